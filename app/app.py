@@ -1,16 +1,23 @@
+import os
+import sys
 from flask import Flask, render_template, request
 from flask.ext import restful
 from flask.ext.restful import abort, reqparse
-import rawes
 import re
 
-from settings import (ES_URL, ES_INDEXES, ES_DOCUMENT_TYPES_PER_INDEX,
-                      ES_DOCUMENT_TYPES, ES_VALIDATION_RESULTS_INDEX)
+from settings import (ES_URL, ES_CLIENT_OPTIONS, ES_INDEXES,
+                      ES_DOCUMENT_TYPES_PER_INDEX, ES_DOCUMENT_TYPES,
+                      ES_VALIDATION_RESULTS_INDEX)
+
+# The Elasticsearch client is shared with the scrapers
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                             'onderwijsscrapers'))
+from onderwijsscrapers.elastic import get_client, ElasticException
 
 app = Flask(__name__)
 api = restful.Api(app)
 
-es = rawes.Elastic(ES_URL)
+es = get_client(ES_URL, **ES_CLIENT_OPTIONS)
 
 def get_alias_from_index(index_name):
     """ The indexes are named as `alias_suffix` """
@@ -360,7 +367,7 @@ class GetDocument(restful.Resource):
  
         try:
             doc = es.get('%s/%s/%s' % (index, doc_type, doc_id))
-        except rawes.elastic_exception.ElasticException, error:
+        except ElasticException, error:
             if error.status_code == 404:
                 abort(404, message='The requested document does not exist')
             else:
@@ -1,4 +1,13 @@
 ES_URL = 'localhost:9200'
+# Size of the pool of keep-alive connections to Elasticsearch (requests
+# wait for a free connection when all are in use), the timeout of a
+# request in seconds, and the number of retries of requests that
+# Elasticsearch rejects with 429 or 503.
+ES_CLIENT_OPTIONS = {
+    'pool_size': 20,
+    'timeout': 10,
+    'max_retries': 2
+}
 ES_INDEXES = set(['duo', 'schoolvo', 'onderwijsinspectie'])
 ES_DOCUMENT_TYPES_PER_INDEX = {
     'duo': set(['vo_school', 'vo_branch', 'vo_board', 'po_school', 'po_branch',
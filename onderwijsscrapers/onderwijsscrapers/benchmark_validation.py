@@ -0,0 +1,110 @@
+#!/usr/bin/python
+
+"""
+Benchmark the validation of exported documents.
+
+Usage (from the directory that contains `scrapy.cfg`)::
+
+    python -m onderwijsscrapers.benchmark_validation <spider name> <directory with exported JSON documents>
+
+for example::
+
+    python -m onderwijsscrapers.benchmark_validation duo_po_branches onderwijsscrapers/export/duo_po_branch
+
+Compares the current `validation.validate` with the previous
+implementation, which serialized every item to JSON (with sorted keys)
+and parsed it again before validating it.
+"""
+import os
+import sys
+import json
+from glob import glob
+from time import time
+
+from colander import Invalid
+
+from onderwijsscrapers.settings import EXPORT_SETTINGS
+from onderwijsscrapers.validation import validate
+
+
+def validate_json_roundtrip(validation_schema, item):
+    """ Validation as it was done before, for comparison. """
+    item_sorted = json.dumps(item, sort_keys=True)
+    item_sorted = json.loads(item_sorted)
+
+    try:
+        validation_schema.deserialize(item_sorted)
+    except Invalid, e:
+        return map(lambda item: dict(field=item[0], message=item[1]),
+                   e.asdict().items())
+    return []
+
+
+def load_items(export_dir):
+    items = []
+    for path in sorted(glob(os.path.join(export_dir, '*.json'))):
+        with open(path) as f:
+            item = json.load(f)
+
+        items.append(encode_strings(item))
+    return items
+
+
+def encode_strings(value):
+    """ Spiders produce UTF-8 encoded byte strings, not unicode. """
+    if isinstance(value, unicode):
+        return value.encode('utf8')
+    if isinstance(value, list):
+        return [encode_strings(v) for v in value]
+    if isinstance(value, dict):
+        return dict((k, encode_strings(v)) for k, v in value.iteritems())
+    return value
+
+
+def benchmark(name, func, items, repeat=3):
+    best = None
+    for i in xrange(repeat):
+        started = time()
+        for item in items:
+            func(item)
+        took = time() - started
+        best = took if best is None else min(best, took)
+
+    print '%-20s %8.3fs  %8.0f items/s' % (name, best, len(items) / best)
+    return best
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print __doc__
+        sys.exit(1)
+
+    spider_name, export_dir = sys.argv[1:]
+    export_settings = EXPORT_SETTINGS[spider_name]
+    items = load_items(export_dir)
+    if not items:
+        print 'No exported documents found in %s' % export_dir
+        sys.exit(1)
+
+    print 'Validating %d items with %s' % (len(items),
+                                          export_settings['schema'].__name__)
+
+    roundtrip_schema = export_settings['schema']()
+    direct_schema = export_settings['schema']()
+
+    # Both implementations should report the same fields
+    for item in items:
+        old_messages = validate_json_roundtrip(roundtrip_schema, item)
+        item, validation = validate(direct_schema, export_settings['index'],
+                                    export_settings['doctype'], None, item)
+        if sorted(old_messages) != validation['messages']:
+            print 'Different messages for %s:' % item.get('meta')
+            print '  json round-trip: %s' % sorted(old_messages)
+            print '  direct:          %s' % validation['messages']
+
+    old = benchmark('json round-trip', lambda item:
+                    validate_json_roundtrip(roundtrip_schema, item), items)
+    new = benchmark('direct', lambda item:
+                    validate(direct_schema, export_settings['index'],
+                             export_settings['doctype'], None, item), items)
+    print 'Speedup: %.2fx' % (old / new)
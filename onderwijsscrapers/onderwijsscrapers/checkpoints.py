@@ -0,0 +1,166 @@
+import os
+import shutil
+import sqlite3
+import threading
+
+from scrapy import log
+from scrapy.http import Request
+
+
+class Checkpoint(object):
+    """
+    The progress of a crawl, saved to disk so that a crawl that died
+    (e.g. while geocoding, or during an Elasticsearch outage) can be
+    resumed instead of starting over.
+
+    A checkpoint keeps track of the datasets whose items have all been
+    merged, the items that were exported per export stage, and the
+    export stages that are complete. The item stores of the pipeline are
+    kept in the same directory (see `store_options`), and are committed
+    together with the progress.
+
+    The checkpoint is removed when a crawl completes. When `resume` is
+    False, the checkpoint of a previous crawl is discarded.
+
+    A checkpoint can be shared by threads (the export methods run
+    concurrently).
+    """
+    def __init__(self, checkpoint_dir, spider_name, resume=False,
+                 interval=1000):
+        self.path = os.path.join(checkpoint_dir, spider_name)
+        self.interval = interval
+        self.stores = []
+
+        if os.path.exists(self.path) and not resume:
+            shutil.rmtree(self.path)
+
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        elif resume:
+            log.msg('Resuming crawl from checkpoint %s' % self.path,
+                    level=log.INFO)
+
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(os.path.join(self.path, 'progress.sqlite'),
+                                  check_same_thread=False)
+        self.db.text_factory = str
+        self.db.execute('CREATE TABLE IF NOT EXISTS crawl '
+                        '(key TEXT PRIMARY KEY, value TEXT)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS datasets '
+                        '(dataset TEXT PRIMARY KEY)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS stages '
+                        '(stage TEXT PRIMARY KEY)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS exported '
+                        '(stage TEXT, item_id TEXT, PRIMARY KEY (stage, item_id))')
+        self.db.commit()
+
+    def store_options(self):
+        """ Options for a `SQLiteItemStore` that is kept in the checkpoint. """
+        return {'store_dir': self.path, 'keep': True}
+
+    def add_store(self, store):
+        """ Commit `store` whenever progress is saved. """
+        self.stores.append(store)
+
+    def commit(self):
+        with self.lock:
+            for store in self.stores:
+                store.commit()
+            self.db.commit()
+
+    def crawl_started_at(self, started_at):
+        """
+        Return the start time of the crawl that is checkpointed, which is
+        `started_at` unless an earlier crawl is resumed.
+        """
+        with self.lock:
+            self.db.execute('INSERT OR IGNORE INTO crawl VALUES (?, ?)',
+                            ('started_at', started_at))
+            self.db.commit()
+            return self.db.execute('SELECT value FROM crawl WHERE key = ?',
+                                   ('started_at',)).fetchone()[0]
+
+    def dataset_done(self, dataset):
+        with self.lock:
+            return self.db.execute('SELECT 1 FROM datasets WHERE dataset = ?',
+                                   (dataset,)).fetchone() is not None
+
+    def complete_dataset(self, dataset):
+        """ Save that all items of `dataset` have been merged. """
+        with self.lock:
+            self.db.execute('INSERT OR IGNORE INTO datasets VALUES (?)',
+                            (dataset,))
+            self.commit()
+
+    def track_dataset(self, dataset, callback):
+        """
+        Wrap a spider callback, so `dataset` is completed once all items
+        produced by the callback have been processed. The callbacks of
+        the requests it produces (e.g. for the files of the dataset) are
+        tracked as well, so the dataset is completed once the last of
+        them is done. If a request fails, the dataset is not completed.
+        """
+        pending = [0]
+
+        def track(callback):
+            pending[0] += 1
+
+            def tracked_callback(response):
+                for result in callback(response) or []:
+                    if isinstance(result, Request) and result.callback:
+                        result = result.replace(callback=track(result.callback))
+                    yield result
+
+                pending[0] -= 1
+                if not pending[0]:
+                    self.complete_dataset(dataset)
+            return tracked_callback
+
+        return track(callback)
+
+    def stage_done(self, stage):
+        with self.lock:
+            return self.db.execute('SELECT 1 FROM stages WHERE stage = ?',
+                                   (stage,)).fetchone() is not None
+
+    def complete_stage(self, stage):
+        with self.lock:
+            self.db.execute('INSERT OR IGNORE INTO stages VALUES (?)',
+                            (stage,))
+            self.commit()
+
+    def is_exported(self, stage, item_id):
+        with self.lock:
+            return self.db.execute('SELECT 1 FROM exported WHERE stage = ? '
+                                   'AND item_id = ?',
+                                   (stage, item_id)).fetchone() is not None
+
+    def mark_exported(self, stage, item_ids):
+        with self.lock:
+            self.db.executemany('INSERT OR IGNORE INTO exported VALUES (?, ?)',
+                                [(stage, item_id) for item_id in item_ids])
+            self.db.commit()
+
+    def remove(self):
+        """ Remove the checkpoint once the crawl is complete. """
+        self.db.close()
+        shutil.rmtree(self.path)
+
+
+checkpoints = {}
+
+
+def get_checkpoint(spider_name, settings):
+    """
+    Return the checkpoint of the crawl of `spider_name`, shared by the
+    spider and the pipeline, or None if `CHECKPOINT_DIR` is not set.
+    """
+    if not settings['CHECKPOINT_DIR']:
+        return None
+
+    if spider_name not in checkpoints:
+        checkpoints[spider_name] = Checkpoint(
+            settings['CHECKPOINT_DIR'], spider_name,
+            resume=settings.getbool('RESUME'),
+            interval=settings.getint('CHECKPOINT_INTERVAL'))
+    return checkpoints[spider_name]
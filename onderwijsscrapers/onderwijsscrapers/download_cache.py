@@ -0,0 +1,151 @@
+import os
+import json
+from hashlib import sha1
+from time import time
+
+from scrapy import log
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+
+
+class DownloadCache(object):
+    """
+    Disk cache of downloaded files (e.g. the DUO datasets), keyed by URL.
+
+    The body of every response is kept in `<sha1 of url>.body`, next to a
+    `.json` file with the URL, content type and the `ETag` and
+    `Last-Modified` headers. When a file is requested again, it is
+    revalidated with a conditional GET, so files that did not change are
+    not downloaded again. In `offline` mode, files are only served from
+    the cache. Requests of spiders use the cache through
+    `DownloadCacheMiddleware`.
+    """
+    def __init__(self, cache_dir, offline=False):
+        self.cache_dir = cache_dir
+        self.offline = offline
+
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    def path(self, url, extension):
+        return os.path.join(self.cache_dir, '%s.%s' % (sha1(url).hexdigest(),
+                                                       extension))
+
+    def lookup(self, url):
+        """ Metadata of the cached response for `url`, or None. """
+        path = self.path(url, 'json')
+        if not os.path.exists(path) or not os.path.exists(self.path(url,
+                                                                    'body')):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def conditional_headers(self, entry):
+        """ Request headers to revalidate a cached response. """
+        headers = {}
+        if entry is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def read_body(self, url):
+        with open(self.path(url, 'body'), 'rb') as f:
+            return f.read()
+
+    def store(self, url, body, headers):
+        """
+        Cache the `body` of a (200) response to `url`; `headers` is a
+        mapping with the response headers.
+        """
+        entry = {
+            'url': url,
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'content_type': headers.get('Content-Type'),
+            'stored_at': time()
+        }
+
+        # Write to temporary files first, so an interrupted download does
+        # not leave a truncated file in the cache
+        for extension, data in [('body', body), ('json', json.dumps(entry))]:
+            path = self.path(url, extension)
+            with open('%s.tmp' % path, 'wb') as f:
+                f.write(data)
+            os.rename('%s.tmp' % path, path)
+
+
+download_caches = {}
+
+
+def get_download_cache(settings):
+    """
+    Return the download cache in `DOWNLOAD_CACHE_DIR`, or None if it is
+    not set.
+    """
+    cache_dir = settings['DOWNLOAD_CACHE_DIR']
+    if not cache_dir:
+        return None
+
+    if cache_dir not in download_caches:
+        download_caches[cache_dir] = DownloadCache(
+            cache_dir, offline=settings.getbool('DOWNLOAD_CACHE_OFFLINE'))
+    return download_caches[cache_dir]
+
+
+class DownloadCacheMiddleware(object):
+    """
+    Downloader middleware that passes the GET requests of spiders through
+    the download cache. Requests for files that are not in the cache are
+    ignored in offline mode.
+    """
+    def __init__(self, settings):
+        self.cache = get_download_cache(settings)
+        if self.cache is None:
+            raise NotConfigured
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings)
+
+    def cached_response(self, request, entry):
+        headers = Headers()
+        if entry.get('content_type'):
+            headers['Content-Type'] = entry['content_type']
+        body = self.cache.read_body(request.url)
+        respcls = responsetypes.from_args(headers=headers, url=request.url,
+                                          body=body)
+        return respcls(url=request.url, headers=headers, body=body,
+                       flags=['cached'])
+
+    def process_request(self, request, spider):
+        if request.method != 'GET':
+            return None
+
+        entry = self.cache.lookup(request.url)
+        if self.cache.offline:
+            if entry is None:
+                raise IgnoreRequest('%s is not in the download cache'
+                                    % request.url)
+            return self.cached_response(request, entry)
+
+        for header, value in self.cache.conditional_headers(entry).items():
+            request.headers.setdefault(header, value)
+        return None
+
+    def process_response(self, request, response, spider):
+        if request.method != 'GET' or 'cached' in response.flags:
+            return response
+
+        if response.status == 304:
+            entry = self.cache.lookup(request.url)
+            if entry is not None:
+                log.msg('Not modified: %s' % request.url, level=log.DEBUG,
+                        spider=spider)
+                return self.cached_response(request, entry)
+
+        if response.status == 200:
+            self.cache.store(request.url, response.body, response.headers)
+        return response
@@ -0,0 +1,101 @@
+"""
+Elasticsearch client shared by the exporters and the API (`app/app.py`).
+
+This module only depends on rawes and requests, so the API can use it
+without Scrapy being installed.
+"""
+import random
+import threading
+from time import sleep
+
+import rawes
+from rawes.elastic_exception import ElasticException
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError
+
+
+class Elastic(rawes.Elastic):
+    """
+    A `rawes.Elastic` client with a bounded pool of keep-alive connections
+    per host. Threads share the pool; when `pool_size` requests to a host
+    are in progress, other threads wait for a connection to be returned.
+
+    `timeout` is the default timeout of a request in seconds, which can be
+    overridden per request (e.g. `es.get(path, timeout=5)`). Requests that
+    Elasticsearch rejects because it is overloaded (429 or 503), and
+    requests that could not connect, are retried up to `max_retries`
+    times. The delay before a retry is random, up to `retry_delay` doubled
+    for every attempt (at most `max_retry_delay`), so that clients that
+    were rejected at the same time do not retry at the same time.
+    """
+    RETRY_STATUS_CODES = (429, 503)
+
+    def __init__(self, url='localhost:9200', timeout=30, pool_size=10,
+                 max_retries=3, retry_delay=0.5, max_retry_delay=30,
+                 connection_pool=None, **kwargs):
+        super(Elastic, self).__init__(url, timeout=timeout,
+                                      connection_pool=connection_pool,
+                                      **kwargs)
+
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+
+        # Clients for subpaths (`es.duo`, `es['duo']`) share the
+        # connections of the client they were created from
+        if connection_pool is None:
+            for connection in self.connection_pool.connections:
+                session = getattr(connection, 'session', None)
+                if session is None:
+                    continue
+                adapter = HTTPAdapter(pool_connections=1,
+                                      pool_maxsize=pool_size, pool_block=True)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+
+    def request(self, method, path, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                return super(Elastic, self).request(method, path, **kwargs)
+            except ElasticException, e:
+                if e.status_code not in self.RETRY_STATUS_CODES or\
+                        attempt >= self.max_retries:
+                    raise
+            except ConnectionError:
+                if attempt >= self.max_retries:
+                    raise
+
+            attempt += 1
+            sleep(self.backoff(attempt))
+
+    def backoff(self, attempt):
+        """ Random delay in seconds before retry number `attempt`. """
+        return random.uniform(0, min(self.max_retry_delay,
+                                     self.retry_delay * 2 ** (attempt - 1)))
+
+    def __getitem__(self, path_item):
+        return Elastic(path=self._build_path(self.path, path_item),
+                       timeout=self.timeout, pool_size=self.pool_size,
+                       max_retries=self.max_retries,
+                       retry_delay=self.retry_delay,
+                       max_retry_delay=self.max_retry_delay,
+                       connection_pool=self.connection_pool)
+
+
+clients = {}
+clients_lock = threading.Lock()
+
+
+def get_client(url, **options):
+    """
+    Return the client for `url` with `options` (see `Elastic`), which is
+    created once per process and shared by everything that uses the same
+    Elasticsearch.
+    """
+    key = (str(url), tuple(sorted(options.items())))
+    with clients_lock:
+        if key not in clients:
+            clients[key] = Elastic(url, **options)
+        return clients[key]
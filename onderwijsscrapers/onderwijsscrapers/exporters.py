@@ -1,51 +1,496 @@
 import os
+import re
 import json
 import string
 import tarfile
+import cStringIO
+import zlib
+from datetime import date, datetime
+from time import sleep, time
 from uuid import uuid1
 
+import colander
 import rawes
+from scrapy import log
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from onderwijsscrapers.elastic import get_client
+from onderwijsscrapers.instrumentation import Histogram
+
+
+def encode(item):
+    """
+    Serialize an item to compact JSON with sorted keys. The pipeline
+    encodes every item once and passes the result to the `save` method
+    of all exporters as `data`.
+    """
+    return json.dumps(item, sort_keys=True)
 
 
 class Exporter(object):
+    """
+    Exporters implement `save(item, doc_id=None, data=None)`, where
+    `data` (if given) is `encode(item)`. Exporters that write JSON should
+    use `data` instead of serializing the item again. Items are only
+    encoded when `uses_data` is true for one of the exporters. An exporter
+    only reads the items it gets, as the same item is passed to several
+    exporters (running in different threads) at once.
+
+    Exporters that can remove documents they exported before implement
+    `delete(doc_id)`, and return True from `can_delete` for the options
+    with which they can; only these can be used for incremental exports.
+    """
     def __init__(self, crawl_started_at, index, doctype):
         self.crawl_started_at = crawl_started_at
         self.index = index
         self.doctype = doctype
 
+    @classmethod
+    def uses_data(cls, options):
+        """
+        Whether an exporter with these options writes the shared encoding
+        of the items it gets as `data`.
+        """
+        return True
+
+    @classmethod
+    def can_delete(cls, options):
+        """
+        Whether an exporter with these options can remove the documents
+        it exported before, so that it can be used for incremental exports.
+        """
+        return False
+
+    def delete(self, doc_id):
+        raise NotImplementedError
+
     def close(self):
         pass
 
+    @classmethod
+    def close_all(cls, exporters):
+        """
+        Close `exporters`, which exported the doctypes of the same index
+        one after the other (e.g. the export names of `duo_all`).
+        """
+        for exporter in exporters:
+            exporter.close()
+
+
+class ReindexError(Exception):
+    pass
+
+
+def is_transient(status, error):
+    """
+    Whether a request (or bulk item) that failed with `status` and `error`
+    may succeed when it is retried: Elasticsearch was overloaded or
+    unavailable, or rejected it as its queue was full.
+    """
+    if status == 429 or status >= 500:
+        return True
+    if isinstance(error, dict):
+        error = error.get('type', '')
+    # Before Elasticsearch 2.0, errors are strings
+    error = repr(error)
+    return 'es_rejected_execution' in error or 'EsRejectedExecution' in error
+
 
 class ElasticSearchExporter(Exporter):
-    def __init__(self, crawl_started_at, index, doctype, url, index_suffix=None):
+    """
+    Export documents to Elasticsearch.
+
+    By default every document is indexed with a separate PUT request.
+    When `bulk_size` is set, documents are buffered and sent to the
+    `_bulk` API as soon as the buffer holds `bulk_size` documents or
+    `bulk_max_bytes` bytes of NDJSON. Items that Elasticsearch rejects
+    because it is overloaded are retried (up to `bulk_max_retries` times,
+    with an increasing delay); items that fail otherwise, or still fail,
+    are logged and kept in `self.failed`.
+    Deletions are buffered in the same way.
+
+    The latencies of all requests to Elasticsearch are counted in
+    `self.request_latency`. Exporters share a pooled client per `url`,
+    configured with `client_options` (see `elastic.Elastic`).
+
+    With `versioned`, every crawl is loaded into a new index named
+    `<index>_<crawl started at>`, while `index` is an alias of the live
+    version, which keeps serving searches. The new version is created with
+    the mapping file of the index in `mappings` (a dict of index names to
+    paths), refreshing disabled and no replicas, and is loaded with the
+    `_bulk` API. When the exporter is closed, the documents of the live
+    version that were not (re)exported are copied into the new version
+    (these are the other doctypes of the index, and the unchanged
+    documents of an incremental export). Then refreshing and `replicas`
+    are restored, the alias is swapped to the new version in one atomic
+    request, and all but the `keep_versions` most recent previous versions
+    are removed. Loads of the same index should not overlap, as the last
+    swap wins; exporters that load several doctypes of an index in the
+    same crawl publish its new version once (see `close_all`).
+    """
+
+    def __init__(self, crawl_started_at, index, doctype, url, index_suffix=None,
+                 bulk_size=None, bulk_max_bytes=5 * 1024 * 1024,
+                 bulk_max_retries=3, bulk_retry_delay=1, versioned=False,
+                 mappings=None, replicas=1, keep_versions=1,
+                 client_options=None):
         super(ElasticSearchExporter, self).__init__(crawl_started_at, index,
             doctype)
 
         self.url = url
-        self.es = rawes.Elastic(self.url)
+        self.es = get_client(self.url, **(client_options or {}))
         self.index_suffix = index_suffix
 
-    def save(self, item, doc_id=None):
+        self.versioned = versioned
+        self.mappings = mappings or {}
+        self.replicas = replicas
+        self.keep_versions = keep_versions
+        self.deleted = set()
+        if self.versioned:
+            self.index_suffix = crawl_started_at.translate(
+                string.maketrans('', ''), '-:')
+            # A new version is always loaded in bulk
+            bulk_size = bulk_size or 500
+
+        self.bulk_size = bulk_size
+        self.bulk_max_bytes = bulk_max_bytes
+        self.bulk_max_retries = bulk_max_retries
+        self.bulk_retry_delay = bulk_retry_delay
+
+        # List of (action, source) NDJSON lines waiting to be sent; the
+        # source of a delete action is None
+        self.buffer = []
+        self.buffer_bytes = 0
+        self.failed = []
+        self.request_latency = Histogram()
+
+        if self.versioned:
+            self.create_version()
+
+    @classmethod
+    def can_delete(cls, options):
+        return True
+
+    @property
+    def index_name(self):
         if self.index_suffix is not None:
-            suffix = '_' + self.index_suffix
-        else:
-            suffix = ''
+            return '%s_%s' % (self.index, self.index_suffix)
+        return self.index
 
-        if doc_id:
-            url = '%s%s/%s/%s' % (self.index, suffix, self.doctype, doc_id)
-        else:
-            url = '%s%s/%s/%s' % (self.index, suffix, self.doctype, uuid1())
+    def exists(self, name):
+        """ Whether an index or alias called `name` exists. """
+        try:
+            return self.es.head(name)
+        except rawes.elastic_exception.ElasticException, e:
+            if e.status_code == 404:
+                return False
+            raise
+
+    def create_version(self):
+        """
+        Create the index of the new version, unless it already exists (when
+        an interrupted crawl is resumed, its version is loaded further).
+        """
+        if self.exists(self.index_name):
+            log.msg('Continuing to load %s' % self.index_name, level=log.INFO)
+            return
+
+        body = {}
+        if self.index in self.mappings:
+            with open(self.mappings[self.index]) as f:
+                body = json.load(f)
+
+        # Bulk loading is much faster without refreshes and replication
+        body.setdefault('settings', {}).setdefault('index', {}).update({
+            'refresh_interval': '-1',
+            'number_of_replicas': 0
+        })
+        self.es.put(self.index_name, data=body)
+        log.msg('Created index %s' % self.index_name, level=log.INFO)
+
+    def save(self, item, doc_id=None, data=None):
+        if not doc_id:
+            doc_id = uuid1()
+
+        source = data if data is not None else encode(item)
+
+        if not self.bulk_size:
+            started = time()
+            self.es.put('%s/%s/%s' % (self.index_name, self.doctype, doc_id),
+                        data=source)
+            self.request_latency.add(time() - started)
+            return
+
+        self.buffer_action({'index': {'_id': str(doc_id)}}, source)
+
+    def delete(self, doc_id):
+        if self.versioned:
+            # The document is not in the new version yet, so it only has
+            # to be left out when the live version is copied
+            self.deleted.add((self.doctype, str(doc_id)))
+            return
+
+        if not self.bulk_size:
+            started = time()
+            try:
+                self.es.delete('%s/%s/%s' % (self.index_name, self.doctype,
+                                             doc_id))
+            except rawes.elastic_exception.ElasticException, e:
+                # The document is already gone
+                if e.status_code != 404:
+                    raise
+            finally:
+                self.request_latency.add(time() - started)
+            return
+
+        self.buffer_action({'delete': {'_id': str(doc_id)}})
+
+    def buffer_action(self, action, source=None):
+        action = json.dumps(action)
+        self.buffer.append((action, source))
+        self.buffer_bytes += len(action) + len(source or '') + 2
+
+        if len(self.buffer) >= self.bulk_size or\
+                self.buffer_bytes >= self.bulk_max_bytes:
+            self.flush()
 
-        self.es.put(url, data=json.dumps(item, sort_keys=True))
+    def flush(self):
+        """
+        Send all buffered documents to the `_bulk` endpoint. Only the
+        items that failed because Elasticsearch was overloaded are resent
+        on a retry; other failures (e.g. a document that does not match
+        the mapping) would fail again.
+        """
+        pending = self.buffer
+        self.buffer = []
+        self.buffer_bytes = 0
+
+        attempt = 0
+        while pending:
+            retry = []
+            for line_pair, error, transient in self._send_bulk(pending):
+                if transient and attempt < self.bulk_max_retries:
+                    retry.append(line_pair)
+                    continue
+
+                action, metadata = json.loads(line_pair[0]).items()[0]
+                doc_id = metadata['_id']
+                log.msg('Failed to %s %s in %s/%s: %s'
+                        % (action, doc_id, self.index_name, self.doctype,
+                           error), level=log.ERROR)
+                self.failed.append((doc_id, error))
+
+            if not retry:
+                return
+
+            attempt += 1
+            log.msg('Retrying %d of %d failed bulk items (attempt %d)'
+                    % (len(retry), len(pending), attempt), level=log.WARNING)
+            sleep(self.bulk_retry_delay * attempt)
+            pending = retry
+
+    def _send_bulk(self, pending):
+        """
+        Send one `_bulk` request and return a list of
+        `((action, source), error, transient)` tuples for the items that
+        failed, where `transient` tells if the item can be retried.
+        """
+        lines = []
+        for action, source in pending:
+            lines.append(action)
+            if source is not None:
+                lines.append(source)
+        body = '\n'.join(lines) + '\n'
+
+        started = time()
+        try:
+            result = self.es.post('%s/%s/_bulk' % (self.index_name,
+                                                   self.doctype), data=body)
+        except rawes.elastic_exception.ElasticException, e:
+            # The request as a whole was rejected (e.g. 429 or 503), so
+            # every item in it failed
+            transient = is_transient(e.status_code, e.result)
+            return [(line_pair, e.result, transient) for line_pair in pending]
+        finally:
+            self.request_latency.add(time() - started)
+
+        if not result.get('errors'):
+            return []
+
+        failed = []
+        for line_pair, item_result in zip(pending, result['items']):
+            action, item_result = item_result.items()[0]
+            status = item_result.get('status', 200)
+            # Deleting a document that does not exist is not an error
+            if action == 'delete' and status == 404:
+                continue
+            # Neither is creating a document that was already exported to
+            # a new version (see `copy_live_version`)
+            if action == 'create' and status == 409:
+                continue
+            if status >= 300 or 'error' in item_result:
+                error = item_result.get('error')
+                failed.append((line_pair, error, is_transient(status, error)))
+
+        return failed
+
+    def copy_live_version(self):
+        """
+        Copy the documents of the live version that are not in the new
+        version into it, except the ones that were deleted. Documents are
+        copied with `create` actions, so documents that were exported
+        (also before a resumed crawl was interrupted) are not overwritten.
+        """
+        if not self.exists(self.index):
+            return 0
+
+        result = self.es.get('%s/_search' % self.index, params={
+            'search_type': 'scan',
+            'scroll': '5m',
+            'size': self.bulk_size
+        }, data={'query': {'match_all': {}}})
+
+        copied = 0
+        while True:
+            result = self.es.get('_search/scroll', params={'scroll': '5m'},
+                                 data=result['_scroll_id'])
+            hits = result['hits']['hits']
+            if not hits:
+                break
+
+            for hit in hits:
+                if (hit['_type'], hit['_id']) in self.deleted:
+                    continue
+                self.buffer_action({'create': {'_id': hit['_id'],
+                                               '_type': hit['_type']}},
+                                   json.dumps(hit['_source'], sort_keys=True))
+                copied += 1
+
+        if self.buffer:
+            self.flush()
+        return copied
+
+    def versions(self):
+        """
+        Names of all versions of the index, oldest first, and the names of
+        the indices the alias points to.
+        """
+        pattern = re.compile(r'^%s_\d{8}T\d{6}Z$' % re.escape(self.index))
+        indices = self.es.get('_aliases')
+
+        versions = sorted(name for name in indices if pattern.match(name))
+        live = [name for name, properties in indices.iteritems()
+                if self.index in properties.get('aliases', {})]
+        return versions, live
+
+    def publish_version(self):
+        """
+        Make the new version searchable and point the alias to it. An
+        index that has the name of the alias (from before versioning) is
+        removed first, so there is a short gap during that first swap.
+        """
+        failed = len(self.failed)
+        copied = self.copy_live_version()
+        if len(self.failed) > failed:
+            raise ReindexError('Failed to copy %d documents into %s, the '
+                               'alias %s still points to the previous '
+                               'version' % (len(self.failed) - failed,
+                                            self.index_name, self.index))
+
+        self.es.put('%s/_settings' % self.index_name, data={'index': {
+            'refresh_interval': '1s',
+            'number_of_replicas': self.replicas
+        }})
+        self.es.post('%s/_refresh' % self.index_name)
+
+        versions, live = self.versions()
+        if not live and self.exists(self.index):
+            log.msg('Replacing index %s by an alias' % self.index,
+                    level=log.WARNING)
+            self.es.delete(self.index)
+
+        actions = [{'remove': {'index': name, 'alias': self.index}}
+                   for name in live if name != self.index_name]
+        actions.append({'add': {'index': self.index_name,
+                                'alias': self.index}})
+        self.es.post('_aliases', data={'actions': actions})
+
+        log.msg('Alias %s points to %s (copied %d documents from the '
+                'previous version)' % (self.index, self.index_name, copied),
+                level=log.INFO)
+
+    def remove_old_versions(self):
+        versions, live = self.versions()
+        previous = [name for name in versions if name < self.index_name
+                    and name not in live]
+        if self.keep_versions:
+            previous = previous[:-self.keep_versions]
+
+        for name in previous:
+            self.es.delete(name)
+            log.msg('Removed old version %s' % name, level=log.INFO)
+
+    def close(self):
+        if self.buffer:
+            self.flush()
+
+        if self.versioned:
+            self.publish_version()
+            self.remove_old_versions()
+
+    @classmethod
+    def close_all(cls, exporters):
+        """
+        The new version of a versioned index is published once, after all
+        doctypes are loaded, by the exporter of the last one. The documents
+        that any of the exporters deleted are left out of the copy of the
+        live version.
+        """
+        if not exporters or not exporters[-1].versioned:
+            return super(ElasticSearchExporter, cls).close_all(exporters)
+
+        publisher = exporters[-1]
+        for exporter in exporters[:-1]:
+            if exporter.buffer:
+                exporter.flush()
+            publisher.deleted.update(exporter.deleted)
+        publisher.close()
 
 
 class FileExporter(Exporter):
+    """
+    Export every document as a JSON file to `<export_dir>/<index>_<doctype>`
+    and/or into a gzipped tarball in `export_dir` (when `create_tar` is set).
+
+    Documents are serialized once and written straight into the tar
+    stream. With `remove_json`, only the tarball is created and no loose
+    JSON files are written.
+
+    Documents are pretty printed with `indent` spaces. With `indent` set
+    to None, they are written compactly, reusing the encoding that is
+    shared with the other export methods.
+
+    Only the JSON files can be updated incrementally: every crawl writes a
+    new tarball, which would only hold the new and changed documents.
+    """
+
     def __init__(self, crawl_started_at, index, doctype, export_dir,
-                 remove_json, create_tar):
+                 remove_json, create_tar, indent=4):
         super(FileExporter, self).__init__(crawl_started_at, index,
             doctype)
 
+        self.indent = indent
+
         self.create_tar = create_tar
         if self.create_tar:
             stared_at_f = crawl_started_at.translate(string.maketrans('', ''),
@@ -54,25 +499,447 @@ class FileExporter(Exporter):
             self.tar = tarfile.open(os.path.join(export_dir, tar_name),
                 'w:gz')
 
+        # Without a tarball, the JSON files are the only output
+        self.write_json = not (remove_json and create_tar)
+
         self.export_dir = os.path.join(export_dir, '%s_%s' % (index, doctype))
 
-        if not os.path.exists(self.export_dir):
+        if self.write_json and not os.path.exists(self.export_dir):
             os.makedirs(self.export_dir)
 
-    def save(self, item, doc_id=None):
+    @classmethod
+    def uses_data(cls, options):
+        # Pretty printed documents are serialized by the exporter itself
+        return options.get('indent', 4) is None
+
+    @classmethod
+    def can_delete(cls, options):
+        return not options.get('create_tar')
+
+    def save(self, item, doc_id=None, data=None):
         if doc_id:
             f_name = '%s.json' % doc_id
         else:
             f_name = '%s.json' % uuid1()
 
-        f_path = os.path.join(self.export_dir, f_name)
-        f = open(f_path, 'w')
-        json.dump(item, f, indent=4, separators=(',', ': '), sort_keys=True)
-        f.close()
+        if self.indent is not None:
+            data = json.dumps(item, indent=self.indent,
+                              separators=(',', ': '), sort_keys=True)
+        elif data is None:
+            data = encode(item)
+
+        if self.write_json:
+            with open(os.path.join(self.export_dir, f_name), 'w') as f:
+                f.write(data)
 
         if self.create_tar:
-            self.tar.add(f_path, arcname=f_name)
+            tar_info = tarfile.TarInfo(f_name)
+            tar_info.size = len(data)
+            tar_info.mtime = time()
+            self.tar.addfile(tar_info, cStringIO.StringIO(data))
+
+    def delete(self, doc_id):
+        f_path = os.path.join(self.export_dir, '%s.json' % doc_id)
+        if self.write_json and os.path.exists(f_path):
+            os.remove(f_path)
 
     def close(self):
         if self.create_tar:
             self.tar.close()
+
+
+class NDJSONExporter(Exporter):
+    """
+    Export all documents of an index/doctype as newline delimited JSON
+    (one document per line) to
+    `<export_dir>/<index>_<doctype>_<crawl started at>.ndjson[.gz|.zst]`.
+
+    `compression` is 'gzip', 'zstd' (requires the `zstandard` package)
+    or None. With `shards` > 1, documents are divided over that many
+    files by document id (`..._<shard>of<shards>.ndjson.gz`), so they
+    can be read in parallel.
+
+    Documents are compressed in blocks of about `block_size` bytes, each
+    of which is a separate gzip member or zstd frame; concatenated, these
+    form a regular gzip or zstd file. The `.index.tsv` sidecar lists, per
+    document, its file, the byte offset of its block in that file, and
+    the offset and length of the document in the decompressed block. A
+    single document can be read by seeking to its block and
+    decompressing only that block.
+    """
+    EXTENSIONS = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+
+    def __init__(self, crawl_started_at, index, doctype, export_dir,
+                 compression='gzip', shards=1, block_size=64 * 1024,
+                 compression_level=6):
+        super(NDJSONExporter, self).__init__(crawl_started_at, index,
+                                             doctype)
+
+        if compression not in self.EXTENSIONS:
+            raise ValueError('Unknown compression %r' % compression)
+        if compression == 'zstd' and zstandard is None:
+            raise ValueError('The zstandard package is required for zstd '
+                             'compression')
+
+        self.compression = compression
+        self.compression_level = compression_level
+        self.block_size = block_size
+        self.shards = shards
+
+        if not os.path.exists(export_dir):
+            os.makedirs(export_dir)
+
+        started_at_f = crawl_started_at.translate(string.maketrans('', ''),
+                                                  '-:')
+        name = '%s_%s_%s' % (index, doctype, started_at_f)
+
+        self.file_names = []
+        for shard in xrange(shards):
+            file_name = name
+            if shards > 1:
+                file_name += '_%dof%d' % (shard + 1, shards)
+            self.file_names.append('%s.ndjson%s'
+                                   % (file_name, self.EXTENSIONS[compression]))
+
+        self.files = [open(os.path.join(export_dir, file_name), 'wb')
+                      for file_name in self.file_names]
+        # The uncompressed documents of the current block of each shard,
+        # and their (doc_id, offset, length) index entries
+        self.blocks = [cStringIO.StringIO() for shard in xrange(shards)]
+        self.block_entries = [[] for shard in xrange(shards)]
+
+        self.index_file = open(os.path.join(export_dir,
+                                            '%s.index.tsv' % name), 'w')
+        self.index_file.write('doc_id\tfile\tblock_offset\toffset\tlength\n')
+
+    def save(self, item, doc_id=None, data=None):
+        if not doc_id:
+            doc_id = uuid1()
+        doc_id = str(doc_id)
+
+        line = (data if data is not None else encode(item)) + '\n'
+
+        shard = zlib.crc32(doc_id) % self.shards
+        block = self.blocks[shard]
+        self.block_entries[shard].append((doc_id, block.tell(), len(line)))
+        block.write(line)
+
+        if block.tell() >= self.block_size:
+            self.flush_block(shard)
+
+    def compress(self, data):
+        if self.compression == 'gzip':
+            # A complete gzip member (wbits 16 + 15 adds the gzip header)
+            compressor = zlib.compressobj(self.compression_level,
+                                          zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            return compressor.compress(data) + compressor.flush()
+        elif self.compression == 'zstd':
+            return zstandard.ZstdCompressor(level=self.compression_level)\
+                .compress(data)
+        return data
+
+    def flush_block(self, shard):
+        """ Compress and write the current block of a shard. """
+        data = self.blocks[shard].getvalue()
+        if not data:
+            return
+
+        f = self.files[shard]
+        block_offset = f.tell()
+        f.write(self.compress(data))
+
+        for doc_id, offset, length in self.block_entries[shard]:
+            self.index_file.write('%s\t%s\t%d\t%d\t%d\n' % (
+                doc_id, self.file_names[shard], block_offset, offset, length))
+
+        self.blocks[shard] = cStringIO.StringIO()
+        self.block_entries[shard] = []
+
+    def close(self):
+        for shard in xrange(self.shards):
+            self.flush_block(shard)
+            self.files[shard].close()
+        self.index_file.close()
+
+
+def to_unicode(value):
+    if isinstance(value, str):
+        return value.decode('utf-8', 'replace')
+    return unicode(value)
+
+
+def to_date(value):
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(str(value)[:10], '%Y-%m-%d').date()
+
+
+def to_bool(value):
+    if isinstance(value, bool):
+        return value
+    raise ValueError(value)
+
+
+def to_json(value):
+    return json.dumps(value, sort_keys=True).decode('utf-8')
+
+
+def decode_bytes(value):
+    """ Keep `value`, but as unicode if it is a (UTF-8) byte string. """
+    if isinstance(value, str):
+        return value.decode('utf-8', 'replace')
+    return value
+
+
+class ColumnarTable(object):
+    """
+    The rows of one table of a `ColumnarExporter`, which are written to
+    the file in row groups of `row_group_size` rows. The first column,
+    `_id`, holds the id of the document each row belongs to.
+
+    `columns` is a list of `(name, path, arrow type, converter)` tuples;
+    `path` is the list of keys under which the value is found in a row.
+    Values that can't be converted to the type of their column are
+    written as null. If `columns` is None, the columns are derived from
+    the rows (nested mappings become dotted columns, lists JSON strings),
+    and their types are inferred when the table is closed.
+    """
+    def __init__(self, path, columns, file_format, row_group_size):
+        self.path = path
+        self.columns = columns
+        self.file_format = file_format
+        self.row_group_size = row_group_size
+
+        self.ids = []
+        self.rows = []
+        self.writer = None
+
+    def append(self, doc_id, row):
+        self.ids.append(doc_id)
+        self.rows.append(row)
+        if self.columns is not None and len(self.rows) >= self.row_group_size:
+            self.write()
+
+    def column_values(self, path, converter):
+        values = []
+        for row in self.rows:
+            value = row
+            for key in path:
+                value = value.get(key) if isinstance(value, dict) else None
+
+            if value is not None:
+                try:
+                    value = converter(value)
+                except (TypeError, ValueError):
+                    value = None
+            values.append(value)
+        return values
+
+    def write(self):
+        if not self.rows:
+            return
+
+        arrays = [pyarrow.array(self.ids, type=pyarrow.string())]
+        arrays.extend(pyarrow.array(self.column_values(path, converter),
+                                    type=arrow_type)
+                      for name, path, arrow_type, converter in self.columns)
+        names = ['_id'] + [name for name, path, arrow_type, converter
+                           in self.columns]
+        table = pyarrow.Table.from_arrays(arrays, names=names)
+        if self.writer is None:
+            if self.file_format == 'parquet':
+                self.writer = pyarrow.parquet.ParquetWriter(self.path,
+                                                            table.schema)
+            else:
+                self.writer = pyarrow.RecordBatchFileWriter(self.path,
+                                                            table.schema)
+
+        self.writer.write_table(table)
+        self.ids = []
+        self.rows = []
+
+    def infer_columns(self):
+        """ Derive the columns from the (flattened) keys of the rows. """
+        paths = []
+        for row in self.rows:
+            stack = [((), row)]
+            while stack:
+                prefix, value = stack.pop()
+                for key in sorted(value, reverse=True):
+                    if isinstance(value[key], dict):
+                        stack.append((prefix + (key,), value[key]))
+                    elif prefix + (key,) not in paths:
+                        paths.append(prefix + (key,))
+
+        self.columns = []
+        for path in paths:
+            values = self.column_values(path, decode_bytes)
+            converter = decode_bytes
+            if any(isinstance(value, list) for value in values):
+                converter = to_json
+            else:
+                # Fall back to strings for columns with mixed types
+                try:
+                    pyarrow.array(values)
+                except (pyarrow.ArrowException, TypeError, ValueError):
+                    converter = to_unicode
+            arrow_type = pyarrow.array(self.column_values(path,
+                                                          converter)).type
+            if arrow_type == pyarrow.null():
+                arrow_type = pyarrow.string()
+            self.columns.append(('.'.join(path), list(path), arrow_type,
+                                 converter))
+
+    def close(self):
+        if self.columns is None:
+            self.infer_columns()
+        self.write()
+        if self.writer is not None:
+            self.writer.close()
+
+
+class ColumnarExporter(Exporter):
+    """
+    Export documents to typed columnar files (Parquet or Arrow IPC) for
+    analytical use, e.g. loading them into a dataframe.
+
+    The scalar fields of the documents are written to
+    `<export_dir>/<index>_<doctype>_<crawl started at>.<format>`, with
+    nested mappings (e.g. `address`) flattened into dotted columns
+    (`address.street`). Every sequence (e.g. `students_by_structure`)
+    goes into a separate child table,
+    `<index>_<doctype>_<crawl started at>.<field>.<format>`, with the
+    `position` in the sequence; any sequences within these become JSON
+    string columns. All tables have an `_id` column with the document id.
+
+    The column types are taken from the colander schema of the
+    index/doctype in `EXPORT_SETTINGS`. Without a schema (e.g. for
+    validation documents) the columns and their types are inferred from
+    the documents, which are then kept in memory until the exporter is
+    closed. Requires the pyarrow package.
+    """
+    EXTENSIONS = {'parquet': 'parquet', 'arrow': 'arrow'}
+    ARROW_TYPES = [
+        (colander.String, 'string', to_unicode),
+        (colander.Integer, 'int64', int),
+        (colander.Float, 'float64', float),
+        (colander.Boolean, 'bool_', to_bool),
+        (colander.Date, 'date32', to_date),
+    ]
+
+    def __init__(self, crawl_started_at, index, doctype, export_dir,
+                 file_format='parquet', row_group_size=10000):
+        super(ColumnarExporter, self).__init__(crawl_started_at, index,
+                                               doctype)
+
+        if pyarrow is None:
+            raise ValueError('The pyarrow package is required for columnar '
+                             'exports')
+        if file_format not in self.EXTENSIONS:
+            raise ValueError('Unknown file format %r' % file_format)
+
+        if not os.path.exists(export_dir):
+            os.makedirs(export_dir)
+
+        started_at_f = crawl_started_at.translate(string.maketrans('', ''),
+                                                  '-:')
+        self.path = os.path.join(export_dir, '%s_%s_%s' % (index, doctype,
+                                                           started_at_f))
+        self.file_format = file_format
+        self.row_group_size = row_group_size
+
+        # The main table and the child tables per sequence path
+        self.children = {}
+        schema = self.find_schema(index, doctype)
+        if schema is None:
+            self.table = self.create_table(None, None)
+        else:
+            self.table = self.create_table(None, self.plan(schema))
+
+    @classmethod
+    def uses_data(cls, options):
+        # The documents are converted to columns, not written as JSON
+        return False
+
+    def find_schema(self, index, doctype):
+        # Imported here, as the settings import this module
+        from scrapy.conf import settings
+
+        for export_settings in settings['EXPORT_SETTINGS'].itervalues():
+            if export_settings['index'] == index and\
+                    export_settings['doctype'] == doctype:
+                return export_settings['schema']()
+        return None
+
+    def column_type(self, node):
+        for colander_type, arrow_type, converter in self.ARROW_TYPES:
+            if isinstance(node.typ, colander_type):
+                return getattr(pyarrow, arrow_type)(), converter
+        return pyarrow.string(), to_json
+
+    def plan(self, node, path=(), child_path=()):
+        """
+        Returns the columns of the table for the mapping `node`, and adds
+        a child table for each sequence in it (unless `node` is part of
+        the elements of the child table at `child_path`).
+        """
+        columns = []
+        for child in node.children:
+            field_path = path + (child.name,)
+            if isinstance(child.typ, colander.Mapping):
+                columns.extend(self.plan(child, field_path, child_path))
+            elif isinstance(child.typ, colander.Sequence) and not child_path:
+                self.plan_child(child, field_path)
+            else:
+                # Sequences within child tables become JSON strings
+                arrow_type, converter = self.column_type(child)
+                columns.append(('.'.join(field_path), list(field_path),
+                                arrow_type, converter))
+        return columns
+
+    def plan_child(self, node, path):
+        """ Create the child table for the sequence `node` at `path`. """
+        columns = [('position', ['position'], pyarrow.int32(), int)]
+
+        element = node.children[0]
+        if isinstance(element.typ, colander.Mapping):
+            element_columns = self.plan(element, child_path=path)
+        else:
+            arrow_type, converter = self.column_type(element)
+            element_columns = [('value', [], arrow_type, converter)]
+
+        for name, column_path, arrow_type, converter in element_columns:
+            columns.append((name, ['element'] + column_path, arrow_type,
+                            converter))
+
+        self.children[path] = self.create_table(path, columns)
+
+    def create_table(self, path, columns):
+        name = self.path
+        if path:
+            name += '.' + '.'.join(path)
+        return ColumnarTable('%s.%s' % (name, self.EXTENSIONS[self.file_format]),
+                             columns, self.file_format, self.row_group_size)
+
+    def save(self, item, doc_id=None, data=None):
+        if not doc_id:
+            doc_id = uuid1()
+        doc_id = str(doc_id)
+
+        self.table.append(doc_id, item)
+
+        for path, table in self.children.iteritems():
+            elements = item
+            for key in path:
+                elements = elements.get(key) if isinstance(elements, dict)\
+                    else None
+
+            if isinstance(elements, list):
+                for position, element in enumerate(elements):
+                    table.append(doc_id, {'position': position,
+                                          'element': element})
+
+    def close(self):
+        self.table.close()
+        for table in self.children.itervalues():
+            table.close()
@@ -0,0 +1,171 @@
+"""
+Timings and counters of the stages of a crawl (downloading, merging,
+geocoding, validating and exporting), which are published as Scrapy
+stats and written to a JSON report when the spider closes.
+"""
+import os
+import json
+import resource
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+from time import time
+
+
+class Histogram(object):
+    """
+    Counts latencies (in seconds) in buckets with upper bounds in
+    milliseconds. Can be shared between threads.
+    """
+    BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, seconds):
+        bucket = bisect_left(self.BUCKETS, seconds * 1000)
+        with self.lock:
+            self.counts[bucket] += 1
+            self.count += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+
+    def update(self, other):
+        """ Add the counts of another histogram to this one. """
+        with self.lock:
+            for bucket, count in enumerate(other.counts):
+                self.counts[bucket] += count
+            self.count += other.count
+            self.total += other.total
+            self.max = max(self.max, other.max)
+
+    def buckets(self):
+        """ `(label, count)` pairs of the non-empty buckets. """
+        labels = ['<=%dms' % bound for bound in self.BUCKETS]
+        labels.append('>%dms' % self.BUCKETS[-1])
+        return [(label, count) for label, count in zip(labels, self.counts)
+                if count]
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'mean_ms': self.total / self.count * 1000 if self.count else 0,
+            'max_ms': self.max * 1000,
+            'buckets': OrderedDict(self.buckets())
+        }
+
+
+class Instrumentation(object):
+    """ Cumulative time and item counts per stage, and latency histograms. """
+    def __init__(self):
+        self.stages = OrderedDict()
+        self.histograms = OrderedDict()
+        self.lock = threading.Lock()
+
+    def record(self, stage, seconds, items=0):
+        with self.lock:
+            totals = self.stages.setdefault(stage, {'items': 0,
+                                                    'seconds': 0.0,
+                                                    'calls': 0})
+            totals['items'] += items
+            totals['seconds'] += seconds
+            totals['calls'] += 1
+
+    @contextmanager
+    def stage(self, stage, items=0):
+        started = time()
+        try:
+            yield
+        finally:
+            self.record(stage, time() - started, items)
+
+    def histogram(self, name):
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            return self.histograms[name]
+
+    def report(self):
+        stages = OrderedDict()
+        for stage, totals in self.stages.iteritems():
+            stages[stage] = dict(totals, items_per_second=(
+                totals['items'] / totals['seconds'] if totals['seconds'] else 0))
+
+        return {
+            'stages': stages,
+            'latencies': OrderedDict((name, histogram.as_dict()) for name,
+                                     histogram in self.histograms.iteritems()),
+            'peak_rss_kb': peak_rss_kb(),
+            'peak_rss_children_kb': peak_rss_kb(resource.RUSAGE_CHILDREN)
+        }
+
+    def publish(self, stats, spider):
+        """ Set the report as `pipeline/...` Scrapy stats. """
+        report = self.report()
+        for stage, totals in report['stages'].iteritems():
+            for key, value in totals.iteritems():
+                stats.set_value('pipeline/%s/%s' % (stage, key), value,
+                                spider=spider)
+
+        for name, histogram in self.histograms.iteritems():
+            for label, count in histogram.buckets():
+                stats.set_value('pipeline/latency/%s/%s' % (name, label),
+                                count, spider=spider)
+
+        for key in ['peak_rss_kb', 'peak_rss_children_kb']:
+            stats.set_value('pipeline/%s' % key, report[key], spider=spider)
+
+    def write_report(self, report_dir, spider_name, started_at, stats=None):
+        """
+        Write the report to `<spider>_<started at>.json` in `report_dir`,
+        together with the other Scrapy stats of the crawl.
+        """
+        if not os.path.exists(report_dir):
+            os.makedirs(report_dir)
+
+        report = self.report()
+        report['spider'] = spider_name
+        report['started_at'] = started_at
+        if stats is not None:
+            report['scrapy_stats'] = dict(
+                (key, value if isinstance(value, (int, long, float))
+                 else unicode(value))
+                for key, value in stats.iteritems()
+                if not key.startswith('pipeline/'))
+
+        path = os.path.join(report_dir, '%s_%s.json' % (
+            spider_name, started_at.replace(':', '').replace('-', '')))
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=4, separators=(',', ': '))
+        return path
+
+
+def peak_rss_kb(who=resource.RUSAGE_SELF):
+    """
+    Peak resident set size (in kB on Linux) of this process, or of the
+    largest of its terminated child processes (e.g. validation workers).
+    """
+    return resource.getrusage(who).ru_maxrss
+
+
+# Instrumentation of the current crawl. It is module level, so that code
+# outside of the pipeline (e.g. the downloads of the DUO spiders) can use
+# it too.
+instrumentation = Instrumentation()
+
+
+def timed(stage):
+    """ Decorator that records the time spent in a function as `stage`. """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with instrumentation.stage(stage, items=1):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
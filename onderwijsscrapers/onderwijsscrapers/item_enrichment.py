@@ -1,14 +1,35 @@
-from time import sleep
+import os
+import re
+import csv
+import socket
+import sqlite3
+import threading
+from array import array
+from bisect import bisect_left
+from copy import deepcopy
+from multiprocessing.pool import ThreadPool
+from time import sleep, time
 
 from scrapy import log
 import httplib, urllib,json, requests
 
+from onderwijsscrapers.instrumentation import Histogram
 
-def bag42_geocode(address):
+
+class GeocoderUnavailable(Exception):
+    """ The geocoding service could (temporarily) not handle a request. """
+    pass
+
+
+def bag42_geocode(address, conn=None, delay=0.25):
     """
     Use the BAG42 service to geocode a given address.
+
+    Pass an open `httplib.HTTPConnection` as `conn` to reuse a keep-alive
+    connection. `delay` is the time to sleep after the request; set it to
+    0 when requests are already rate limited by the caller.
     """
-    log.msg('Geocoding address %s' % address, evel=log.INFO)
+    log.msg('Geocoding address %s' % address, level=log.INFO)
     address_fields = ['street', 'zip_code', 'city']
 
     payload = []
@@ -18,21 +39,24 @@ def bag42_geocode(address):
 
     payload_data = "address=" + ';'.join(payload)
 
-    try:
-        conn = httplib.HTTPConnection('bag42.nl')
-        conn.request('GET', "/api/v0/geocode/json?" + payload_data)
-        resp = conn.getresponse()
-    except requests.exceptions.ConnectionError:
-        sleep(2)
+    if conn is None:
         conn = httplib.HTTPConnection('bag42.nl')
+
+    try:
         conn.request('GET', "/api/v0/geocode/json?" + payload_data)
         resp = conn.getresponse()
+        body = resp.read()
+    except (httplib.HTTPException, socket.error), e:
+        conn.close()
+        raise GeocoderUnavailable(e)
+
+    if resp.status in (429, 500, 502, 503, 504):
+        raise GeocoderUnavailable('BAG42 returned HTTP %d' % resp.status)
 
     try:
-        result = json.loads(resp.read())
-    except:
-        print resp.text
-        log.msg('Unable to decode JSON object: %s' % resp.read(), level=log.ERROR)
+        result = json.loads(body)
+    except ValueError:
+        log.msg('Unable to decode JSON object: %s' % body, level=log.ERROR)
         return None
     if result['status'] != 'OK':
         log.msg('Unable to geocode address %s' % address, level=log.WARNING)
@@ -64,12 +88,13 @@ def bag42_geocode(address):
             }
         }
 
-    sleep(0.25)
+    if delay:
+        sleep(delay)
 
     return geocoded_address
 
 
-def nominatim_geocode(address):
+def nominatim_geocode(address, session=requests, delay=1):
     """
     Use the OSM Nominatim (http://wiki.openstreetmap.org/wiki/Nominatim)
     service to geocode addresses. An address is expected to be formatted
@@ -82,6 +107,9 @@ def nominatim_geocode(address):
 
     When one of the above fields is missing or has no value, it is not
     included in the query we send to Nominatim.
+
+    Pass a `requests.Session` as `session` to reuse a keep-alive
+    connection.
     """
     address_nominatim_mapping = {
         'street': 'street',
@@ -99,11 +127,19 @@ def nominatim_geocode(address):
             payload[mapped] = address[org]
 
     nominatim_url = 'http://nominatim.openstreetmap.org/search'
-    resp = requests.get(nominatim_url, params=payload)
+    try:
+        resp = session.get(nominatim_url, params=payload)
+    except requests.exceptions.RequestException, e:
+        raise GeocoderUnavailable(e)
+
+    if resp.status_code in (429, 500, 502, 503, 504):
+        raise GeocoderUnavailable('Nominatim returned HTTP %d'
+                                  % resp.status_code)
 
     result = resp.json()
     # OSM wants us to sleep for a second between requests
-    sleep(1)
+    if delay:
+        sleep(delay)
 
     return result
 
@@ -111,10 +147,416 @@ def nominatim_geocode(address):
     # a less restrictive appraoch (i.e. search without a zipcode)
     if not result and 'postalcode' in payload:
         del payload['postalcode']
-        resp = requests.get(nominatim_url, params=payload)
+        resp = session.get(nominatim_url, params=payload)
         result = resp.json()
-        sleep(1)
+        if delay:
+            sleep(delay)
         if not result:
             return None
     else:
         return None
+
+
+def nominatim_to_geocoded(result):
+    """
+    Convert the first match of a Nominatim search result to the format
+    that is returned by `bag42_geocode`.
+    """
+    if not result:
+        return None
+
+    result = result[0]
+    geocoded_address = {
+        'geo_location': {
+            'lat': float(result['lat']),
+            'lon': float(result['lon'])
+        }
+    }
+
+    if 'display_name' in result:
+        geocoded_address['formatted_address'] = result['display_name']
+
+    if 'boundingbox' in result:
+        south, north, west, east = map(float, result['boundingbox'])
+        geocoded_address['geo_viewport'] = {
+            'northeast': {'lat': north, 'lon': east},
+            'southwest': {'lat': south, 'lon': west}
+        }
+
+    return geocoded_address
+
+
+# Geocoding providers that can be used by the `ConcurrentGeocoder`. Each
+# provider has a geocode function and a function that opens a (keep-alive)
+# connection that is passed to it.
+GEOCODE_PROVIDERS = {
+    'bag42': {
+        'geocode': lambda address, conn: bag42_geocode(address, conn=conn,
+                                                       delay=0),
+        'connect': lambda: httplib.HTTPConnection('bag42.nl', timeout=30),
+    },
+    'nominatim': {
+        'geocode': lambda address, conn: nominatim_to_geocoded(
+            nominatim_geocode(address, session=conn, delay=0)),
+        'connect': requests.Session,
+    },
+}
+
+
+class TokenBucket(object):
+    """
+    Thread-safe token bucket that allows `rate` calls per second, with
+    bursts of at most `capacity` calls.
+    """
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = capacity or max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.updated_at = time()
+        self.lock = threading.Lock()
+
+    def consume(self):
+        """ Block until a token is available and take it. """
+        while True:
+            with self.lock:
+                now = time()
+                self.tokens = min(self.capacity, self.tokens +
+                                  (now - self.updated_at) * self.rate)
+                self.updated_at = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                wait = (1 - self.tokens) / self.rate
+            sleep(wait)
+
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(provider, rate):
+    """
+    Return the token bucket of a provider, so all geocoders that use the
+    same provider share one rate limit.
+    """
+    with _rate_limiters_lock:
+        if provider not in _rate_limiters:
+            _rate_limiters[provider] = TokenBucket(rate)
+        return _rate_limiters[provider]
+
+
+def parse_house_number(street):
+    """
+    Return the house number in a DUO street field, e.g. 29 for
+    'Valeriusstraat 29- 31' or 12 for 'Hoofdstraat 12 a'.
+    """
+    match = re.search(r'\s(\d+)\D*(?:-\s*\d+\D*)?$', street or '')
+    if match:
+        return int(match.group(1))
+
+
+class LocalGeocoder(object):
+    """
+    Geocode addresses without any network requests, using a BAG-style
+    CSV file with the columns `postcode`, `huisnummer`, `lat` and `lon`.
+
+    Postcode and house number are packed into a single number per
+    address. The packed keys and the coordinates are kept in sorted
+    arrays, so a lookup is a binary search. The arrays are saved to
+    `<path>.idx`, which is used instead of the CSV file as long as the
+    CSV file does not change.
+    """
+    provider = 'local'
+    max_house_number = 100000
+
+    def __init__(self, path, delimiter=','):
+        self.stats = {'hits': 0, 'misses': 0}
+
+        index_path = '%s.idx' % path
+        if os.path.exists(index_path) and\
+                os.path.getmtime(index_path) >= os.path.getmtime(path):
+            self.load_index(index_path)
+        else:
+            self.build_index(path, delimiter)
+            self.save_index(index_path)
+
+    @classmethod
+    def address_key(cls, zip_code, house_number):
+        """
+        Pack a postcode ('1234AB') and house number into a single
+        number, or return None if either of them is invalid.
+        """
+        match = re.match(r'^(\d{4})\s*([A-Z]{2})$', (zip_code or '').strip()
+                                                                   .upper())
+        if not match or house_number is None or\
+                not 0 < house_number < cls.max_house_number:
+            return None
+
+        digits, letters = match.groups()
+        postcode = (int(digits) * 26 + ord(letters[0]) - 65) * 26\
+            + ord(letters[1]) - 65
+
+        # Doubles represent these keys exactly and, unlike longs, have
+        # the same size on every platform.
+        return float(postcode * cls.max_house_number + house_number)
+
+    def build_index(self, path, delimiter):
+        log.msg('Building local geocoding index from %s' % path,
+                level=log.INFO)
+
+        addresses = []
+        with open(path, 'rb') as f:
+            for row in csv.DictReader(f, delimiter=delimiter):
+                key = self.address_key(row['postcode'],
+                                       int_or_none(row['huisnummer']))
+                if key is not None:
+                    addresses.append((key, float(row['lat']),
+                                      float(row['lon'])))
+        addresses.sort()
+
+        self.keys, self.lats, self.lons = array('d'), array('d'), array('d')
+        for key, lat, lon in addresses:
+            # Keep the first of multiple objects with the same address
+            if self.keys and self.keys[-1] == key:
+                continue
+            self.keys.append(key)
+            self.lats.append(lat)
+            self.lons.append(lon)
+
+    def save_index(self, index_path):
+        with open(index_path, 'wb') as f:
+            array('d', [len(self.keys)]).tofile(f)
+            self.keys.tofile(f)
+            self.lats.tofile(f)
+            self.lons.tofile(f)
+
+    def load_index(self, index_path):
+        with open(index_path, 'rb') as f:
+            size = array('d')
+            size.fromfile(f, 1)
+            size = int(size[0])
+
+            self.keys, self.lats, self.lons = array('d'), array('d'), array('d')
+            self.keys.fromfile(f, size)
+            self.lats.fromfile(f, size)
+            self.lons.fromfile(f, size)
+
+    def geocode(self, address):
+        key = self.address_key(address.get('zip_code'),
+                               parse_house_number(address.get('street')))
+
+        if key is not None:
+            i = bisect_left(self.keys, key)
+            if i < len(self.keys) and self.keys[i] == key:
+                self.stats['hits'] += 1
+                return {
+                    'geo_location': {
+                        'lat': self.lats[i],
+                        'lon': self.lons[i]
+                    }
+                }
+
+        self.stats['misses'] += 1
+        return None
+
+    def geocode_many(self, addresses):
+        return [self.geocode(address) for address in addresses]
+
+    def close(self):
+        pass
+
+
+def int_or_none(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def normalize_address(address):
+    """
+    Return a normalized `(street, zip_code, city)` tuple for an address,
+    which is used as key for cached geocoding results.
+    """
+    street = re.sub(r'\s+', ' ', address.get('street') or '').strip().upper()
+    zip_code = re.sub(r'\s+', '', address.get('zip_code') or '').upper()
+    city = re.sub(r'\s+', ' ', address.get('city') or '').strip().upper()
+
+    return street, zip_code, city
+
+
+class GeocodeCache(object):
+    """
+    Persistent cache of geocoding results, stored in a SQLite database
+    and keyed by the normalized address. Successful results expire after
+    `ttl` seconds; addresses that could not be geocoded are cached as
+    well, but expire after `negative_ttl` seconds so they are retried
+    sooner. Results of different providers are cached separately.
+
+    The cache can be shared by multiple threads.
+    """
+    def __init__(self, path, ttl=90 * 24 * 3600, negative_ttl=7 * 24 * 3600,
+                 provider='bag42'):
+        cache_dir = os.path.dirname(path)
+        if cache_dir and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.provider = provider
+        self.stats = {'hits': 0, 'negative_hits': 0, 'misses': 0}
+
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS geocodes '
+                        '(provider TEXT, street TEXT, zip_code TEXT, '
+                        'city TEXT, result TEXT, cached_at REAL, '
+                        'PRIMARY KEY (provider, street, zip_code, city))')
+
+    def get(self, address):
+        """
+        Return a `(found, result)` tuple. `found` is False if the address
+        is not in the cache (or expired); `result` is None for addresses
+        that are known to be impossible to geocode.
+        """
+        with self.lock:
+            row = self.db.execute('SELECT result, cached_at FROM geocodes '
+                                  'WHERE provider = ? AND street = ? AND '
+                                  'zip_code = ? AND city = ?',
+                                  (self.provider,) +
+                                  normalize_address(address)).fetchone()
+
+            if row is not None:
+                result, cached_at = row
+                ttl = self.ttl if result is not None else self.negative_ttl
+                if time() - cached_at < ttl:
+                    if result is None:
+                        self.stats['negative_hits'] += 1
+                        return True, None
+
+                    self.stats['hits'] += 1
+                    return True, json.loads(result)
+
+            self.stats['misses'] += 1
+            return False, None
+
+    def set(self, address, result):
+        if result is not None:
+            result = json.dumps(result)
+
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO geocodes VALUES '
+                            '(?, ?, ?, ?, ?, ?)',
+                            (self.provider,) + normalize_address(address) +
+                            (result, time()))
+            self.db.commit()
+
+    @property
+    def hit_rate(self):
+        lookups = sum(self.stats.values())
+        if not lookups:
+            return 0.0
+
+        return (self.stats['hits'] + self.stats['negative_hits'])\
+            / float(lookups)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+class ConcurrentGeocoder(object):
+    """
+    Geocode addresses with a pool of worker threads. Every worker keeps
+    its own keep-alive connection to the provider, requests are rate
+    limited per provider, and requests that fail because the provider is
+    unavailable are retried with an exponential backoff.
+
+    When a `GeocodeCache` is given, cached results are used instead of
+    calling the provider, and new results are added to the cache.
+
+    The latencies of the requests to the provider are counted in
+    `self.latency`.
+    """
+    def __init__(self, provider='bag42', workers=4, rate=4, retries=3,
+                 backoff=1, cache=None):
+        self.provider = provider
+        self.geocode_func = GEOCODE_PROVIDERS[provider]['geocode']
+        self.connect = GEOCODE_PROVIDERS[provider]['connect']
+        self.rate_limiter = get_rate_limiter(provider, rate)
+        self.retries = retries
+        self.backoff = backoff
+        self.cache = cache
+
+        self.latency = Histogram()
+
+        self.local = threading.local()
+        self.pool = ThreadPool(workers)
+
+    def geocode(self, address):
+        """ Geocode a single address; returns None if that fails. """
+        if self.cache is not None:
+            found, result = self.cache.get(address)
+            if found:
+                return result
+
+        try:
+            result = self.request(address)
+        except GeocoderUnavailable, e:
+            # Don't cache this, the address might be fine
+            log.msg('Giving up geocoding address %s: %s' % (address, e),
+                    level=log.ERROR)
+            return None
+
+        if self.cache is not None:
+            self.cache.set(address, result)
+
+        return result
+
+    def request(self, address):
+        """
+        Geocode an address with the provider, retrying when the provider
+        is unavailable.
+        """
+        for attempt in xrange(self.retries + 1):
+            if getattr(self.local, 'conn', None) is None:
+                self.local.conn = self.connect()
+
+            self.rate_limiter.consume()
+            started = time()
+            try:
+                result = self.geocode_func(address, self.local.conn)
+            except GeocoderUnavailable:
+                self.latency.add(time() - started)
+                # Start over with a fresh connection
+                self.local.conn = None
+                if attempt == self.retries:
+                    raise
+                sleep(self.backoff * 2 ** attempt)
+            else:
+                self.latency.add(time() - started)
+                return result
+
+    def geocode_many(self, addresses):
+        """
+        Geocode a list of addresses concurrently. The results are returned
+        in the same order as `addresses`. Addresses that occur more than
+        once are only geocoded once.
+        """
+        keys = [normalize_address(address) for address in addresses]
+
+        unique = {}
+        for key, address in zip(keys, addresses):
+            unique.setdefault(key, address)
+        unique_keys = sorted(unique.keys())
+
+        results = dict(zip(unique_keys, self.pool.map(
+            self.geocode, [unique[key] for key in unique_keys])))
+
+        return [deepcopy(results[key]) for key in keys]
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
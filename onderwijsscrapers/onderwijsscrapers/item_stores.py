@@ -0,0 +1,165 @@
+import os
+import sqlite3
+import cPickle as pickle
+
+
+class ItemStore(object):
+    """
+    Key/value store for the (partial) items that are collected by the
+    pipeline during a crawl. Items are dicts; `update` merges a partial
+    item into the item that is already stored under the same key, just
+    like `dict.update`.
+    """
+    def __init__(self, spider_name, name):
+        self.spider_name = spider_name
+        self.name = name
+
+    def get(self, item_id, default=None):
+        raise NotImplementedError
+
+    def put(self, item_id, item):
+        raise NotImplementedError
+
+    def update(self, item_id, item):
+        stored = self.get(item_id)
+        if stored is None:
+            self.put(item_id, dict(item))
+        else:
+            stored.update(item)
+            self.put(item_id, stored)
+
+    def iteritems(self):
+        raise NotImplementedError
+
+    def __contains__(self, item_id):
+        return self.get(item_id) is not None
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def commit(self):
+        """ Make sure all items that were put are persisted (if supported). """
+        pass
+
+    def close(self):
+        pass
+
+
+class MemoryItemStore(ItemStore):
+    """ Keeps all items in a dict; fast, but bounded by available RAM. """
+    def __init__(self, spider_name, name):
+        super(MemoryItemStore, self).__init__(spider_name, name)
+        self.items = {}
+
+    def get(self, item_id, default=None):
+        return self.items.get(item_id, default)
+
+    def put(self, item_id, item):
+        self.items[item_id] = item
+
+    def update(self, item_id, item):
+        if item_id not in self.items:
+            self.items[item_id] = dict(item)
+        else:
+            self.items[item_id].update(item)
+
+    def iteritems(self):
+        return self.items.iteritems()
+
+    def __contains__(self, item_id):
+        return item_id in self.items
+
+    def __len__(self):
+        return len(self.items)
+
+
+class SQLiteItemStore(ItemStore):
+    """
+    Keeps items pickled in a SQLite database on disk, so the memory
+    used by a crawl no longer grows with the number of items.
+    `iteritems` streams the items back in insertion order.
+
+    The database is a scratch file and is removed on `close`, unless
+    `keep` is set. Closing a store that is already closed does nothing.
+    """
+    def __init__(self, spider_name, name, store_dir, keep=False,
+                 commit_every=1000):
+        super(SQLiteItemStore, self).__init__(spider_name, name)
+
+        if not os.path.exists(store_dir):
+            os.makedirs(store_dir)
+
+        self.path = os.path.join(store_dir, '%s_%s.sqlite' % (spider_name,
+                                                              name))
+        self.keep = keep
+        self.commit_every = commit_every
+        self.uncommitted = 0
+
+        self.closed = False
+        self.db = sqlite3.connect(self.path)
+        self.db.text_factory = str
+        # The store only lives for the duration of a crawl, so trade
+        # durability for write speed. WAL lets `iteritems` read a
+        # snapshot while items are being written.
+        self.db.execute('PRAGMA synchronous = OFF')
+        self.db.execute('PRAGMA journal_mode = WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS items '
+                        '(item_id TEXT PRIMARY KEY, item BLOB)')
+
+    def get(self, item_id, default=None):
+        row = self.db.execute('SELECT item FROM items WHERE item_id = ?',
+                              (item_id,)).fetchone()
+        if row is None:
+            return default
+
+        return pickle.loads(str(row[0]))
+
+    def put(self, item_id, item):
+        data = sqlite3.Binary(pickle.dumps(item, pickle.HIGHEST_PROTOCOL))
+
+        # Keep the rowid (and therefore the iteration order) of items
+        # that are already present.
+        cursor = self.db.execute('UPDATE items SET item = ? WHERE item_id = ?',
+                                 (data, item_id))
+        if cursor.rowcount == 0:
+            self.db.execute('INSERT INTO items (item_id, item) VALUES (?, ?)',
+                            (item_id, data))
+
+        self.uncommitted += 1
+        if self.uncommitted >= self.commit_every:
+            self.commit()
+
+    def commit(self):
+        self.db.commit()
+        self.uncommitted = 0
+
+    def iteritems(self):
+        self.commit()
+
+        # Use a separate connection, so commits on the main connection
+        # do not reset the cursor while the result set is consumed.
+        reader = sqlite3.connect(self.path)
+        try:
+            for item_id, data in reader.execute('SELECT item_id, item FROM '
+                                                'items ORDER BY rowid'):
+                yield str(item_id), pickle.loads(str(data))
+        finally:
+            reader.close()
+
+    def __contains__(self, item_id):
+        return self.db.execute('SELECT 1 FROM items WHERE item_id = ?',
+                               (item_id,)).fetchone() is not None
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM items').fetchone()[0]
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+
+        self.db.commit()
+        self.db.close()
+
+        if not self.keep and os.path.exists(self.path):
+            os.remove(self.path)
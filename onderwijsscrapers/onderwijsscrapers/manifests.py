@@ -0,0 +1,70 @@
+import os
+import json
+from hashlib import sha1
+
+
+def content_hash(item):
+    """
+    Hash the content of an exported item. The `meta` field is left out,
+    as it holds the timestamps of the crawl and the validation (which
+    change on every run, even when the content does not).
+    """
+    content = dict((key, value) for key, value in item.iteritems()
+                   if key != 'meta')
+    return sha1(json.dumps(content, sort_keys=True)).hexdigest()
+
+
+class ExportManifest(object):
+    """
+    The content hashes of the documents that were exported to an index
+    and doctype during the previous crawl, used to only export the
+    documents that are new or changed.
+
+    The manifest is a JSON file mapping document ids to content hashes.
+    It is only written by `save`, so when a crawl fails before the export
+    is complete, the next crawl compares against the last complete run.
+    """
+    def __init__(self, manifest_dir, name, index, doctype):
+        self.path = os.path.join(manifest_dir, '%s_%s_%s.json' % (name, index,
+                                                                  doctype))
+
+        self.previous = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.previous = json.load(f)
+
+        self.current = {}
+
+    def is_changed(self, doc_id, digest):
+        """
+        Record the content hash of a document of the current crawl, and
+        return True if it differs from the previous crawl.
+        """
+        self.current[doc_id] = digest
+        return self.previous.get(doc_id) != digest
+
+    def revert(self, doc_id):
+        """
+        Keep the state of the previous crawl for a document that could
+        not be exported or deleted, so the next crawl tries again.
+        """
+        if doc_id in self.previous:
+            self.current[doc_id] = self.previous[doc_id]
+        else:
+            self.current.pop(doc_id, None)
+
+    def deleted(self):
+        """ Ids of the documents that disappeared since the previous crawl. """
+        return sorted(set(self.previous) - set(self.current))
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        # Write to a temporary file first, so an interrupted write does
+        # not leave a truncated manifest behind.
+        tmp_path = '%s.tmp' % self.path
+        with open(tmp_path, 'w') as f:
+            json.dump(self.current, f, sort_keys=True)
+        os.rename(tmp_path, self.path)
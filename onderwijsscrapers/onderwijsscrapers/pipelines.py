@@ -1,4 +1,11 @@
+import sys
+import threading
 from datetime import datetime
+from itertools import islice
+from multiprocessing import Pool
+from Queue import Queue
+from time import time
+from zlib import crc32
 import pytz
 
 
@@ -7,35 +14,183 @@ from scrapy.exceptions import DropItem
 from scrapy import log
 
 # from onderwijsscrapers import exporters
-from onderwijsscrapers.item_enrichment import bag42_geocode
+from onderwijsscrapers.item_enrichment import (ConcurrentGeocoder,
+                                               GeocodeCache, LocalGeocoder)
+from onderwijsscrapers.checkpoints import get_checkpoint
+from onderwijsscrapers.exporters import encode
+from onderwijsscrapers.instrumentation import instrumentation
+from onderwijsscrapers.item_stores import SQLiteItemStore
+from onderwijsscrapers.manifests import ExportManifest, content_hash
 from onderwijsscrapers.validation import validate
 
 
+def chunks(iterable, size):
+    """ Yield lists of (at most) `size` elements from `iterable`. """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class ExportQueue(object):
+    """
+    Bounded queue that feeds `(item_id, item, data)` entries to the
+    exporter of one export method, running in its own thread. Iterating
+    stops at the `None` that marks the end of the items.
+    """
+    def __init__(self, size):
+        self.queue = Queue(size)
+        self.done = False
+
+    def put(self, entry):
+        self.queue.put(entry)
+
+    def __iter__(self):
+        while True:
+            entry = self.queue.get()
+            if entry is None:
+                self.done = True
+                return
+            yield entry
+
+    def drain(self):
+        """
+        Discard the remaining entries, so that a failed export method
+        does not block the other ones.
+        """
+        if not self.done:
+            for entry in self:
+                pass
+
+
+def shard_items(items, shards):
+    """
+    Divide a list of `(item_id, item)` pairs over `shards` lists by item
+    id. Items keep their position in `items`, so the results of all
+    shards can be merged back into the original order.
+    """
+    sharded = [[] for shard in xrange(shards)]
+    for position, (item_id, item) in enumerate(items):
+        sharded[crc32(item_id) % shards].append((position, item_id, item))
+    return sharded
+
+
+def check_export_methods(export_methods):
+    """
+    Raise a ValueError if an export method in `export_methods` (the
+    `EXPORT_METHODS` setting) is incremental, but its exporter can not
+    delete the documents that disappeared since the previous crawl.
+    """
+    for method, method_properties in export_methods.iteritems():
+        exporter = method_properties['exporter']
+        if method_properties.get('incremental') and\
+                not exporter.can_delete(method_properties['options']):
+            raise ValueError('Export method %s can not be incremental, as %s '
+                             'can not delete documents with these options'
+                             % (method, exporter.__name__))
+
+
+# Every validation worker process creates its own schema instance
+worker_schema = None
+
+
+def init_validation_worker(schema):
+    global worker_schema
+    worker_schema = schema()
+
+
+def validate_shard(args):
+    """
+    Validate a shard of items in a validation worker process. Returns
+    `(position, item, validation, seconds)` tuples.
+    """
+    index, doctype, shard = args
+    results = []
+    for position, item_id, item in shard:
+        started = time()
+        item, validation = validate(worker_schema, index, doctype, item_id,
+                                    item)
+        results.append((position, item, validation, time() - started))
+    return results
+
+
 class OnderwijsscrapersPipeline(object):
     def __init__(self):
         self.scrape_started = datetime.utcnow().replace(tzinfo=pytz.utc)\
             .strftime('%Y-%m-%dT%H:%M:%SZ')
+        self.instrumentation = instrumentation
+
+    def open_spider(self, spider):
+        check_export_methods(settings['EXPORT_METHODS'])
+
+        self.checkpoint = get_checkpoint(spider.name, settings)
+        if self.checkpoint is not None:
+            # A resumed crawl keeps the start time of the interrupted one,
+            # so it continues to load the same version of versioned indices
+            self.scrape_started = self.checkpoint.crawl_started_at(
+                self.scrape_started)
+
+        # A spider that crawls for several spiders at once (e.g. `duo_all`)
+        # lists their names in `export_names`, and sets the `export_name`
+        # of every item. The items of each name are merged and exported
+        # with the export settings of that name.
+        self.export_names = getattr(spider, 'export_names', [spider.name])
         self.items = {}
+
+        # The exporters of an index that is shared by several export names
+        # (e.g. the `duo` index of `duo_all`) are closed together, once all
+        # of these names are exported
+        indices = [settings['EXPORT_SETTINGS'][export_name]['index']
+                   for export_name in self.export_names]
+        self.shared_indices = set(index for index in indices
+                                  if indices.count(index) > 1)
+        self.exporter_groups = {}
+
         self.universal_items = {}
+        for export_name in self.export_names:
+            self.items[export_name] = self.create_store(
+                spider, self.store_name(spider, export_name, 'items'))
+            self.universal_items[export_name] = self.create_store(
+                spider, self.store_name(spider, export_name, 'universal_items'))
+
+    def store_name(self, spider, export_name, name):
+        """ Name of store `name` for the items of `export_name`. """
+        if export_name == spider.name:
+            return name
+        return '%s_%s' % (export_name, name)
+
+    def create_store(self, spider, name):
+        """
+        Create an item store as configured in `ITEM_STORE`. When the crawl
+        is checkpointed, the items are stored in the checkpoint instead.
+        """
+        if self.checkpoint is not None:
+            store = SQLiteItemStore(spider.name, name,
+                                    **self.checkpoint.store_options())
+            self.checkpoint.add_store(store)
+            return store
+
+        return settings['ITEM_STORE']['store'](spider.name, name,
+                                               **settings['ITEM_STORE']['options'])
 
     def process_item(self, item, spider):
+        export_name = item.pop('export_name', spider.name)
+
         # Check if the fields that identify the item are present. If not,
         # log and drop the item.
-        id_fields = settings['EXPORT_SETTINGS'][spider.name]['id_fields']
+        id_fields = settings['EXPORT_SETTINGS'][export_name]['id_fields']
         if not all(field in item for field in id_fields):
             log.msg('Dropped item, not all required fields are present. %s'
                 % item, level=log.WARNING, spider=spider)
             raise DropItem
             return
 
+        started = time()
         item_id = '-'.join([str(item[field]) for field in id_fields])
-        print '=' * 10
-        print item_id
 
-        if item_id not in self.items:
-            self.items[item_id] = dict(item)
-        else:
-            self.items[item_id].update(dict(item))
+        self.items[export_name].update(item_id, dict(item))
 
         # Check if this item should be included into all related items
         # of the same spider (e.g. ignore reference year)
@@ -49,84 +204,526 @@ class OnderwijsscrapersPipeline(object):
 
         item_id = '-'.join([str(item[field]) for field in id_fields])
         if universal_item:
-            self.universal_items[item_id] = dict(item).copy()
+            self.universal_items[export_name].put(item_id, dict(item).copy())
 
+        self.instrumentation.record('merge', time() - started, items=1)
         return item
 
     def close_spider(self, spider):
-        export_settings = settings['EXPORT_SETTINGS'][spider.name]
+        stores, manifests, validations = [], [], {}
+        for export_name in self.export_names:
+            export_stores, export_manifests, validation = \
+                self.export_items(spider, export_name)
+            stores.extend(export_stores)
+            manifests.extend(export_manifests)
+            if validation is not None:
+                index, validation_reports, exported = validation
+                validations.setdefault(index, []).append((validation_reports,
+                                                          exported))
+
+        for (method, index), exporters in self.exporter_groups.items():
+            with self.instrumentation.stage('export/%s/close/%s'
+                                            % (method, index)):
+                exporters[0].close_all(exporters)
+
+        # The validation reports of all export names are exported together,
+        # as they share the validation index
+        for index, reports in validations.items():
+            stage_suffix = '/%s' % index if len(validations) > 1 else ''
+            self.export_validation(index, reports, stage_suffix)
+
+        # Only save the manifests once everything has been exported
+        for manifest in manifests:
+            if manifest is not None:
+                manifest.save()
+
+        # Stores are closed once everything is exported, as the checkpoint
+        # commits all of them
+        for store in stores + self.items.values() + self.universal_items.values():
+            store.close()
+
+        # The crawl is complete, so there is nothing left to resume
+        if self.checkpoint is not None:
+            self.checkpoint.remove()
+
+        self.instrumentation.publish(spider.crawler.stats, spider)
+        if settings['PIPELINE_REPORT_DIR']:
+            path = self.instrumentation.write_report(
+                settings['PIPELINE_REPORT_DIR'], spider.name,
+                self.scrape_started, spider.crawler.stats.get_stats(spider))
+            log.msg('Wrote pipeline report to %s' % path, level=log.INFO)
+
+    def export_items(self, spider, export_name):
+        """
+        Enrich, validate and export the items of `export_name`, with the
+        export settings of that name. Returns the stores it created, the
+        export manifests (to save once everything is exported) and, if the
+        items are validated, a `(validation index, validation reports,
+        exported)` tuple.
+        """
+        export_settings = settings['EXPORT_SETTINGS'][export_name]
+        merged_items = self.items[export_name]
+        universal_items = self.universal_items[export_name]
+
+        # Export stages of other names than the spider's are kept apart
+        # in the checkpoint
+        stage_prefix = 'export'
+        if export_name != spider.name:
+            stage_prefix = 'export/%s' % export_name
 
-        items = {}
-        validation_reports = []
+        # Enriched items (and their validation reports) are written to
+        # separate stores, so they can be streamed to the exporters without
+        # keeping them all in memory.
+        items = self.create_store(
+            spider, self.store_name(spider, export_name, 'export'))
+        validation_reports = self.create_store(
+            spider, self.store_name(spider, export_name, 'validation'))
 
         # Add metadata to items and (if required) merge universal items.
         # Also validate and perform 'item_enrichment' functions
         # (i.e. geocodeing).
         id_fields = export_settings['id_fields']
-        total_items = len(self.items.keys())
+        total_items = len(merged_items)
         count = 0
         # Create colander schema for all items
         validation_schema = export_settings['schema']()
-        
-        for item_id, item in self.items.iteritems():
-            universal_item = 'None-%s' % '-'.join([str(item[field]) for field in
-                                                   id_fields[1:]])
-            if universal_item in self.universal_items:
-                universal_item = self.universal_items[universal_item]
-                if 'reference_year' in universal_item:
-                    del universal_item['reference_year']
-                item.update(universal_item)
-
-            if 'ignore_id_fields' in item:
-                del item['ignore_id_fields']
-
-            item['meta'] = {
-                'scrape_started_at': self.scrape_started,
-                'item_scraped_at': datetime.utcnow().replace(tzinfo=pytz.utc)
-                                                    .strftime('%Y-%m-%dT%H:%M:%SZ')
-            }
-
-            # Geocode if enabled for this index
-            if export_settings['geocode']:
-                count += 1
-                for address_field in export_settings['geocode_fields']:
-                    if address_field in item:
-                        geocoded = bag42_geocode(item[address_field])
-                        if geocoded:
-                            item[address_field].update(geocoded)
-                log.msg('Geocoded %d/%d' % (count, total_items), level=log.INFO)
-
-            # Validate the item is this is enabled
-            if export_settings['validate']:
-                item, validation = validate(validation_schema,
-                                            export_settings['index'],
-                                            export_settings['doctype'],
-                                            item_id, item)
 
-                validation_reports.append(validation)
+        if export_settings['geocode']:
+            geocoders = self.create_geocoders(export_settings['geocode'])
+
+        # Validate in a pool of worker processes if configured. On an error
+        # the worker processes are stopped, so they don't outlive the crawl.
+        pool = None
+        if export_settings['validate'] and settings['VALIDATION_PROCESSES'] > 1:
+            pool = Pool(settings['VALIDATION_PROCESSES'],
+                        initializer=init_validation_worker,
+                        initargs=(export_settings['schema'],))
+
+        completed = False
+        try:
+            # Items are processed in batches, so the addresses of all items
+            # in a batch can be geocoded concurrently.
+            for batch in chunks(merged_items.iteritems(),
+                                settings['GEOCODE_BATCH_SIZE']):
+                # Skip the items that were enriched before the crawl was
+                # interrupted
+                if self.checkpoint is not None:
+                    batch = [(item_id, item) for item_id, item in batch
+                             if item_id not in items]
+                    if not batch:
+                        continue
+
+                with self.instrumentation.stage('enrich', items=len(batch)):
+                    for item_id, item in batch:
+                        universal_item = 'None-%s' % '-'.join([str(item[field]) for field in
+                                                               id_fields[1:]])
+                        if universal_item in universal_items:
+                            universal_item = universal_items.get(universal_item)
+                            if 'reference_year' in universal_item:
+                                del universal_item['reference_year']
+                            item.update(universal_item)
+
+                        if 'ignore_id_fields' in item:
+                            del item['ignore_id_fields']
+
+                        item['meta'] = {
+                            'scrape_started_at': self.scrape_started,
+                            'item_scraped_at': datetime.utcnow().replace(tzinfo=pytz.utc)
+                                                                .strftime('%Y-%m-%dT%H:%M:%SZ')
+                        }
+
+                # Geocode if enabled for this index
+                if export_settings['geocode']:
+                    with self.instrumentation.stage('geocode', items=len(batch)):
+                        self.geocode_items(geocoders, batch,
+                                           export_settings['geocode_fields'])
+                    count += len(batch)
+                    log.msg('Geocoded %d/%d' % (count, total_items), level=log.INFO)
+
+                # Validate the items if this is enabled
+                if export_settings['validate']:
+                    with self.instrumentation.stage('validate', items=len(batch)):
+                        validated = self.validate_items(pool, validation_schema,
+                                                        export_settings, batch)
+                    for item_id, item, validation in validated:
+                        validation_reports.put(item_id, validation)
+                        items.put(item_id, item)
+                else:
+                    for item_id, item in batch:
+                        items.put(item_id, item)
+
+                if self.checkpoint is not None:
+                    self.checkpoint.commit()
+            completed = True
+        finally:
+            if pool is not None:
+                if completed:
+                    pool.close()
+                else:
+                    pool.terminate()
+                pool.join()
+
+        if export_settings['geocode']:
+            self.close_geocoders(geocoders, spider)
+
+        # Every item is serialized once and exported with all export
+        # methods at once. Incremental export methods only get the
+        # documents that changed since the previous crawl.
+        manifests = {}
+        exports = []
+        for method, method_properties in settings['EXPORT_METHODS'].items():
+            manifest = None
+            if method_properties.get('incremental'):
+                manifest = ExportManifest(settings['EXPORT_MANIFEST_DIR'],
+                                          method, export_settings['index'],
+                                          export_settings['doctype'])
+            manifests[method] = manifest
+
+            group = None
+            if export_settings['index'] in self.shared_indices:
+                group = self.exporter_groups.setdefault(
+                    (method, export_settings['index']), [])
+
+            exports.append((method, {
+                'method_properties': method_properties,
+                'index': export_settings['index'],
+                'doctype': export_settings['doctype'],
+                'manifest': manifest,
+                'stage': '%s/%s' % (stage_prefix, method),
+                'checkpoint': self.checkpoint,
+                'group': group
+            }))
+        exported = self.export_all(exports, items.iteritems())
 
-            items[item_id] = item
+        validation = None
+        if export_settings['validate']:
+            validation = (export_settings['validation_index'],
+                          validation_reports, exported)
+        return [items, validation_reports], manifests.values(), validation
 
+    def export_validation(self, index, reports, stage_suffix=''):
+        """
+        Export validation reports to `index`. `reports` is a list of
+        `(validation_reports, exported)` pairs, one per export name, where
+        `exported` is the result of exporting the items of that name.
+
+        Validation documents don't have a fixed id, so when resuming they
+        are only skipped if all of them were exported.
+        """
+        exports = []
         for method, method_properties in settings['EXPORT_METHODS'].items():
-            # Export the document
-            exporter = method_properties['exporter'](self.scrape_started,
-                                                     export_settings['index'],
-                                                     export_settings['doctype'],
-                                                     **method_properties['options'])
+            stage = 'export/%s/validation%s' % (method, stage_suffix)
+            if self.checkpoint and self.checkpoint.stage_done(stage):
+                continue
+
+            # Incremental export methods only get the reports of the
+            # documents that changed
+            item_filter = None
+            if method_properties.get('incremental'):
+                ids = set()
+                for validation_reports, exported in reports:
+                    ids.update(exported[method])
+                item_filter = lambda report, ids=ids: report['doc_id'] in ids
+
+            exports.append((method, {
+                'method_properties': method_properties,
+                'index': index,
+                'doctype': 'doc_validation',
+                'stage': stage,
+                'item_filter': item_filter
+            }))
+
+        self.export_all(exports, ((None, report)
+                                  for validation_reports, exported in reports
+                                  for report_id, report
+                                  in validation_reports.iteritems()))
+
+        if self.checkpoint is not None:
+            for method, kwargs in exports:
+                self.checkpoint.complete_stage(kwargs['stage'])
+
+    def validate_items(self, pool, validation_schema, export_settings, items):
+        """
+        Validate a list of `(item_id, item)` pairs and return a list of
+        `(item_id, item, validation)` tuples in the same order. If `pool`
+        is given, the items are sharded by id over its worker processes.
+        """
+        index = export_settings['index']
+        doctype = export_settings['doctype']
+        latency = self.instrumentation.histogram('validate')
+
+        if pool is None:
+            validated = []
+            for item_id, item in items:
+                started = time()
+                item, validation = validate(validation_schema, index, doctype,
+                                            item_id, item)
+                latency.add(time() - started)
+                validated.append((item_id, item, validation))
+            return validated
+
+        shards = shard_items(items, settings['VALIDATION_PROCESSES'])
+        results = [None] * len(items)
+        for shard in pool.map(validate_shard, [(index, doctype, shard)
+                                               for shard in shards if shard]):
+            for position, item, validation, seconds in shard:
+                latency.add(seconds)
+                results[position] = (items[position][0], item, validation)
+        return results
+
+    def create_geocoders(self, providers):
+        """
+        Create a geocoder for each provider in `providers`, which is the
+        'geocode' export setting of a spider: either True (use BAG42), a
+        provider name, or a list of provider names that are tried in
+        order. The 'local' provider uses the index in `LOCAL_GEOCODER`.
+        """
+        if providers is True:
+            providers = ['bag42']
+        elif isinstance(providers, basestring):
+            providers = [providers]
+
+        geocoders = []
+        for provider in providers:
+            if provider == 'local':
+                geocoders.append(LocalGeocoder(**settings['LOCAL_GEOCODER']))
+                continue
+
+            cache = None
+            if settings['GEOCODE_CACHE']:
+                cache = GeocodeCache(provider=provider,
+                                     **settings['GEOCODE_CACHE'])
+
+            geocoders.append(ConcurrentGeocoder(
+                provider, workers=settings['GEOCODE_WORKERS'],
+                rate=settings['GEOCODE_RATE_LIMITS'][provider],
+                retries=settings['GEOCODE_RETRIES'], cache=cache))
+
+        return geocoders
+
+    def close_geocoders(self, geocoders, spider):
+        """ Close the geocoders and publish their hit rates as stats. """
+        stats = spider.crawler.stats
+        for geocoder in geocoders:
+            geocoder.close()
+
+            latency = getattr(geocoder, 'latency', None)
+            if latency is not None:
+                self.instrumentation.histogram('geocode/%s' % geocoder.provider)\
+                    .update(latency)
+
+            if isinstance(geocoder, LocalGeocoder):
+                for stat, value in geocoder.stats.iteritems():
+                    stats.set_value('geocode_local/%s' % stat, value,
+                                    spider=spider)
+
+            cache = getattr(geocoder, 'cache', None)
+            if cache is not None:
+                for stat, value in cache.stats.iteritems():
+                    stats.set_value('geocode_cache/%s/%s'
+                                    % (geocoder.provider, stat), value,
+                                    spider=spider)
+                stats.set_value('geocode_cache/%s/hit_rate'
+                                % geocoder.provider, cache.hit_rate,
+                                spider=spider)
+                log.msg('Geocode cache hit rate (%s): %.1f%%'
+                        % (geocoder.provider, cache.hit_rate * 100),
+                        level=log.INFO)
+                cache.close()
+
+    def geocode_items(self, geocoders, items, geocode_fields):
+        """
+        Geocode the address fields of a list of `(item_id, item)` pairs
+        and merge the results into the addresses. Each geocoder only gets
+        the addresses that the previous ones could not geocode. Results
+        are merged in the order of `items`, so the outcome does not depend
+        on the order in which the geocoding requests complete.
+        """
+        addresses = []
+        for item_id, item in items:
+            for address_field in geocode_fields:
+                if item.get(address_field):
+                    addresses.append(item[address_field])
+
+        for geocoder in geocoders:
+            if not addresses:
+                break
+
+            misses = []
+            for address, geocoded in zip(addresses,
+                                         geocoder.geocode_many(addresses)):
+                if geocoded:
+                    address.update(geocoded)
+                else:
+                    misses.append(address)
+            addresses = misses
 
-            for item_id, item in items.iteritems():
-                exporter.save(item, item_id)
+    def export_all(self, exports, items):
+        """
+        Export all `(item_id, item)` pairs in `items` with several export
+        methods at once. `exports` is a list of `(method, kwargs)` pairs,
+        where `kwargs` are the arguments of `export` (except `items`).
 
+        Each item is serialized once, and the encoded item is passed to
+        the exporters of all methods. Items are not serialized when none of
+        the exporters uses the encoding (e.g. pretty printed files). Every
+        export method runs in its own thread, fed by a bounded queue, so
+        that e.g. writing files and indexing into Elasticsearch overlap.
+        Returns a dict with the result of `export` per method. If an
+        export method fails, the others are completed and the first error
+        is raised.
+        """
+        results = {}
+        errors = []
+        queues = []
+        threads = []
+
+        def run(method, kwargs, queue):
+            try:
+                results[method] = self.export(items=queue, **kwargs)
+            except Exception:
+                errors.append(sys.exc_info())
+                log.msg('Export method %s failed' % method, level=log.ERROR)
+                queue.drain()
+
+        for method, kwargs in exports:
+            queue = ExportQueue(settings.getint('EXPORT_QUEUE_SIZE'))
+            thread = threading.Thread(target=run, args=(method, kwargs, queue),
+                                      name='export-%s' % method)
+            thread.daemon = True
+            thread.start()
+            queues.append(queue)
+            threads.append(thread)
+
+        uses_data = any(kwargs['method_properties']['exporter'].uses_data(
+                            kwargs['method_properties']['options'])
+                        for method, kwargs in exports)
+
+        try:
+            if queues:
+                for item_id, item in items:
+                    data = encode(item) if uses_data else None
+                    entry = (item_id, item, data)
+                    for queue in queues:
+                        queue.put(entry)
+        finally:
+            for queue in queues:
+                queue.put(None)
+            for thread in threads:
+                thread.join()
+
+        if errors:
+            exc_type, exc_value, exc_traceback = errors[0]
+            raise exc_type, exc_value, exc_traceback
+
+        return results
+
+    def export(self, method_properties, index, doctype, items, manifest=None,
+               stage='export', checkpoint=None, item_filter=None,
+               group=None):
+        """
+        Save all `(item_id, item, data)` entries in `items` with a single
+        exporter, where `data` is the encoded item or None (see
+        `export_all`).
+        Closing the exporter flushes anything it still buffers (e.g. a
+        pending Elasticsearch bulk request). Items for which `item_filter`
+        returns False are skipped.
+
+        If an `ExportManifest` is given, only the items whose content
+        changed since the previous crawl are saved, and the documents of
+        items that disappeared are deleted. Returns the set of ids of
+        the saved items. The manifest is not saved.
+
+        If a `Checkpoint` is given, the ids of the saved items are added
+        to it every `interval` items (after flushing the exporter), and
+        items that were saved before the crawl was interrupted are skipped.
+
+        If a `group` (a list) is given, the exporter is flushed instead of
+        closed, and appended to the group, to be closed together with the
+        exporters of the other doctypes of the index (see
+        `Exporter.close_all`).
+
+        The time spent is recorded as `stage`, together with the request
+        latencies of the exporter (if it keeps track of these).
+        """
+        started = time()
+        exporter = method_properties['exporter'](self.scrape_started, index,
+                                                 doctype,
+                                                 **method_properties['options'])
+
+        exported = set()
+        pending = []
+        saved = 0
+        unchanged = 0
+        for item_id, item, data in items:
+            if item_filter is not None and not item_filter(item):
+                continue
+
+            if manifest is not None and\
+                    not manifest.is_changed(item_id, content_hash(item)):
+                unchanged += 1
+                continue
+
+            exported.add(item_id)
+            if checkpoint is not None and checkpoint.is_exported(stage,
+                                                                 item_id):
+                continue
+
+            exporter.save(item, item_id, data)
+            saved += 1
+
+            if checkpoint is not None:
+                pending.append(item_id)
+                if len(pending) >= checkpoint.interval:
+                    self.checkpoint_export(checkpoint, exporter, stage,
+                                           pending)
+                    pending = []
+
+        deleted = []
+        if manifest is not None:
+            deleted = manifest.deleted()
+            for doc_id in deleted:
+                exporter.delete(doc_id)
+
+        if group is None:
             exporter.close()
+        else:
+            if hasattr(exporter, 'flush'):
+                exporter.flush()
+            group.append(exporter)
+
+        if checkpoint is not None:
+            self.checkpoint_export(checkpoint, exporter, stage, pending)
+
+        self.instrumentation.record(stage, time() - started, items=saved)
+        request_latency = getattr(exporter, 'request_latency', None)
+        if request_latency is not None:
+            self.instrumentation.histogram(stage).update(request_latency)
+
+        if manifest is not None:
+            # Documents that failed to export are exported again (or
+            # deleted again) by the next crawl
+            for doc_id, error in getattr(exporter, 'failed', []):
+                manifest.revert(doc_id)
+                exported.discard(doc_id)
+
+            log.msg('Exported %d new or changed documents to %s/%s, skipped '
+                    '%d unchanged and deleted %d' % (len(exported), index,
+                                                     doctype, unchanged,
+                                                     len(deleted)),
+                    level=log.INFO)
 
-            # Export validation documents
-            if export_settings['validate']:
-                exporter = method_properties['exporter'](self.scrape_started,
-                                                         export_settings['validation_index'],
-                                                         'doc_validation',
-                                                         **method_properties['options'])
+        return exported
 
-                for item in validation_reports:
-                    exporter.save(item)
+    def checkpoint_export(self, checkpoint, exporter, stage, item_ids):
+        """
+        Flush the exporter (if it buffers) and add the ids of the items
+        that were saved to the checkpoint, except the ones that failed.
+        """
+        if hasattr(exporter, 'flush'):
+            exporter.flush()
 
-                exporter.close()
+        failed = set(doc_id for doc_id, error in getattr(exporter, 'failed',
+                                                         []))
+        checkpoint.mark_exported(stage, [item_id for item_id in item_ids
+                                         if item_id not in failed])
@@ -1,5 +1,6 @@
 import os
 import exporters
+import item_stores
 
 # BOT_NAME = 'onderwijsscrapers'
 # BOT_VERSION = '1.0'
@@ -8,6 +9,9 @@ SPIDER_MODULES = ['onderwijsscrapers.spiders']
 ITEM_PIPELINES = {
     'onderwijsscrapers.pipelines.OnderwijsscrapersPipeline': 1
 }
+DOWNLOADER_MIDDLEWARES = {
+    'onderwijsscrapers.download_cache.DownloadCacheMiddleware': 580
+}
 NEWSPIDER_MODULE = 'onderwijsscrapers.spiders'
 # USER_AGENT = '%s/%s' % (BOT_NAME, BOT_VERSION)
 
@@ -50,28 +54,173 @@ ORIGINS = {
     'VML.JOEGOSLAVIE': 'former_yugoslavia',
 }
 
+# Addresses are geocoded concurrently by GEOCODE_WORKERS threads, in
+# batches of GEOCODE_BATCH_SIZE items. Requests are limited per provider
+# to the given number of requests per second, and requests that fail
+# because the provider is unavailable are retried GEOCODE_RETRIES times.
+GEOCODE_WORKERS = 4
+GEOCODE_BATCH_SIZE = 500
+GEOCODE_RATE_LIMITS = {
+    'bag42': 8,
+    'nominatim': 1
+}
+GEOCODE_RETRIES = 3
+
+# Geocoding results are cached on disk, keyed by the normalized address.
+# Results expire after 'ttl' seconds, addresses that could not be geocoded
+# after 'negative_ttl' seconds. Set to None to disable the cache.
+GEOCODE_CACHE = {
+    'path': os.path.join(PROJECT_ROOT, 'geocode_cache.sqlite'),
+    'ttl': 90 * 24 * 3600,
+    'negative_ttl': 7 * 24 * 3600
+}
+
+# BAG-style CSV file (columns 'postcode', 'huisnummer', 'lat' and 'lon')
+# that is used by the 'local' geocoding provider.
+LOCAL_GEOCODER = {
+    'path': os.path.join(PROJECT_ROOT, 'bag_addresses.csv'),
+    'delimiter': ','
+}
+
 # Directory to which scrape results should be saved (in case the file
 # exporter is used).
 EXPORT_DIR = os.path.join(PROJECT_ROOT, 'export')
 
-# Available methods are 'elasticsearch' and 'file'
+# Directory in which the content hashes of the exported documents are kept
+# for export methods that are 'incremental'.
+EXPORT_MANIFEST_DIR = os.path.join(PROJECT_ROOT, 'export_manifests')
+
+# Elasticsearch mapping files, used when a new version of an index is
+# created (see the 'versioned' option of the Elasticsearch exporter)
+ES_MAPPINGS_DIR = os.path.join(os.path.dirname(os.path.dirname(PROJECT_ROOT)),
+                               'es_mappings')
+ES_MAPPINGS = {
+    'duo': os.path.join(ES_MAPPINGS_DIR, 'duo.json'),
+    'onderwijsinspectie': os.path.join(ES_MAPPINGS_DIR, 'owinsp.json'),
+    'schoolvo': os.path.join(ES_MAPPINGS_DIR, 'schoolvo.json'),
+    'onderwijsdata_validation': os.path.join(ES_MAPPINGS_DIR,
+                                             'onderwijsdata_validation.json')
+}
+
+# Available methods are 'elasticsearch', 'file', 'ndjson' and 'columnar'.
+# When a method is 'incremental', only documents that are new or changed
+# since the previous crawl are exported, and documents that disappeared are
+# deleted. The ndjson and columnar exporters, and the file exporter with
+# 'create_tar', write complete files per crawl and can't delete, so they
+# can't be incremental. All methods run at the same time, each in its own
+# thread, and share a single JSON encoding of every document (which is
+# skipped when no method uses it).
 EXPORT_METHODS = {
     'file': {
         'exporter': exporters.FileExporter,
         'options': {
             'export_dir': EXPORT_DIR,
             'create_tar': True,
-            'remove_json': False
+            # Only write the tarball, not the separate JSON files
+            'remove_json': False,
+            # Pretty print the JSON files; None writes them compactly,
+            # reusing the encoding that is shared by all export methods
+            'indent': 4
         }
     },
+    # 'ndjson': {
+    #     'exporter': exporters.NDJSONExporter,
+    #     'options': {
+    #         'export_dir': EXPORT_DIR,
+    #         # 'gzip', 'zstd' (requires the zstandard package) or None
+    #         'compression': 'gzip',
+    #         # Number of files to divide the documents over
+    #         'shards': 1
+    #     }
+    # },
+    # 'columnar': {
+    #     'exporter': exporters.ColumnarExporter,
+    #     'options': {
+    #         'export_dir': EXPORT_DIR,
+    #         # 'parquet' or 'arrow' (requires the pyarrow package)
+    #         'file_format': 'parquet'
+    #     }
+    # },
     # 'elasticsearch': {
     #     'exporter': exporters.ElasticSearchExporter,
+    #     'incremental': True,
     #     'options': {
-    #         'url': '127.0.0.1:9200'
+    #         'url': '127.0.0.1:9200',
+    #         # Index documents with the _bulk API, flushing after
+    #         # 'bulk_size' documents or 'bulk_max_bytes' bytes. Set
+    #         # 'bulk_size' to None to index one document per request.
+    #         'bulk_size': 500,
+    #         'bulk_max_bytes': 5 * 1024 * 1024,
+    #         'bulk_max_retries': 3,
+    #         # Connection pool size, request timeout (in seconds) and
+    #         # retries of requests that were rejected with 429 or 503
+    #         'client_options': {
+    #             'pool_size': 10,
+    #             'timeout': 30,
+    #             'max_retries': 3
+    #         },
+    #         # Load every crawl into a new version of the index, and swap
+    #         # the alias to it when the crawl is done. Not to be combined
+    #         # with 'index_suffix'.
+    #         'versioned': False,
+    #         'mappings': ES_MAPPINGS,
+    #         # Replicas of a version once it is loaded
+    #         'replicas': 1,
+    #         # Number of previous versions kept to roll back to
+    #         'keep_versions': 1
     #     }
     # }
 }
 
+# Number of encoded documents that can be waiting for each export method.
+# The slowest method determines the pace of all methods.
+EXPORT_QUEUE_SIZE = 1000
+
+# Storage for the (partial) items that are merged by the pipeline during
+# a crawl. The in-memory store is fastest; for large crawls (e.g. all
+# years of DUO branches) use the SQLite store to keep memory bounded.
+ITEM_STORE = {
+    'store': item_stores.MemoryItemStore,
+    'options': {}
+}
+# ITEM_STORE = {
+#     'store': item_stores.SQLiteItemStore,
+#     'options': {
+#         'store_dir': os.path.join(PROJECT_ROOT, 'item_store')
+#     }
+# }
+
+# Directory to which a JSON report with the timings of the pipeline stages
+# (merge, enrich, geocode, validate, export), latency histograms and the
+# Scrapy stats is written when a spider closes. Set to None to disable.
+PIPELINE_REPORT_DIR = os.path.join(PROJECT_ROOT, 'reports')
+
+# Directory in which the progress of crawls is checkpointed (the merged
+# items, the enriched items and the exported items), or None to disable
+# checkpointing. A crawl that was interrupted can be resumed with
+# `scrapy crawl <spider> -s RESUME=1`, which skips the DUO datasets that
+# were completed and the items that were already enriched or exported.
+# Exported items are checkpointed every CHECKPOINT_INTERVAL items.
+CHECKPOINT_DIR = None
+# CHECKPOINT_DIR = os.path.join(PROJECT_ROOT, 'checkpoints')
+CHECKPOINT_INTERVAL = 1000
+RESUME = False
+
+# Directory in which downloaded files (e.g. the DUO datasets) and pages are
+# cached, or None to disable caching. Cached files are revalidated with
+# conditional GETs (ETag/Last-Modified), so files that did not change are
+# not downloaded again. With `scrapy crawl <spider> -s
+# DOWNLOAD_CACHE_OFFLINE=1`, everything is served from the cache and
+# nothing is downloaded, which makes a crawl reproducible.
+DOWNLOAD_CACHE_DIR = os.path.join(PROJECT_ROOT, 'download_cache')
+DOWNLOAD_CACHE_OFFLINE = False
+
+# Number of worker processes used to validate the items when a spider
+# closes. Items are processed in batches of GEOCODE_BATCH_SIZE, which are
+# sharded by item id over the workers; 0 or 1 validates in the crawler
+# process itself.
+VALIDATION_PROCESSES = 0
+
 from validation.duo import (DuoVoSchool, DuoVoBoard, DuoVoBranch, DuoPoSchool,
                             DuoPoBoard, DuoPoBranch, DuoPaoCollaboration, 
                             DuoMboBoard, DuoMboInstitution)
@@ -232,6 +381,11 @@ EXPORT_SETTINGS = {
     },
 }
 
+# The 'geocode' setting of each spider is either False, True (use BAG42),
+# the name of a geocoding provider ('local', 'bag42' or 'nominatim') or a
+# list of providers that are tried in order, e.g. ['local', 'bag42'] to
+# only call BAG42 for addresses that are not in the local index.
+
 # Allow all settings to be overridden by a local file that is not in
 # the VCS.
 try:
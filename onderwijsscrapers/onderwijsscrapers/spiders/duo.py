@@ -4,20 +4,24 @@ import locale
 import xlrd
 from datetime import datetime
 from os import devnull
-from os.path import basename
+from os.path import basename, exists, join
+from hashlib import sha1
 from zipfile import ZipFile
 from collections import defaultdict
-from itertools import islice, chain
 import pprint
 
-import requests
 from scrapy import log
+from scrapy.conf import settings
 from scrapy.spider import Spider
 from scrapy.http import Request
 
 from onderwijsscrapers.items import (DuoVoBoard, DuoVoSchool, DuoVoBranch,
                                      DuoPoBoard, DuoPoSchool, DuoPoBranch,
                                      DuoPaoCollaboration, DuoMboBoard, DuoMboInstitution)
+from onderwijsscrapers.checkpoints import get_checkpoint
+from onderwijsscrapers.download_cache import get_download_cache
+from onderwijsscrapers.instrumentation import instrumentation
+from onderwijsscrapers.student_flow import StudentFlowIndex
 
 locale.setlocale(locale.LC_ALL, 'nl_NL.UTF-8')
 
@@ -30,13 +34,48 @@ class DuoSpider(Spider):
         self.add_local_table = add_local_table
 
     def start_requests(self):
-        return [
-            Request(
+        checkpoint = get_checkpoint(self.name, settings)
+
+        requests = []
+        for url, parse_row in self.requests.items():
+            if self.url_filter is not None and url != self.url_filter:
+                continue
+
+            # When resuming a crawl, skip the datasets whose items have all
+            # been processed already
+            if checkpoint is not None:
+                if checkpoint.dataset_done(url):
+                    log.msg('Skipping completed dataset %s' % url,
+                            level=log.INFO)
+                    continue
+                parse_row = checkpoint.track_dataset(url, parse_row)
+
+            requests.append(Request(
                 'http://data.duo.nl/organisatie/open_onderwijsdata/databestanden/' + url,
                 # lambda self, response: self.parse_cvs(self, response, parse_row)
                 parse_row
-            ) for url,parse_row in self.requests.items() if (self.url_filter is None or url == self.url_filter)
-        ]
+            ))
+        return requests
+
+    def request_files(self, response, parse_file, extension='csv'):
+        """
+        Request all files with `extension` that are listed on a DUO page,
+        so they are downloaded concurrently by Scrapy. `parse_file` is
+        called with the response, URL and reference date of every file,
+        and returns the items parsed from it.
+        """
+        def parse_file_response(file_response):
+            instrumentation.record('download',
+                                   file_response.meta.get('download_latency', 0),
+                                   items=1)
+            return parse_file(file_response, file_response.meta['file_url'],
+                              file_response.meta['reference_date'])
+
+        for url, reference_date in find_available_datasets(response, extension).iteritems():
+            yield Request(url, parse_file_response, dont_filter=True, meta={
+                'file_url': url,
+                'reference_date': reference_date
+            })
 
     def dataset(self, response, make_item, dataset_name, parse_row):
         """
@@ -59,12 +98,12 @@ class DuoSpider(Spider):
 
         # TODO: add local file loading, refactor student_flow
 
-        for csv_url, reference_date in find_available_datasets(response).iteritems():
+        def parse_file(file_response, csv_url, reference_date):
             reference_year = reference_date.year
             reference_date = str(reference_date)
 
             dataset = {}
-            for row in parse_csv_file(csv_url):
+            for row in parse_csv_file(file_response):
                 for key, value in parse_row(row):
                     # Allow separate years
                     year = value.pop('reference_year', None)
@@ -84,6 +123,8 @@ class DuoSpider(Spider):
                     school[dataset_name] = item
                     yield school
 
+        return self.request_files(response, parse_file)
+
 
 
 def find_available_datasets(response, extension='csv'):
@@ -99,61 +140,90 @@ def find_available_datasets(response, extension='csv'):
         available_datasets['http://duo.nl%s' % dataset_url] = ref_date
     return available_datasets
 
-def extract_csv_files(zip_url):
-    zip_file = requests.get(zip_url)
-
+def extract_csv_files(response):
+    """ Parse the sheets of all XLS files in a downloaded zip file """
     csv_files = []
-    zfiles = ZipFile(cStringIO.StringIO(zip_file.content))
+    zfiles = ZipFile(cStringIO.StringIO(response.body))
     for zfile in zfiles.filelist:
         for sheet in parse_xls_sheets_from_content(zfiles.read(zfile)).values():
             csv_files.append(sheet)
 
     return csv_files
 
-def parse_xls_sheets_from_content(content):
-    """ Download and parse CSV content """
-    xls = cStringIO.StringIO(content)
+def iter_xls_rows(sheet):
+    """
+    Iterate over the rows of an xlrd `sheet` as dicts, keyed by the header
+    in the first row. Values are UTF-8 encoded strings, like the values of
+    a `csv.DictReader`.
+    """
+    if sheet.nrows == 0:
+        return
+
+    header = [unicode(x).encode('utf8') for x in sheet.row_values(0)]
+    for rownum in xrange(1, sheet.nrows):
+        yield dict(zip(header, [unicode(x).encode('utf8')
+                                for x in sheet.row_values(rownum)]))
 
+def parse_xls_sheets_from_content(content, sheet_names=None):
+    """
+    Parse XLS content into a dict of `{sheet name: row iterator}`. Sheets
+    are loaded on demand, so only the sheets in `sheet_names` (default:
+    all sheets) are read.
+    """
     # Suppress warnings as the xls files are wrongly initialized.
     with open(devnull, 'w') as OUT:
-        wb = xlrd.open_workbook(file_contents=xls.read(), logfile=OUT)
+        wb = xlrd.open_workbook(file_contents=content, logfile=OUT,
+                                on_demand=True)
 
     sheets = {}
-    for sheet_name in wb.sheet_names():
-        sh = wb.sheet_by_name(sheet_name)
-        data = []
-        for rownum in xrange(sh.nrows):
-            data.append(sh.row_values(rownum))
-        data = [[unicode(x) for x in row] for row in data]
-        data = [';'.join(row) for row in data]
-        data = '\n'.join(data)
-
-        sheets[sheet_name] = csv.DictReader(cStringIO.StringIO(data.encode('utf8')), delimiter=';')
+    for sheet_name in sheet_names or wb.sheet_names():
+        sheets[sheet_name] = iter_xls_rows(wb.sheet_by_name(sheet_name))
+
+    # The loaded sheets keep their cells; only the file data is released
+    wb.release_resources()
     return sheets
 
-def parse_xls_sheets_from_url(xls_url):
-    """ Download and parse CSV file """
-    xls_file = requests.get(xls_url)
+def parse_xls_sheets_from_response(response, sheet_names=None):
+    """ Parse a downloaded XLS file """
     # don't specify encoding
-    return parse_xls_sheets_from_content(xls_file.content)
-
-def parse_csv_file(csv_url):
-    """ Download and parse CSV file """
-    csv_file = requests.get(csv_url)
-    csv_file.encoding = 'cp1252'
-    csv_file = csv.DictReader(cStringIO.StringIO(csv_file.content
-                  .decode('cp1252').encode('utf8')), delimiter=';')
+    return parse_xls_sheets_from_content(response.body, sheet_names)
+
+def get_xls_rows(response, sheet_name):
+    """
+    Return the rows of sheet `sheet_name` of a downloaded XLS file as a
+    list. They are kept in the meta of the response, which `duo_all`
+    passes to the parsers of several spiders in turn, so the sheet is
+    parsed once.
+    """
+    sheets = response.meta.setdefault('xls_rows', {})
+    if sheet_name not in sheets:
+        sheets[sheet_name] = list(parse_xls_sheets_from_response(
+            response, [sheet_name])[sheet_name])
+    return sheets[sheet_name]
+
+def decode_lines(lines, encoding='cp1252'):
+    """
+    Re-encode `lines` from `encoding` to UTF-8 while they are read, so the
+    `csv` module can parse a file without a decoded copy of all of it.
+    """
+    for line in lines:
+        yield line.decode(encoding).encode('utf8')
+
+def parse_csv_file(response):
+    """ Parse a downloaded CSV file """
+    csv_file = csv.DictReader(decode_lines(cStringIO.StringIO(response.body)),
+                              delimiter=';')
     # todo: is this a dict or an iterator? can we do (whitespace) preprocessing here?
     return csv_file
 
 def int_or_none(value):
     """
         Try to make `value` an int. If the string is not a number,
-        or empty, return None.
+        or empty (or None), return None.
     """
     try:
         return int(value)
-    except ValueError:
+    except (TypeError, ValueError):
         return None
 
 def extend_to_blank(l):
@@ -165,21 +235,377 @@ def extend_to_blank(l):
     return out
 
 
-def get_staff_people(xls_url, with_brin=True):
+# Fields for which a `RowMapping` converter returns OMIT are not set
+OMIT = object()
+
+class RowMapping(object):
     """
-    Primair/Voortgezet onderwijs > Personeel
-    Parse "01. Onderwijspersoneel in aantal personen"
+    Declarative mapping of the columns of a DUO file to the fields of an
+    item. The mapping is compiled once per file, for the columns it has.
+
+    `fields` is a list of `(field, columns, convert)`: `field` may be a
+    dotted path into nested dicts (e.g. 'address.city'), `columns` is the
+    name of a column or a tuple of names, of which the values are passed to
+    `convert` (None keeps the value of a single column as is). Values are
+    stripped once per row, and empty values are replaced by `blank`.
+
+    Column names are stripped as well, and `aliases` maps other names of
+    a column to the name used in `fields`. Fields in `optional` are left
+    out for files that do not have their columns.
+    """
+    def __init__(self, fields, aliases=None, optional=(), blank=''):
+        self.fields = fields
+        self.aliases = aliases or {}
+        self.optional = optional
+        self.blank = blank
+
+    def compile(self, columns):
+        """ Return a function that maps a row with `columns` to a dict """
+        names = {}
+        for column in columns:
+            # extra values of a row are in the `None` column of DictReader
+            if column is None:
+                continue
+            name = column.strip()
+            names[self.aliases.get(name, name)] = column
+
+        plan = []
+        for field, sources, convert in self.fields:
+            if isinstance(sources, basestring):
+                sources = (sources,)
+            missing = [source for source in sources if source not in names]
+            if missing:
+                if field in self.optional:
+                    continue
+                raise KeyError('Missing column(s) %s' % ', '.join(missing))
+            plan.append((field.split('.'), [names[s] for s in sources], convert))
+
+        used = set(column for _, columns, _ in plan for column in columns)
+        blank = self.blank
+
+        def map_row(row):
+            values = {}
+            for column in used:
+                values[column] = row[column].strip() or blank
+
+            fields = {}
+            for path, columns, convert in plan:
+                if convert is None:
+                    value = values[columns[0]]
+                else:
+                    value = convert(*[values[column] for column in columns])
+                if value is OMIT:
+                    continue
+
+                target = fields
+                for key in path[:-1]:
+                    target = target.setdefault(key, {})
+                target[path[-1]] = value
+            return fields
+
+        return map_row
+
+    def map_rows(self, rows):
+        """ Iterate over the fields of every row in `rows` """
+        map_row = None
+        for row in rows:
+            if map_row is None:
+                map_row = self.compile(row.keys())
+            yield map_row(row)
+
+def text_or_none(value):
+    return value or None
+
+def zip_code(value):
+    return value.replace(' ', '') if value else value
+
+def zip_code_or_none(value):
+    return zip_code(value) or None
+
+def street(name, number):
+    return '%s %s' % (name, number)
+
+def street_or_none(name, number):
+    return street(name, number) if name else None
+
+def int_or_omit(value):
+    return int(value) if value else OMIT
+
+def text_or_omit(value):
+    return value or OMIT
+
+def split_or_none(value):
+    """ Transform 'VMBO/HAVO' into ['VMBO', 'HAVO'] """
+    return value.split('/') if value else None
+
+def branch_id(number, brin):
+    """ Branch number without the BRIN number, e.g. '00AA01' into 1 """
+    return int(number.replace(brin, '')) if number else OMIT
+
+def collaboration_id(cid):
+    if '-' in cid:
+        int_parts = map(int_or_none, cid.split('-'))
+        if any([i == None for i in int_parts]):
+            cid = '-'.join(map(str, int_parts))
+    return cid
+
+ADDRESS_FIELDS = [
+    ('address.street', ('STRAATNAAM', 'HUISNUMMER-TOEVOEGING'), street),
+    ('address.zip_code', 'POSTCODE', zip_code),
+    ('address.city', 'PLAATSNAAM', None),
+]
+
+CORRESPONDENCE_ADDRESS_FIELDS = [
+    ('correspondence_address.street', ('STRAATNAAM CORRESPONDENTIEADRES',
+        'HUISNUMMER-TOEVOEGING CORRESPONDENTIEADRES'), street),
+    ('correspondence_address.zip_code', 'POSTCODE CORRESPONDENTIEADRES',
+        zip_code),
+    ('correspondence_address.city', 'PLAATSNAAM CORRESPONDENTIEADRES', None),
+]
+
+# Empty correspondence addresses are None
+OPTIONAL_CORRESPONDENCE_ADDRESS_FIELDS = [
+    ('correspondence_address.street', ('STRAATNAAM CORRESPONDENTIEADRES',
+        'HUISNUMMER-TOEVOEGING CORRESPONDENTIEADRES'), street_or_none),
+    ('correspondence_address.zip_code', 'POSTCODE CORRESPONDENTIEADRES',
+        zip_code_or_none),
+    ('correspondence_address.city', 'PLAATSNAAM CORRESPONDENTIEADRES',
+        text_or_none),
+]
+
+AREA_FIELDS = [
+    ('nodal_area', 'NODAAL GEBIED NAAM', text_or_none),
+    ('nodal_area_code', 'NODAAL GEBIED CODE', int_or_none),
+    ('rpa_area', 'RPA-GEBIED NAAM', text_or_none),
+    ('rpa_area_code', 'RPA-GEBIED CODE', int_or_none),
+    ('wgr_area', 'WGR-GEBIED NAAM', text_or_none),
+    ('wgr_area_code', 'WGR-GEBIED CODE', int_or_none),
+    ('corop_area', 'COROPGEBIED NAAM', text_or_none),
+    ('education_area', 'ONDERWIJSGEBIED NAAM', text_or_none),
+    ('education_area_code', 'ONDERWIJSGEBIED CODE', int_or_none),
+    ('rmc_region', 'RMC-REGIO NAAM', text_or_none),
+    ('rmc_region_code', 'RMC-REGIO CODE', int_or_none),
+]
+
+# Vo/po "Adressen bevoegde gezagen"
+BOARD_COLUMNS = RowMapping(ADDRESS_FIELDS + OPTIONAL_CORRESPONDENCE_ADDRESS_FIELDS + [
+    ('board_id', 'BEVOEGD GEZAG NUMMER', int),
+    ('name', 'BEVOEGD GEZAG NAAM', None),
+    ('municipality', 'GEMEENTENAAM', text_or_none),
+    ('municipality_code', 'GEMEENTENUMMER', int_or_none),
+    ('phone', 'TELEFOONNUMMER', text_or_none),
+    ('website', 'INTERNETADRES', text_or_none),
+    ('denomination', 'DENOMINATIE', text_or_none),
+    ('administrative_office_id', 'ADMINISTRATIEKANTOORNUMMER', int_or_none),
+])
+
+# Vo/po "Adressen hoofdvestigingen"; all empty values are None
+SCHOOL_FIELDS = ADDRESS_FIELDS + CORRESPONDENCE_ADDRESS_FIELDS + AREA_FIELDS + [
+    ('board_id', 'BEVOEGD GEZAG NUMMER', int),
+    ('brin', 'BRIN NUMMER', None),
+    ('province', 'PROVINCIE', None),
+    ('name', 'INSTELLINGSNAAM', None),
+    ('municipality', 'GEMEENTENAAM', None),
+    ('denomination', 'DENOMINATIE', None),
+    ('website', 'INTERNETADRES', None),
+    ('phone', 'TELEFOONNUMMER', None),
+    ('corop_area_code', 'COROPGEBIED CODE', int_or_omit),
+]
+
+VO_SCHOOL_COLUMNS = RowMapping(SCHOOL_FIELDS + [
+    ('municipality_code', 'GEMEENTENUMMER', int_or_none),
+    ('education_structures', 'ONDERWIJSSTRUCTUUR', split_or_none),
+], blank=None)
+
+PO_SCHOOL_COLUMNS = RowMapping(SCHOOL_FIELDS + [
+    ('municipality_code', 'GEMEENTENUMMER', int),
+], blank=None)
+
+# Vo/po "Adressen (alle) vestigingen"
+BRANCH_FIELDS = ADDRESS_FIELDS + OPTIONAL_CORRESPONDENCE_ADDRESS_FIELDS + AREA_FIELDS + [
+    ('name', 'VESTIGINGSNAAM', None),
+    ('website', 'INTERNETADRES', text_or_none),
+    ('denomination', 'DENOMINATIE', text_or_none),
+    ('province', 'PROVINCIE', text_or_none),
+    ('board_id', 'BEVOEGD GEZAG NUMMER', int_or_none),
+    ('brin', 'BRIN NUMMER', text_or_omit),
+    ('branch_id', ('VESTIGINGSNUMMER', 'BRIN NUMMER'), branch_id),
+    ('municipality', 'GEMEENTENAAM', text_or_none),
+    ('municipality_code', 'GEMEENTENUMMER', int_or_none),
+    ('phone', 'TELEFOONNUMMER', text_or_none),
+    ('corop_area_code', 'COROPGEBIED CODE', int_or_none),
+]
+
+VO_BRANCH_COLUMNS = RowMapping(BRANCH_FIELDS + [
+    ('education_structures', 'ONDERWIJSSTRUCTUUR', split_or_none),
+])
+
+# In the special education set, the BRIN number column has no space
+PO_BRANCH_COLUMNS = RowMapping(BRANCH_FIELDS,
+                               aliases={'BRINNUMMER': 'BRIN NUMMER'},
+                               optional=('branch_id',))
+
+# Passend onderwijs "Adressen samenwerkingsverbanden"
+COLLABORATION_COLUMNS = RowMapping([
+    ('collaboration_id', 'ADMINISTRATIENUMMER', collaboration_id),
+    ('name', 'SAMENWERKINGSVERBAND', None),
+    ('address.street', 'ADRES', text_or_none),
+    ('address.city', 'PLAATSNAAM', text_or_none),
+    ('address.zip_code', 'POSTCODE', zip_code_or_none),
+    ('correspondence_address.street', 'CORRESPONDENTIEADRES', None),
+    ('correspondence_address.city', 'PLAATS CORRESPONDENTIEADRES', None),
+    ('correspondence_address.zip_code', 'POSTCODE CORRESPONDENTIEADRES',
+        zip_code),
+])
+
+# Mbo "Adressen bevoegde gezagen"
+MBO_BOARD_COLUMNS = RowMapping(ADDRESS_FIELDS + CORRESPONDENCE_ADDRESS_FIELDS + [
+    ('board_id', 'BEVOEGD GEZAG NUMMER', int),
+    ('administrative_office_id', 'ADMINISTRATIEKANTOORNUMMER', int_or_none),
+    ('denomination', 'DENOMINATIE', None),
+    ('municipality', 'GEMEENTENAAM', None),
+    ('municipality_code', 'GEMEENTENUMMER', int),
+    ('name', 'BEVOEGD GEZAG NAAM', None),
+    ('phone', 'TELEFOONNUMMER', None),
+    ('website', 'INTERNETADRES', None),
+])
+
+# Mbo "Adressen instellingen"
+MBO_INSTITUTION_COLUMNS = RowMapping(ADDRESS_FIELDS + CORRESPONDENCE_ADDRESS_FIELDS + [
+    ('brin', 'BRIN NUMMER', None),
+    ('board_id', 'BEVOEGD GEZAG NUMMER', None),
+    ('name', 'INSTELLINGSNAAM', None),
+    ('denomination', 'DENOMINATIE', None),
+    ('municipality', 'GEMEENTENAAM', None),
+    ('municipality_code', 'GEMEENTENUMMER', int),
+    ('phone', 'TELEFOONNUMMER', None),
+    ('website', 'INTERNETADRES', None),
+    ('corop_area', 'COROPGEBIED NAAM', None),
+    ('corop_area_code', 'COROPGEBIED CODE', int),
+    ('nodal_area', 'NODAAL GEBIED NAAM', None),
+    ('nodal_area_code', 'NODAAL GEBIED CODE', int),
+    ('education_area', 'ONDERWIJSGEBIED NAAM', None),
+    ('education_area_code', 'ONDERWIJSGEBIED CODE', int),
+    ('rpa_area', 'RPA-GEBIED NAAM', None),
+    ('rpa_area_code', 'RPA-GEBIED CODE', int),
+    ('rmc_region', 'RMC-REGIO NAAM', None),
+    ('rmc_region_code', 'RMC-REGIO CODE', int),
+    ('wgr_area', 'NAAM WGR-GEBIED', None),
+    ('wgr_area_code', 'WGR-GEBIED CODE', int),
+    ('mbo_institution_kind', 'MBO INSTELLINGSSOORT - NAAM', None),
+    ('mbo_institution_kind_code', 'MBO INSTELLINGSOORT - CODE', None),
+])
+
+def to_count(value):
+    return int(float(value or 0))
+
+def to_float(value):
+    return float(value or 0)
+
+def to_float_or_none(value):
+    # mean ages: 0 means missing
+    return float(value or 0) or None
+
+# Columns of the DUO staff files, per measure and year (e.g. "MANNEN 2012").
+# `fields` maps the words before the year to a field and converter;
+# `prefix` precedes the words of the workload and age ranges (e.g.
+# "FTE'S PERSONEN 25-35 JAAR 2012").
+STAFF_PEOPLE_COLUMNS = {
+    'total': 'staff',
+    'prefix': (),
+    'value': 'count',
+    'convert': to_count,
+    'workload': 'staff_workload',
+    'age': 'staff_age',
+    'fields': {
+        ('PERSONEN',): ('staff', to_count),
+        ('MANNEN',): ('staff_male', to_count),
+        ('VROUWEN',): ('staff_female', to_count),
+        ('GESLACHT', 'ONBEKEND'): ('staff_gender_unknown', to_count),
+        ('GEMIDDELDE', 'LEEFTIJD'): ('age_mean', to_float_or_none),
+        ('GEMIDDELDE', 'LEEFTIJD', 'MAN'): ('age_mean_male', to_float_or_none),
+        ('GEMIDDELDE', 'LEEFTIJD', 'VROUW'): ('age_mean_female', to_float_or_none),
+        ('GEMIDDELDE', "FTE'S"): ('workload_mean', to_float),
+        ('PERSONEN', 'IN', 'TIJDELIJKE', 'DIENST'): ('staff_temp', to_count),
+        ('PERSONEN', 'IN', 'VASTE', 'DIENST'): ('staff_perm', to_count),
+    }
+}
+
+STAFF_FTE_COLUMNS = {
+    'total': 'fte',
+    'prefix': ("FTE'S",),
+    'value': 'fte',
+    'convert': to_float,
+    'workload': 'fte_workload',
+    'age': 'fte_age',
+    'fields': {
+        ("FTE'S",): ('fte', to_float),
+        ("FTE'S", 'MANNEN'): ('fte_male', to_float),
+        ("FTE'S", 'VROUWEN'): ('fte_female', to_float),
+        ("FTE'S", 'GESLACHT', 'ONBEKEND'): ('fte_gender_unknown', to_float),
+        # The mean age and workload are already present in staff_people
+        ("FTE'S", 'PERSONEN', 'IN', 'TIJDELIJKE', 'DIENST'): ('fte_temp', to_float),
+        ("FTE'S", 'PERSONEN', 'IN', 'VASTE', 'DIENST'): ('fte_perm', to_float),
+    }
+}
+
+def compile_staff_plan(columns, spec):
+    """
+    Map the `columns` of a staff file to the values they contain, once per
+    file instead of for every row.
 
-    Both on school and board level
+    returns the set of years, and a list of `(column, year, field, range,
+    converter)`, where `range` is None for fields and the range for the
+    entries of the workload and age lists.
+    """
+    years = set()
+    plan = []
+    prefix = list(spec['prefix'])
+    n = len(prefix)
+    for column in columns:
+        key = column.split()
+        if not key or not (key[-1].isdigit() and len(key[-1]) == 4):
+            continue
+
+        year = int(key[-1])
+        years.add(year)
+
+        if tuple(key[:-1]) in spec['fields']:
+            field, convert = spec['fields'][tuple(key[:-1])]
+            plan.append((column, year, field, None, convert))
+
+        if key[:n + 1] == prefix + ['PERSONEN'] and key[-2] == "FTE'S":
+            key_range = '>%s' % key[-3] if key[n + 1] == 'MEER' \
+                   else ''.join(key[n + 1:-2])
+            plan.append((column, year, spec['workload'], key_range,
+                         spec['convert']))
+
+        if key[:n + 1] == prefix + ['PERSONEN'] and key[-2] == 'JAAR':
+            key_range = '>%s' % key[-3] if key[n + 1] == 'OUDER' \
+                   else '<%s' % key[-3] if key[n + 1] == 'JONGER' \
+                   else ''.join(key[n + 1:-2])
+            plan.append((column, year, spec['age'], key_range,
+                         spec['convert']))
+
+        if key[:-1] == prefix + ['LEEFTIJD', 'ONBEKEND']:
+            plan.append((column, year, spec['age'], '?', spec['convert']))
+
+    return years, plan
+
+def parse_staff_file(response, spec, with_brin=True):
+    """
+    Parse the 'per owtype-bestuur-brin-functie' sheet of a staff file with
+    the columns in `spec`.
 
-    returns dict of `{(year, brin/board id): {staff dict}}`
+    returns dict of `{(year, brin/board id): [{staff per function group}]}`
     """
-    staff_per_school = {}
+    staff_per_item = {}
+    total, value = spec['total'], spec['value']
+    years, plan = None, None
 
-    sheets = parse_xls_sheets_from_url(xls_url)
-    for row in islice(sheets['per owtype-bestuur-brin-functie'], None):
-        brinnr = row.pop('BRIN NUMMER', None).strip()
-        boardnr = int(float(row.pop('BEVOEGD GEZAG', None)))
+    for row in get_xls_rows(response, 'per owtype-bestuur-brin-functie'):
+        brinnr = row['BRIN NUMMER'].strip()
+        boardnr = int(float(row['BEVOEGD GEZAG']))
 
         item_id = None
         if with_brin and brinnr != 'bovenschools':
@@ -187,230 +613,89 @@ def get_staff_people(xls_url, with_brin=True):
         if (not with_brin) and brinnr == 'bovenschools':
             item_id = boardnr
 
-        if item_id is not None:
-            fg = row.pop('FUNCTIEGROEP', None)
-            staff_per_year = {}
-
-            # loop over all rows, filtering key names and extracting year
-            for key, val in row.items():
-                key = key.split()
-                if key[-1].isdigit() and len(key[-1]) == 4:
-
-                    year = int(key[-1])
-                    if year not in staff_per_year:
-                        staff_per_year[year] = {}
-
-                    # missing values are starred, for privacy reasons
-                    if val != '*':
-                        if key[:-1] == ['PERSONEN']:
-                            staff_per_year[year]['staff'] = int(float(val or 0))
-
-                        if key[:-1] == ['MANNEN']:
-                            staff_per_year[year]['staff_male'] = int(float(val or 0))
-                        if key[:-1] == ['VROUWEN']:
-                            staff_per_year[year]['staff_female'] = int(float(val or 0))
-                        if key[:-1] == ['GESLACHT', 'ONBEKEND']:
-                            staff_per_year[year]['staff_gender_unknown'] = int(float(val or 0))
-
-                        # mean ages: 0 means missing
-                        if key[:-1] == ['GEMIDDELDE', 'LEEFTIJD']:
-                            staff_per_year[year]['age_mean'] = float(val or 0) or None
-                        if key[:-1] == ['GEMIDDELDE', 'LEEFTIJD', 'MAN']:
-                            staff_per_year[year]['age_mean_male'] = float(val or 0) or None
-                        if key[:-1] == ['GEMIDDELDE', 'LEEFTIJD', 'VROUW']:
-                            staff_per_year[year]['age_mean_female'] = float(val or 0) or None
-
-                        if key[:-1] == ['GEMIDDELDE', "FTE'S"]:
-                            staff_per_year[year]['workload_mean'] = float(val or 0)
-
-                        if key[:-1] == ['PERSONEN', 'IN', 'TIJDELIJKE', 'DIENST']:
-                            staff_per_year[year]['staff_temp'] = int(float(val or 0))
-                        if key[:-1] == ['PERSONEN', 'IN', 'VASTE', 'DIENST']:
-                            staff_per_year[year]['staff_perm'] = int(float(val or 0))
-
-                        if 'staff_workload' not in staff_per_year[year]:
-                            staff_per_year[year]['staff_workload'] = []
-                        if key[0] == 'PERSONEN' and key[-2] == "FTE'S":
-                            key_range = '>%s' % key[-3] if key[1] == 'MEER' else ''.join(key[1:-2])
-                            staff_per_year[year]['staff_workload'].append({
-                                'range': key_range,
-                                'count': int(float(val or 0)),
-                            })
+        if item_id is None:
+            continue
 
-                        if 'staff_age' not in staff_per_year[year]:
-                            staff_per_year[year]['staff_age'] = []
-                        if key[0] == 'PERSONEN' and key[-2] == 'JAAR':
-                            key_range = '>%s' % key[-3] if key[1] == 'OUDER' \
-                                   else '<%s' % key[-3] if key[1] == 'JONGER' \
-                                   else ''.join(key[1:-2])
-                            staff_per_year[year]['staff_age'].append({
-                                'range': key_range,
-                                'count': int(float(val or 0)),
-                            })
-                        if key[:-1] == ['LEEFTIJD', 'ONBEKEND']:
-                            staff_per_year[year]['staff_age'].append({
-                                'range': '?',
-                                'count': int(float(val or 0)),
-                            })
+        if plan is None:
+            years, plan = compile_staff_plan(row.keys(), spec)
+
+        staff_per_year = dict((year, {}) for year in years)
+        for column, year, field, key_range, convert in plan:
+            val = row[column]
+            # missing values are starred, for privacy reasons
+            if val == '*':
+                continue
 
-            # add rows per function group
-            for year, staff in staff_per_year.items():
-                if (year, item_id) not in staff_per_school:
-                    staff_per_school[(year, item_id)] = []
+            # the workload and age lists are only added to the years that
+            # have a value
+            staff = staff_per_year[year]
+            if not staff:
+                staff[spec['workload']] = []
+                staff[spec['age']] = []
 
-                staff_per_school[(year, item_id)].append({
-                    'function_group': fg,
-                    'staff': staff if staff['staff'] else {'staff': 0},
+            if key_range is None:
+                staff[field] = convert(val)
+            else:
+                staff[field].append({
+                    'range': key_range,
+                    value: convert(val),
                 })
 
-    return staff_per_school
+        # add rows per function group
+        for year, staff in staff_per_year.iteritems():
+            staff_per_item.setdefault((year, item_id), []).append({
+                'function_group': row.get('FUNCTIEGROEP'),
+                total: staff if staff.get(total) else {total: 0},
+            })
+
+    return staff_per_item
 
-def get_staff_fte(xls_url, with_brin=True):
+def get_staff_people(response, with_brin=True):
     """
     Primair/Voortgezet onderwijs > Personeel
-    Parse "02. Onderwijspersoneel in aantal fte"
+    Parse "01. Onderwijspersoneel in aantal personen"
 
     Both on school and board level
 
     returns dict of `{(year, brin/board id): {staff dict}}`
     """
-    fte_per_school = {}
+    return parse_staff_file(response, STAFF_PEOPLE_COLUMNS, with_brin)
 
-    sheets = parse_xls_sheets_from_url(xls_url)
-    for row in islice(sheets['per owtype-bestuur-brin-functie'], None):
-        brinnr = row.pop('BRIN NUMMER', None).strip()
-        boardnr = int(float(row.pop('BEVOEGD GEZAG', None)))
-
-        item_id = None
-        if with_brin and brinnr != 'bovenschools':
-            item_id = brinnr
-        if (not with_brin) and brinnr == 'bovenschools':
-            item_id = boardnr
-
-        if item_id is not None:
-            fg = row.pop('FUNCTIEGROEP', None)
-            fte_per_year = {}
-
-            # loop over all rows, filtering key names and extracting year
-            for key, val in row.items():
-                key = key.split()
-                if key[-1].isdigit() and len(key[-1]) == 4:
-
-                    year = int(key[-1])
-                    if year not in fte_per_year:
-                        fte_per_year[year] = {}
-
-                    # missing values are starred, for privacy reasons
-                    if val != '*':
-                        if key[:-1] == ["FTE'S"]:
-                            fte_per_year[year]['fte'] = float(val or 0)
-
-                        if key[:-1] == ["FTE'S", 'MANNEN']:
-                            fte_per_year[year]['fte_male'] = float(val or 0)
-                        if key[:-1] == ["FTE'S", 'VROUWEN']:
-                            fte_per_year[year]['fte_female'] = float(val or 0)
-                        if key[:-1] == ["FTE'S", 'GESLACHT', 'ONBEKEND']:
-                            fte_per_year[year]['fte_gender_unknown'] = float(val or 0)
-
-                        # These fields are already present in staff_people
-                        # mean ages: 0 means missing
-                        # if key[:-1] == ['GEMIDDELDE', 'LEEFTIJD']:
-                        #     fte_per_year[year]['age_mean'] = float(val or 0) or None
-                        # if key[:-1] == ['GEMIDDELDE', 'LEEFTIJD', 'MAN']:
-                        #     fte_per_year[year]['age_mean_male'] = float(val or 0) or None
-                        # if key[:-1] == ['GEMIDDELDE', 'LEEFTIJD', 'VROUW']:
-                        #     fte_per_year[year]['age_mean_female'] = float(val or 0) or None
-                        # if key[:-1] == ['GEMIDDELDE', "FTE'S"]:
-                        #     fte_per_year[year]['workload_mean'] = float(val or 0)
-
-                        if key[:-1] == ["FTE'S", 'PERSONEN', 'IN', 'TIJDELIJKE', 'DIENST']:
-                            fte_per_year[year]['fte_temp'] = float(val or 0)
-                        if key[:-1] == ["FTE'S", 'PERSONEN', 'IN', 'VASTE', 'DIENST']:
-                            fte_per_year[year]['fte_perm'] = float(val or 0)
-
-                        if 'fte_workload' not in fte_per_year[year]:
-                            fte_per_year[year]['fte_workload'] = []
-                        if key[0:2] == ["FTE'S", 'PERSONEN'] and key[-2] == "FTE'S":
-                            key_range = '>%s' % key[-3] if key[2] == 'MEER' else ''.join(key[2:-2])
-                            fte_per_year[year]['fte_workload'].append({
-                                'range': key_range,
-                                'fte': float(val or 0),
-                            })
-
-                        if 'fte_age' not in fte_per_year[year]:
-                            fte_per_year[year]['fte_age'] = []
-                        if key[0:2] == ["FTE'S", 'PERSONEN'] and key[-2] == 'JAAR':
-                            key_range = '>%s' % key[-3] if key[2] == 'OUDER' \
-                                   else '<%s' % key[-3] if key[2] == 'JONGER' \
-                                   else ''.join(key[2:-2])
-                            fte_per_year[year]['fte_age'].append({
-                                'range': key_range,
-                                'fte': float(val or 0),
-                            })
-                        if key[:-1] == ["FTE'S", 'LEEFTIJD', 'ONBEKEND']:
-                            fte_per_year[year]['fte_age'].append({
-                                'range': '?',
-                                'fte': float(val or 0),
-                            })
-
-            # add rows per function group
-            for year, staff in fte_per_year.items():
-                if (year, item_id) not in fte_per_school:
-                    fte_per_school[(year, item_id)] = []
-
-                fte_per_school[(year, item_id)].append({
-                    'function_group': fg,
-                    'fte': staff if staff['fte'] else {'fte': 0},
-                })
+def get_staff_fte(response, with_brin=True):
+    """
+    Primair/Voortgezet onderwijs > Personeel
+    Parse "02. Onderwijspersoneel in aantal fte"
 
-    return fte_per_school
+    Both on school and board level
 
-def get_student_flow(table, for_po=True):
+    returns dict of `{(year, brin/board id): {staff dict}}`
     """
-    Stroominformatie > Doorstromers
-    05. Doorstromers van primair naar voortgezet onderwijs
+    return parse_staff_file(response, STAFF_FTE_COLUMNS, with_brin)
 
-    both relevant for po and vo
+def get_student_flow_index(response):
     """
-    table = csv.DictReader(islice(table, 2, None), delimiter=';')
-    table.fieldnames = [
-        'BRIN NUMMER PO',
-        'VESTIGINGSNUMMER PO',
-        'INSTELLINGSNAAM PO',
-        'STRAATNAAM PO',
-        'PLAATSNAAM PO',
-        'BRIN NUMMER VO',
-        'VESTIGINGSNUMMER VO',
-        'INSTELLINGSNAAM VO',
-        'STRAATNAAM VO',
-        'PLAATSNAAM VO',
-        'AANTAL DOORSTROMERS',
-    ]
-
-    flow_per_branch = {}
-    for row in table:
-        po_brin = row['BRIN NUMMER PO']
-        po_branch_id = int(row['VESTIGINGSNUMMER PO'])
-        vo_brin = row['BRIN NUMMER VO']
-        vo_branch_id = int(row['VESTIGINGSNUMMER VO'])
-        if for_po:
-            if (po_brin, po_branch_id) not in flow_per_branch:
-                flow_per_branch[(po_brin, po_branch_id)] = []
-            flow_per_branch[(po_brin, po_branch_id)].append({
-                'to_vo_brin': vo_brin,
-                'to_vo_branch_id': vo_branch_id,
-                'out_flow': int(row['AANTAL DOORSTROMERS']),
-            })
+    Return the `StudentFlowIndex` of the flow table in `response`. It is
+    kept in the meta of the response, which `duo_all` passes to the po and
+    vo branch parsers in turn, so they share the index and it is released
+    together with the response. The index is saved in the download cache
+    (if enabled) for later crawls.
+    """
+    if 'student_flow_index' not in response.meta:
+        path = None
+        cache = get_download_cache(settings)
+        if cache is not None:
+            digest = sha1(response.body).hexdigest()
+            path = join(cache.cache_dir, '%s.flow' % digest)
+
+        if path is not None and exists(path):
+            index = StudentFlowIndex.load(path)
         else:
-            if (vo_brin, vo_branch_id) not in flow_per_branch:
-                flow_per_branch[(vo_brin, vo_branch_id)] = []
-            flow_per_branch[(vo_brin, vo_branch_id)].append({
-                'from_po_brin': po_brin,
-                'from_po_branch_id': po_branch_id,
-                'in_flow': int(row['AANTAL DOORSTROMERS']),
-            })
-
-    return flow_per_branch
+            index = StudentFlowIndex.from_table(
+                decode_lines(cStringIO.StringIO(response.body)))
+            if path is not None:
+                index.save(path)
+        response.meta['student_flow_index'] = index
+    return response.meta['student_flow_index']
 
 
 class DuoVoBoardsSpider(DuoSpider):
@@ -436,53 +721,16 @@ class DuoVoBoardsSpider(DuoSpider):
         """
         Parse "03. Adressen bevoegde gezagen"
         """
-        for csv_url, reference_date in find_available_datasets(response).iteritems():
+        def parse_file(file_response, csv_url, reference_date):
             reference_year = reference_date.year
-            reference_date = str(reference_date)
-            for row in parse_csv_file(csv_url):
-                # strip leading and trailing whitespace.
-                for key in row.keys():
-                    row[key] = row[key].strip()
-
-                board = DuoVoBoard()
-                board['board_id'] = int(row['BEVOEGD GEZAG NUMMER'])
-                board['name'] = row['BEVOEGD GEZAG NAAM']
-                board['address'] = {
-                    'street': '%s %s' % (row['STRAATNAAM'],
-                                         row['HUISNUMMER-TOEVOEGING']),
-                    'zip_code': row['POSTCODE'].replace(' ', ''),
-                    'city': row['PLAATSNAAM']
-                }
-
-                board['correspondence_address'] = {}
-                if row['STRAATNAAM CORRESPONDENTIEADRES']:
-                    board['correspondence_address']['street'] = '%s %s'\
-                        % (row['STRAATNAAM CORRESPONDENTIEADRES'],
-                           row['HUISNUMMER-TOEVOEGING CORRESPONDENTIEADRES'])
-                else:
-                    board['correspondence_address']['street'] = None
-
-                board['correspondence_address']['zip_code'] = row[
-                        'POSTCODE CORRESPONDENTIEADRES'].replace(' ', '') or None
-
-                board['correspondence_address']['city'] = row[
-                        'PLAATSNAAM CORRESPONDENTIEADRES'] or None
-
-                board['municipality'] = row['GEMEENTENAAM'] or None
-
-                board['municipality_code'] = int_or_none(row['GEMEENTENUMMER'])
-
-                board['phone'] = row['TELEFOONNUMMER'] or None
-
-                board['website'] = row['INTERNETADRES'] or None
-
-                board['denomination'] = row['DENOMINATIE'] or None
-
-                board['administrative_office_id'] = int_or_none(row['ADMINISTRATIEKANTOORNUMMER'])
+            for fields in BOARD_COLUMNS.map_rows(parse_csv_file(file_response)):
+                yield DuoVoBoard(
+                    reference_year=reference_year,
+                    ignore_id_fields=['reference_year'],
+                    **fields
+                )
 
-                board['reference_year'] = reference_year
-                board['ignore_id_fields'] = ['reference_year']
-                yield board
+        return self.request_files(response, parse_file)
 
     def parse_financial_key_indicators(self, response):
         """
@@ -557,10 +805,10 @@ class DuoVoBoardsSpider(DuoSpider):
         Parse "01. Onderwijspersoneel in aantal personen"
         """
 
-        for xls_url, reference_date in find_available_datasets(response, extension='xls').iteritems():
+        def parse_file(file_response, xls_url, reference_date):
             reference_year = reference_date.year # different years in document
             reference_date = str(reference_date)
-            staff_per_board = get_staff_people(xls_url, with_brin=False)
+            staff_per_board = get_staff_people(file_response, with_brin=False)
 
             for (year, board_id), per_board in staff_per_board.iteritems():
                 board = DuoVoBoard(
@@ -572,16 +820,18 @@ class DuoVoBoardsSpider(DuoSpider):
                 )
                 yield board
 
+        return self.request_files(response, parse_file, extension='xls')
+
     def parse_vo_staff_fte(self, response):
         """
         Voortgezet onderwijs > Personeel
         Parse "02. Onderwijspersoneel in aantal fte"
         """
 
-        for xls_url, reference_date in find_available_datasets(response, extension='xls').iteritems():
+        def parse_file(file_response, xls_url, reference_date):
             reference_year = reference_date.year # different years in document
             reference_date = str(reference_date)
-            staff_per_board = get_staff_fte(xls_url, with_brin=False)
+            staff_per_board = get_staff_fte(file_response, with_brin=False)
 
             for (year, board_id), per_board in staff_per_board.iteritems():
                 board = DuoVoBoard(
@@ -593,6 +843,8 @@ class DuoVoBoardsSpider(DuoSpider):
                 )
                 yield board
 
+        return self.request_files(response, parse_file, extension='xls')
+
 class DuoVoSchoolsSpider(DuoSpider):
     name = 'duo_vo_schools'
 
@@ -625,74 +877,16 @@ class DuoVoSchoolsSpider(DuoSpider):
         Parse: "01. Adressen hoofdvestigingen"
         """
 
-        # Fields that do not need additonal processing
-        school_fields = {
-            'BRIN NUMMER': 'brin',
-            'PROVINCIE': 'province',
-            'INSTELLINGSNAAM': 'name',
-            'GEMEENTENAAM': 'municipality',
-            'DENOMINATIE': 'denomination',
-            'INTERNETADRES': 'website',
-            'TELEFOONNUMMER': 'phone',
-            'ONDERWIJSGEBIED NAAM': 'education_area',
-            'NODAAL GEBIED NAAM': 'nodal_area',
-            'RPA-GEBIED NAAM': 'rpa_area',
-            'WGR-GEBIED NAAM': 'wgr_area',
-            'COROPGEBIED NAAM': 'corop_area',
-            'RMC-REGIO NAAM': 'rmc_region'
-        }
-
-        for csv_url, reference_date in find_available_datasets(response).iteritems():
+        def parse_file(file_response, csv_url, reference_date):
             reference_year = reference_date.year
-            reference_date = str(reference_date)
-            for row in parse_csv_file(csv_url):
-                # strip leading and trailing whitespace.
-                for key in row.keys():
-                    value = row[key].strip()
-                    row[key] = value or None
-
-                school = DuoVoSchool()
-                school['board_id'] = int(row['BEVOEGD GEZAG NUMMER'])
-                school['address'] = {
-                    'street': '%s %s' % (row['STRAATNAAM'],
-                                         row['HUISNUMMER-TOEVOEGING']),
-                    'city': row['PLAATSNAAM'],
-                    'zip_code': row['POSTCODE'].replace(' ', '')
-                }
-
-                school['correspondence_address'] = {
-                    'street': '%s %s' % (row['STRAATNAAM CORRESPONDENTIEADRES'],
-                                         row['HUISNUMMER-TOEVOEGING '
-                                             'CORRESPONDENTIEADRES']),
-                    'city': row['PLAATSNAAM CORRESPONDENTIEADRES'],
-                    'zip_code': row['POSTCODE CORRESPONDENTIEADRES'].replace(' ', '')
-                }
-
-                school['municipality_code'] = int_or_none(row['GEMEENTENUMMER'])
-                school['education_structures'] = row['ONDERWIJSSTRUCTUUR']
-                if school['education_structures']:
-                    school['education_structures'] = school['education_structures'].split('/')
-
-                if row['COROPGEBIED CODE']:
-                    school['corop_area_code'] = int(row['COROPGEBIED CODE'])
-
-                school['nodal_area_code'] = int_or_none(row['NODAAL GEBIED CODE'])
-
-                school['rpa_area_code'] = int_or_none(row['RPA-GEBIED CODE'])
-
-                school['wgr_area_code'] = int_or_none(row['WGR-GEBIED CODE'])
-
-                school['education_area_code'] = int_or_none(row['ONDERWIJSGEBIED CODE'])
-
-                school['rmc_region_code'] = int_or_none(row['RMC-REGIO CODE'])
-
-                for field, field_norm in school_fields.iteritems():
-                    school[field_norm] = row[field]
+            for fields in VO_SCHOOL_COLUMNS.map_rows(parse_csv_file(file_response)):
+                yield DuoVoSchool(
+                    reference_year=reference_year,
+                    ignore_id_fields=['reference_year'],
+                    **fields
+                )
 
-                school['reference_year'] = reference_year
-                school['ignore_id_fields'] = ['reference_year']
-
-                yield school
+        return self.request_files(response, parse_file)
 
     def parse_dropouts(self, response):
         """
@@ -810,10 +1004,10 @@ class DuoVoSchoolsSpider(DuoSpider):
         Parse "01. Onderwijspersoneel in aantal personen"
         """
 
-        for xls_url, reference_date in find_available_datasets(response, extension='xls').iteritems():
+        def parse_file(file_response, xls_url, reference_date):
             reference_year = reference_date.year # different years in document
             reference_date = str(reference_date)
-            staff_per_school = get_staff_people(xls_url, with_brin=True)
+            staff_per_school = get_staff_people(file_response, with_brin=True)
 
             for (year, brin), per_school in staff_per_school.iteritems():
                 school = DuoVoSchool(
@@ -825,16 +1019,18 @@ class DuoVoSchoolsSpider(DuoSpider):
                 )
                 yield school
 
+        return self.request_files(response, parse_file, extension='xls')
+
     def parse_vo_staff_fte(self, response):
         """
         Voortgezet onderwijs > Personeel
         Parse "02. Onderwijspersoneel in aantal fte"
         """
 
-        for xls_url, reference_date in find_available_datasets(response, extension='xls').iteritems():
+        def parse_file(file_response, xls_url, reference_date):
             reference_year = reference_date.year # different years in document
             reference_date = str(reference_date)
-            staff_per_school = get_staff_fte(xls_url, with_brin=True)
+            staff_per_school = get_staff_fte(file_response, with_brin=True)
 
             for (year, brin), per_school in staff_per_school.iteritems():
                 school = DuoVoSchool(
@@ -846,6 +1042,8 @@ class DuoVoSchoolsSpider(DuoSpider):
                 )
                 yield school
 
+        return self.request_files(response, parse_file, extension='xls')
+
     def parse_vo_staff_course(self, response):
         """
         Voortgezet onderwijs > Personeel
@@ -881,14 +1079,14 @@ class DuoVoSchoolsSpider(DuoSpider):
         }
 
 
-        for xls_url, reference_date in find_available_datasets(response, extension='xls').iteritems():
+        def parse_file(file_response, xls_url, reference_date):
             reference_year = reference_date.year # different years in document
             reference_date = str(reference_date)
 
             staff_per_school = {}
 
-            sheets = parse_xls_sheets_from_url(xls_url)
-            for row in islice(sheets['per bestuur-brin-vak-graad'], None):
+            sheets = parse_xls_sheets_from_response(file_response, ['per bestuur-brin-vak-graad'])
+            for row in sheets['per bestuur-brin-vak-graad']:
                 brin = row.pop('BRIN NUMMER', None).strip()
 
                 course = row.pop('VAK', None).strip()
@@ -955,6 +1153,8 @@ class DuoVoSchoolsSpider(DuoSpider):
                 )
                 yield school
 
+        return self.request_files(response, parse_file, extension='xls')
+
     def parse_vo_time_per_course(self, response):
         """
         Voortgezet onderwijs > Personeel
@@ -992,14 +1192,14 @@ class DuoVoSchoolsSpider(DuoSpider):
         }
 
 
-        for xls_url, reference_date in find_available_datasets(response, extension='xls').iteritems():
+        def parse_file(file_response, xls_url, reference_date):
             reference_year = reference_date.year # different years in document
             reference_date = str(reference_date)
 
             time_per_school = {}
 
-            sheets = parse_xls_sheets_from_url(xls_url)
-            for row in islice(sheets['per bestuur-brin-vak-graad'], None):
+            sheets = parse_xls_sheets_from_response(file_response, ['per bestuur-brin-vak-graad'])
+            for row in sheets['per bestuur-brin-vak-graad']:
                 brin = row.pop('BRIN NUMMER', None).strip()
 
                 course = row.pop('VAK', None).strip()
@@ -1068,6 +1268,8 @@ class DuoVoSchoolsSpider(DuoSpider):
                 )
                 yield school
 
+        return self.request_files(response, parse_file, extension='xls')
+
 class DuoVoBranchesSpider(DuoSpider):
     name = 'duo_vo_branches'
 
@@ -1104,97 +1306,16 @@ class DuoVoBranchesSpider(DuoSpider):
         Parse "02. Adressen alle vestigingen"
         """
 
-        for csv_url, reference_date in find_available_datasets(response).iteritems():
+        def parse_file(file_response, csv_url, reference_date):
             reference_year = reference_date.year
-            reference_date = str(reference_date)
-            for row in parse_csv_file(csv_url):
-                school = DuoVoBranch()
-
-                school['reference_year'] = reference_year
-                school['ignore_id_fields'] = ['reference_year']
-                school['name'] = row['VESTIGINGSNAAM'].strip()
-                school['address'] = {
-                    'street': '%s %s' % (row['STRAATNAAM'].strip(),
-                                         row['HUISNUMMER-TOEVOEGING'].strip()),
-                    'city': row['PLAATSNAAM'].strip(),
-                    'zip_code': row['POSTCODE'].strip().replace(' ', '')
-                }
-
-                school['website'] = row['INTERNETADRES'].strip() or None
-
-                school['denomination'] = row['DENOMINATIE'].strip() or None
-
-                if row['ONDERWIJSSTRUCTUUR'].strip():
-                    school['education_structures'] = row['ONDERWIJSSTRUCTUUR']\
-                        .strip().split('/')
-                else:
-                    school['education_structures'] = None
-
-                school['province'] = row['PROVINCIE'].strip() or None
-
-                school['board_id'] = int_or_none(row['BEVOEGD GEZAG NUMMER'].strip())
-
-                if row['BRIN NUMMER'].strip():
-                    school['brin'] = row['BRIN NUMMER'].strip()
-
-                if row['VESTIGINGSNUMMER'].strip():
-                    school['branch_id'] = int(row['VESTIGINGSNUMMER']
-                                              .strip()
-                                              .replace(row['BRIN NUMMER'], ''))
-
-                school['municipality'] = row['GEMEENTENAAM'].strip() or None
-
-                school['municipality_code'] = int_or_none(row['GEMEENTENUMMER'].strip())
-
-                school['phone'] = row['TELEFOONNUMMER'].strip() or None
-
-                school['correspondence_address'] = {}
-                if row['STRAATNAAM CORRESPONDENTIEADRES'].strip():
-                    school['correspondence_address']['street'] = '%s %s'\
-                        % (row['STRAATNAAM CORRESPONDENTIEADRES'].strip(),
-                           row['HUISNUMMER-TOEVOEGING CORRESPONDENTIEADRES'].strip())
-                else:
-                    school['correspondence_address']['street'] = None
-
-                if row['POSTCODE CORRESPONDENTIEADRES'].strip():
-                    school['correspondence_address']['zip_code'] = row[
-                        'POSTCODE CORRESPONDENTIEADRES'].strip().replace(' ', '')
-                else:
-                    school['correspondence_address']['zip_code'] = None
-
-                school['correspondence_address']['city'] = row[
-                        'PLAATSNAAM CORRESPONDENTIEADRES'].strip() or None
-
-                school['nodal_area'] = row['NODAAL GEBIED NAAM'].strip() or None
-
-                school['nodal_area_code'] = int_or_none(row['NODAAL GEBIED CODE']
-                                                    .strip())
-
-                school['rpa_area'] = row['RPA-GEBIED NAAM'].strip() or None
-
-                school['rpa_area_code'] = int_or_none(row['RPA-GEBIED CODE'].strip())
-
-                school['wgr_area'] = row['WGR-GEBIED NAAM'].strip() or None
-
-                school['wgr_area_code'] = int_or_none(row['WGR-GEBIED CODE'].strip())
-
-                school['corop_area'] = row['COROPGEBIED NAAM'].strip() or None
-
-                school['corop_area_code'] = int_or_none(row['COROPGEBIED CODE'].strip())
-
-                school['education_area'] = row['ONDERWIJSGEBIED NAAM'].strip() or None
-
-                if row['ONDERWIJSGEBIED CODE'].strip():
-                    school['education_area_code'] = int(row['ONDERWIJSGEBIED '
-                                                            'CODE'].strip())
-                else:
-                    school['education_area_code'] = None
-
-                school['rmc_region'] = row['RMC-REGIO NAAM'].strip() or None
-
-                school['rmc_region_code'] = int_or_none(row['RMC-REGIO CODE'].strip())
+            for fields in VO_BRANCH_COLUMNS.map_rows(parse_csv_file(file_response)):
+                yield DuoVoBranch(
+                    reference_year=reference_year,
+                    ignore_id_fields=['reference_year'],
+                    **fields
+                )
 
-                yield school
+        return self.request_files(response, parse_file)
 
     def parse_students_by_structure(self, response):
         """
@@ -1296,12 +1417,12 @@ class DuoVoBranchesSpider(DuoSpider):
         Parse "06. Examenkandidaten en geslaagden"
         """
 
-        for csv_url, reference_date in find_available_datasets(response).iteritems():
+        def parse_file(file_response, csv_url, reference_date):
             reference_year = reference_date.year
             reference_date = str(reference_date)
             school_ids = {}
             graduations_school_year = {}
-            for row in parse_csv_file(csv_url):
+            for row in parse_csv_file(file_response):
                 # Remove newline chars and strip leading and trailing
                 # whitespace.
                 for key in row.keys():
@@ -1416,6 +1537,8 @@ class DuoVoBranchesSpider(DuoSpider):
 
                 yield school
 
+        return self.request_files(response, parse_file)
+
     def student_exam_grades(self, response):
         """
         Parse "07. Geslaagden, gezakten en gemiddelde examencijfers per instelling"
@@ -1783,28 +1906,11 @@ class DuoVoBranchesSpider(DuoSpider):
         05. Doorstromers van primair naar voortgezet onderwijs
         """
 
-        tables = []
-        for csv_url, reference_date in find_available_datasets(response).iteritems():
-            csv_file = requests.get(csv_url)
-            csv_file.encoding = 'cp1252'
-            csv_file = cStringIO.StringIO(csv_file.content
-                  .decode('cp1252').encode('utf8'))
-            tables.append( (csv_file, reference_date, csv_url) )
-
-        # add local file
-        if self.add_local_table is not None:
-            try:
-                reference_date = datetime.strptime(basename(self.add_local_table), '%Y-%m-%d.csv').date()
-                tables.append( (file(self.add_local_table), reference_date, None) )
-            except Exception as ex:
-                print 'Could not add', self.add_local_table, ':',  ex
-
-        for table, reference_date, csv_url in tables:
+        def parse_table(index, reference_date, csv_url):
             reference_year = reference_date.year
             reference_date = str(reference_date)
-            flow_per_branch = get_student_flow(table, for_po=False)
 
-            for (brin, branch_id), per_school in flow_per_branch.iteritems():
+            for (brin, branch_id), per_school in index.in_flow_per_branch():
                 school = DuoVoBranch(
                     brin=brin,
                     branch_id=branch_id,
@@ -1815,6 +1921,26 @@ class DuoVoBranchesSpider(DuoSpider):
                 )
                 yield school
 
+        def parse_file(file_response, csv_url, reference_date):
+            index = get_student_flow_index(file_response)
+            return parse_table(index, reference_date, csv_url)
+
+        # add local file
+        if self.add_local_table is not None:
+            index = None
+            try:
+                reference_date = datetime.strptime(basename(self.add_local_table), '%Y-%m-%d.csv').date()
+                index = StudentFlowIndex.from_table(file(self.add_local_table))
+            except Exception as ex:
+                print 'Could not add', self.add_local_table, ':',  ex
+
+            if index is not None:
+                for school in parse_table(index, reference_date, None):
+                    yield school
+
+        for request in self.request_files(response, parse_file):
+            yield request
+
 
 
 class DuoPoBoardsSpider(DuoSpider):
@@ -1845,57 +1971,16 @@ class DuoPoBoardsSpider(DuoSpider):
         Parse "06. Bevoegde gezagen speciaal (basis)onderwijs"
         """
 
-        for csv_url, reference_date in find_available_datasets(response).iteritems():
+        def parse_file(file_response, csv_url, reference_date):
             reference_year = reference_date.year
-            reference_date = str(reference_date)
-            for row in parse_csv_file(csv_url):
-                # strip leading and trailing whitespace.
-                for key in row.keys():
-                    row[key] = row[key].strip()
-
-                board = DuoPoBoard()
-                board['board_id'] = int(row['BEVOEGD GEZAG NUMMER'])
-                board['name'] = row['BEVOEGD GEZAG NAAM']
-                board['address'] = {
-                    'street': '%s %s' % (row['STRAATNAAM'],
-                                         row['HUISNUMMER-TOEVOEGING']),
-                    'zip_code': row['POSTCODE'].replace(' ', ''),
-                    'city': row['PLAATSNAAM']
-                }
-
-                board['correspondence_address'] = {}
-                if row['STRAATNAAM CORRESPONDENTIEADRES']:
-                    board['correspondence_address']['street'] = '%s %s'\
-                        % (row['STRAATNAAM CORRESPONDENTIEADRES'],
-                           row['HUISNUMMER-TOEVOEGING CORRESPONDENTIEADRES'])
-                else:
-                    board['correspondence_address']['street'] = None
-
-                if row['POSTCODE CORRESPONDENTIEADRES']:
-                    board['correspondence_address']['zip_code'] = row[
-                        'POSTCODE CORRESPONDENTIEADRES'].replace(' ', '')
-                else:
-                    board['correspondence_address']['zip_code'] = None
-
-                board['correspondence_address']['city'] = row[
-                        'PLAATSNAAM CORRESPONDENTIEADRES'] or None
-
-                board['municipality'] = row['GEMEENTENAAM'] or None
-
-                board['municipality_code'] = int_or_none(row['GEMEENTENUMMER'])
-
-                board['phone'] = row['TELEFOONNUMMER'] or None
-
-                board['website'] = row['INTERNETADRES'] or None
-
-                board['denomination'] = row['DENOMINATIE'] or None
+            for fields in BOARD_COLUMNS.map_rows(parse_csv_file(file_response)):
+                yield DuoPoBoard(
+                    reference_year=reference_year,
+                    ignore_id_fields=['reference_year'],
+                    **fields
+                )
 
-                board['administrative_office_id'] = \
-                        int_or_none(row['ADMINISTRATIEKANTOORNUMMER'])
-
-                board['reference_year'] = reference_year
-                board['ignore_id_fields'] = ['reference_year']
-                yield board
+        return self.request_files(response, parse_file)
 
     def parse_po_financial_key_indicators(self, response):
         """
@@ -1995,10 +2080,10 @@ class DuoPoBoardsSpider(DuoSpider):
         Parse "01. Onderwijspersoneel in aantal personen"
         """
 
-        for xls_url, reference_date in find_available_datasets(response, extension='xls').iteritems():
+        def parse_file(file_response, xls_url, reference_date):
             reference_year = reference_date.year # different years in document
             reference_date = str(reference_date)
-            staff_per_board = get_staff_people(xls_url, with_brin=False)
+            staff_per_board = get_staff_people(file_response, with_brin=False)
 
             for (year, board_id), per_board in staff_per_board.iteritems():
                 board = DuoPoBoard(
@@ -2010,16 +2095,18 @@ class DuoPoBoardsSpider(DuoSpider):
                 )
                 yield board
 
+        return self.request_files(response, parse_file, extension='xls')
+
     def parse_po_staff_fte(self, response):
         """
         Primair onderwijs > Personeel
         Parse "02. Onderwijspersoneel in aantal fte"
         """
 
-        for xls_url, reference_date in find_available_datasets(response, extension='xls').iteritems():
+        def parse_file(file_response, xls_url, reference_date):
             reference_year = reference_date.year # different years in document
             reference_date = str(reference_date)
-            staff_per_board = get_staff_fte(xls_url, with_brin=False)
+            staff_per_board = get_staff_fte(file_response, with_brin=False)
 
             for (year, board_id), per_board in staff_per_board.iteritems():
                 board = DuoPoBoard(
@@ -2031,6 +2118,8 @@ class DuoPoBoardsSpider(DuoSpider):
                 )
                 yield board
 
+        return self.request_files(response, parse_file, extension='xls')
+
 class DuoPoSchoolsSpider(DuoSpider):
     name = 'duo_po_schools'
 
@@ -2061,71 +2150,16 @@ class DuoPoSchoolsSpider(DuoSpider):
         Parse: "02. Hoofdvestigingen speciaal (basis)onderwijs"
         """
 
-        # Fields that do not need additonal processing
-        school_fields = {
-            'BRIN NUMMER': 'brin',
-            'PROVINCIE': 'province',
-            'INSTELLINGSNAAM': 'name',
-            'GEMEENTENAAM': 'municipality',
-            'DENOMINATIE': 'denomination',
-            'INTERNETADRES': 'website',
-            'TELEFOONNUMMER': 'phone',
-            'ONDERWIJSGEBIED NAAM': 'education_area',
-            'NODAAL GEBIED NAAM': 'nodal_area',
-            'RPA-GEBIED NAAM': 'rpa_area',
-            'WGR-GEBIED NAAM': 'wgr_area',
-            'COROPGEBIED NAAM': 'corop_area',
-            'RMC-REGIO NAAM': 'rmc_region'
-        }
-
-        for csv_url, reference_date in find_available_datasets(response).iteritems():
+        def parse_file(file_response, csv_url, reference_date):
             reference_year = reference_date.year
-            reference_date = str(reference_date)
-            for row in parse_csv_file(csv_url):
-                # strip leading and trailing whitespace.
-                for key in row.keys():
-                    value = row[key].strip()
-                    row[key] = value or None
-
-                school = DuoPoSchool()
-                school['board_id'] = int(row['BEVOEGD GEZAG NUMMER'])
-                school['address'] = {
-                    'street': '%s %s' % (row['STRAATNAAM'],
-                                         row['HUISNUMMER-TOEVOEGING']),
-                    'city': row['PLAATSNAAM'],
-                    'zip_code': row['POSTCODE'].replace(' ', '')
-                }
-
-                school['correspondence_address'] = {
-                    'street': '%s %s' % (row['STRAATNAAM CORRESPONDENTIEADRES'],
-                                         row['HUISNUMMER-TOEVOEGING '
-                                             'CORRESPONDENTIEADRES']),
-                    'city': row['PLAATSNAAM CORRESPONDENTIEADRES'],
-                    'zip_code': row['POSTCODE CORRESPONDENTIEADRES'].replace(' ', '')
-                }
-
-                school['municipality_code'] = int(row['GEMEENTENUMMER'])
-
-                if row['COROPGEBIED CODE']:
-                    school['corop_area_code'] = int(row['COROPGEBIED CODE'])
-
-                school['nodal_area_code'] = int_or_none(row['NODAAL GEBIED CODE'])
-
-                school['rpa_area_code'] = int_or_none(row['RPA-GEBIED CODE'])
-
-                school['wgr_area_code'] = int_or_none(row['WGR-GEBIED CODE'])
-
-                school['education_area_code'] = int_or_none(row['ONDERWIJSGEBIED CODE'])
-
-                school['rmc_region_code'] = int_or_none(row['RMC-REGIO CODE'])
-
-                for field, field_norm in school_fields.iteritems():
-                    school[field_norm] = row[field]
+            for fields in PO_SCHOOL_COLUMNS.map_rows(parse_csv_file(file_response)):
+                yield DuoPoSchool(
+                    reference_year=reference_year,
+                    ignore_id_fields=['reference_year'],
+                    **fields
+                )
 
-                school['reference_year'] = reference_year
-                school['ignore_id_fields'] = ['reference_year']
-
-                yield school
+        return self.request_files(response, parse_file)
 
     def parse_spo_students_per_cluster(self, response):
         """
@@ -2197,10 +2231,10 @@ class DuoPoSchoolsSpider(DuoSpider):
         Parse "01. Onderwijspersoneel in aantal personen"
         """
 
-        for xls_url, reference_date in find_available_datasets(response, extension='xls').iteritems():
+        def parse_file(file_response, xls_url, reference_date):
             reference_year = reference_date.year # different years in document
             reference_date = str(reference_date)
-            staff_per_school = get_staff_people(xls_url, with_brin=True)
+            staff_per_school = get_staff_people(file_response, with_brin=True)
 
             for (year, brin), per_school in staff_per_school.iteritems():
                 school = DuoPoSchool(
@@ -2212,16 +2246,18 @@ class DuoPoSchoolsSpider(DuoSpider):
                 )
                 yield school
 
+        return self.request_files(response, parse_file, extension='xls')
+
     def parse_po_staff_fte(self, response):
         """
         Primair onderwijs > Personeel
         Parse "02. Onderwijspersoneel in aantal fte"
         """
 
-        for xls_url, reference_date in find_available_datasets(response, extension='xls').iteritems():
+        def parse_file(file_response, xls_url, reference_date):
             reference_year = reference_date.year # different years in document
             reference_date = str(reference_date)
-            staff_per_school = get_staff_fte(xls_url, with_brin=True)
+            staff_per_school = get_staff_fte(file_response, with_brin=True)
 
             for (year, brin), per_school in staff_per_school.iteritems():
                 school = DuoPoSchool(
@@ -2233,6 +2269,8 @@ class DuoPoSchoolsSpider(DuoSpider):
                 )
                 yield school
 
+        return self.request_files(response, parse_file, extension='xls')
+
 class DuoPoBranchesSpider(DuoSpider):
     name = 'duo_po_branches'
 
@@ -2273,102 +2311,16 @@ class DuoPoBranchesSpider(DuoSpider):
         Parse "04. Alle vestigingen speciaal (basis)onderwijs"
         """
 
-        for csv_url, reference_date in find_available_datasets(response).iteritems():
+        def parse_file(file_response, csv_url, reference_date):
             reference_year = reference_date.year
-            reference_date = str(reference_date)
-            for row in parse_csv_file(csv_url):
-                school = DuoPoBranch()
-
-                # Correct this field name which has a trailing space.
-                if row.has_key('VESTIGINGSNAAM '):
-                    row['VESTIGINGSNAAM'] = row['VESTIGINGSNAAM ']
-
-                # In the special education set, it does not have a space
-                if row.has_key('BRINNUMMER'):
-                    row['BRIN NUMMER'] = row['BRINNUMMER']
-
-                school['reference_year'] = reference_year
-                school['ignore_id_fields'] = ['reference_year']
-                school['name'] = row['VESTIGINGSNAAM'].strip()
-                school['address'] = {
-                    'street': '%s %s' % (row['STRAATNAAM'].strip(),
-                                         row['HUISNUMMER-TOEVOEGING'].strip()),
-                    'city': row['PLAATSNAAM'].strip(),
-                    'zip_code': row['POSTCODE'].strip().replace(' ', '')
-                }
-
-                school['website'] = row['INTERNETADRES'].strip() or None
-
-                school['denomination'] = row['DENOMINATIE'].strip() or None
-
-                school['province'] = row['PROVINCIE'].strip() or None
-
-                school['board_id'] = int_or_none(row['BEVOEGD GEZAG NUMMER'].strip())
-
-                if row['BRIN NUMMER'].strip():
-                    school['brin'] = row['BRIN NUMMER'].strip()
-
-                if row.has_key('VESTIGINGSNUMMER') and row['VESTIGINGSNUMMER'].strip():
-                    school['branch_id'] = int(row['VESTIGINGSNUMMER']
-                                              .strip()
-                                              .replace(row['BRIN NUMMER'], ''))
-
-                school['municipality'] = row['GEMEENTENAAM'].strip() or None
-
-                school['municipality_code'] = int_or_none(row['GEMEENTENUMMER'].strip())
-
-                school['phone'] = row['TELEFOONNUMMER'].strip() or None
-
-                school['correspondence_address'] = {}
-                if row['STRAATNAAM CORRESPONDENTIEADRES'].strip():
-                    school['correspondence_address']['street'] = '%s %s'\
-                        % (row['STRAATNAAM CORRESPONDENTIEADRES'].strip(),
-                           row['HUISNUMMER-TOEVOEGING CORRESPONDENTIEADRES'].strip())
-                else:
-                    school['correspondence_address']['street'] = None
-
-                if row['POSTCODE CORRESPONDENTIEADRES'].strip():
-                    school['correspondence_address']['zip_code'] = row[
-                        'POSTCODE CORRESPONDENTIEADRES'].strip().replace(' ', '')
-                else:
-                    school['correspondence_address']['zip_code'] = None
-
-                school['correspondence_address']['city'] = row[
-                        'PLAATSNAAM CORRESPONDENTIEADRES'].strip() or None
-
-                school['nodal_area'] = row['NODAAL GEBIED NAAM'].strip() or None
-
-                if row['NODAAL GEBIED CODE'].strip():
-                    school['nodal_area_code'] = int(row['NODAAL GEBIED CODE']
-                                                    .strip())
-                else:
-                    school['nodal_area_code'] = None
-
-                school['rpa_area'] = row['RPA-GEBIED NAAM'].strip() or None
-
-                school['rpa_area_code'] = int_or_none(row['RPA-GEBIED CODE'].strip())
-
-                school['wgr_area'] = row['WGR-GEBIED NAAM'].strip() or None
-
-                school['wgr_area_code'] = int_or_none(row['WGR-GEBIED CODE'].strip())
-
-                school['corop_area'] = row['COROPGEBIED NAAM'].strip() or None
-
-                school['corop_area_code'] = int_or_none(row['COROPGEBIED CODE'].strip())
-
-                school['education_area'] = row['ONDERWIJSGEBIED NAAM'].strip() or None
-
-                if row['ONDERWIJSGEBIED CODE'].strip():
-                    school['education_area_code'] = int(row['ONDERWIJSGEBIED '
-                                                            'CODE'].strip())
-                else:
-                    school['education_area_code'] = None
-
-                school['rmc_region'] = row['RMC-REGIO NAAM'].strip() or None
-
-                school['rmc_region_code'] = int_or_none(row['RMC-REGIO CODE'].strip())
+            for fields in PO_BRANCH_COLUMNS.map_rows(parse_csv_file(file_response)):
+                yield DuoPoBranch(
+                    reference_year=reference_year,
+                    ignore_id_fields=['reference_year'],
+                    **fields
+                )
 
-                yield school
+        return self.request_files(response, parse_file)
 
     def parse_po_student_weight(self, response):
         """
@@ -2431,13 +2383,13 @@ class DuoPoBranchesSpider(DuoSpider):
         Parse "02. Leerlingen basisonderwijs naar leeftijd"
         """
 
-        for csv_url, reference_date in find_available_datasets(response).iteritems():
+        def parse_file(file_response, csv_url, reference_date):
             reference_year = reference_date.year
             reference_date = str(reference_date)
             school_ids = {}
             ages_per_branch_by_student_weight = {}
 
-            for row in parse_csv_file(csv_url):
+            for row in parse_csv_file(file_response):
                 # Datasets 2011 and 2012 suddenly changed these field names.
                 if row.has_key('BRINNUMMER'):
                     row['BRIN NUMMER'] = row['BRINNUMMER']
@@ -2503,19 +2455,21 @@ class DuoPoBranchesSpider(DuoSpider):
                 )
                 yield school
 
+        return self.request_files(response, parse_file)
+
     def parse_po_born_outside_nl(self, response):
         """
         Primair onderwijs > Leerlingen
         Parse "09. Leerlingen basisonderwijs met een niet-Nederlandse achtergrond naar geboorteland"
         """
 
-        for csv_url, reference_date in find_available_datasets(response).iteritems():
+        def parse_file(file_response, csv_url, reference_date):
             reference_year = reference_date.year
             reference_date = str(reference_date)
             school_ids = {}
             students_by_origin = {}
 
-            for row in parse_csv_file(csv_url):
+            for row in parse_csv_file(file_response):
                 brin = row['BRIN NUMMER'].strip()
                 branch_id = int(row['VESTIGINGSNUMMER'])
                 school_id = '%s-%s' % (brin, branch_id)
@@ -2553,6 +2507,8 @@ class DuoPoBranchesSpider(DuoSpider):
                 )
                 yield school
 
+        return self.request_files(response, parse_file)
+
     def parse_po_pupil_zipcode_by_age(self, response):
         """
         Primair onderwijs > Leerlingen
@@ -2561,11 +2517,11 @@ class DuoPoBranchesSpider(DuoSpider):
 
         # For some reason, DUO decided to create a seperate file for each
         # municipality, zip them and only provide xls files.
-        for zip_url, reference_date in find_available_datasets(response, extension='zip').iteritems():
+        def parse_file(file_response, zip_url, reference_date):
             reference_year = reference_date.year
             reference_date = str(reference_date)
 
-            for csv_file in extract_csv_files(zip_url):
+            for csv_file in extract_csv_files(file_response):
                 school_ids = {}
                 student_residences = {}
 
@@ -2614,19 +2570,21 @@ class DuoPoBranchesSpider(DuoSpider):
 
                 yield school
 
+        return self.request_files(response, parse_file, extension='zip')
+
     def parse_po_student_year(self, response):
         """
         Primair onderwijs > Leerlingen
         Parse "11. Leerlingen (speciaal) basisonderwijs per schoolvestiging naar leerjaar"
         """
 
-        for csv_url, reference_date in find_available_datasets(response).iteritems():
+        def parse_file(file_response, csv_url, reference_date):
             reference_year = reference_date.year
             reference_date = str(reference_date)
             school_ids = {}
             years_per_branch = {}
 
-            for row in parse_csv_file(csv_url):
+            for row in parse_csv_file(file_response):
                 # Datasets 2011 and 2012 suddenly changed these field names. (?)
                 if row.has_key('BRINNUMMER'):
                     row['BRIN NUMMER'] = row['BRINNUMMER']
@@ -2674,17 +2632,19 @@ class DuoPoBranchesSpider(DuoSpider):
                 )
                 yield school
 
+        return self.request_files(response, parse_file)
+
     def parse_spo_students_by_birthyear(self, response):
         """
         Passend onderwijs > Leerlingen
         Parse: "05. Leerlingen speciaal (basis)onderwijs naar geboortejaar"
         """
 
-        for csv_url, reference_date in find_available_datasets(response).iteritems():
+        def parse_file(file_response, csv_url, reference_date):
             reference_year = reference_date.year
             reference_date = str(reference_date)
 
-            for row in parse_csv_file(csv_url):
+            for row in parse_csv_file(file_response):
                 # Datasets 2011 and 2012 suddenly changed these field names. (?)
                 if row.has_key('BRINNUMMER'):
                     row['BRIN NUMMER'] = row['BRINNUMMER']
@@ -2722,6 +2682,8 @@ class DuoPoBranchesSpider(DuoSpider):
 
                 yield branch
 
+        return self.request_files(response, parse_file)
+
     def parse_spo_students_by_edu_type(self, response):
         """
         Primair onderwijs > Leerlingen
@@ -2880,15 +2842,15 @@ class DuoPoBranchesSpider(DuoSpider):
                 'branch_active',
         }
 
-        for xls_url, reference_date in find_available_datasets(response, extension='xls').iteritems():
+        def parse_file(file_response, xls_url, reference_date):
             reference_year = reference_date.year # different years in document
             reference_date = str(reference_date)
             school_ids = {}
             students_in_BRON_per_school = {}
 
             # download manually
-            xls_file = requests.get(xls_url)
-            xls = cStringIO.StringIO(xls_file.content)
+            xls_file = file_response.body
+            xls = cStringIO.StringIO(xls_file)
             with open(devnull, 'w') as OUT:
                 wb = xlrd.open_workbook(file_contents=xls.read(), logfile=OUT)
 
@@ -2974,34 +2936,19 @@ class DuoPoBranchesSpider(DuoSpider):
                 )
                 yield school
 
+        return self.request_files(response, parse_file, extension='xls')
+
     def parse_po_student_flow(self, response):
         """
         Stroominformatie > Doorstromers
         05. Doorstromers van primair naar voortgezet onderwijs
         """
 
-        tables = []
-        for csv_url, reference_date in find_available_datasets(response).iteritems():
-            csv_file = requests.get(csv_url)
-            csv_file.encoding = 'cp1252'
-            csv_file = cStringIO.StringIO(csv_file.content
-                  .decode('cp1252').encode('utf8'))
-            tables.append( (csv_file, reference_date, csv_url) )
-
-        # add local file
-        if self.add_local_table is not None:
-            try:
-                reference_date = datetime.strptime(basename(self.add_local_table), '%Y-%m-%d.csv').date()
-                tables.append( (file(self.add_local_table), reference_date, None) )
-            except Exception as ex:
-                print 'Could not add', self.add_local_table, ':',  ex
-
-        for table, reference_date, csv_url in tables:
+        def parse_table(index, reference_date, csv_url):
             reference_year = reference_date.year
             reference_date = str(reference_date)
-            flow_per_branch = get_student_flow(table, for_po=True)
 
-            for (brin, branch_id), per_school in flow_per_branch.iteritems():
+            for (brin, branch_id), per_school in index.out_flow_per_branch():
                 school = DuoPoBranch(
                     brin=brin,
                     branch_id=branch_id,
@@ -3012,6 +2959,26 @@ class DuoPoBranchesSpider(DuoSpider):
                 )
                 yield school
 
+        def parse_file(file_response, csv_url, reference_date):
+            index = get_student_flow_index(file_response)
+            return parse_table(index, reference_date, csv_url)
+
+        # add local file
+        if self.add_local_table is not None:
+            index = None
+            try:
+                reference_date = datetime.strptime(basename(self.add_local_table), '%Y-%m-%d.csv').date()
+                index = StudentFlowIndex.from_table(file(self.add_local_table))
+            except Exception as ex:
+                print 'Could not add', self.add_local_table, ':',  ex
+
+            if index is not None:
+                for school in parse_table(index, reference_date, None):
+                    yield school
+
+        for request in self.request_files(response, parse_file):
+            yield request
+
 
 class DuoPaoCollaborationsSpider(DuoSpider):
     name = 'duo_pao_collaborations'
@@ -3037,44 +3004,16 @@ class DuoPaoCollaborationsSpider(DuoSpider):
         Parse: "05. Adressen samenwerkingsverbanden lichte ondersteuning, voortgezet onderwijs"
         Parse: "07. Adressen samenwerkingsverbanden passend onderwijs, voortgezet onderwijs"
         """
-        # Fields that do not need additonal processing
-        collaboration_fields = {
-            'SAMENWERKINGSVERBAND': 'name'
-        }
-
-        for csv_url, reference_date in find_available_datasets(response).iteritems():
+        def parse_file(file_response, csv_url, reference_date):
             reference_year = reference_date.year
-            reference_date = str(reference_date)
-            for row in parse_csv_file(csv_url):
-
-                collaboration = DuoPaoCollaboration()
-
-                cid = row['ADMINISTRATIENUMMER'].strip()
-                if '-' in cid:
-                    int_parts = map(int_or_none, cid.split('-'))
-                    if any([i == None for i in int_parts]):
-                        cid = '-'.join(map(str, int_parts))
-                collaboration['collaboration_id'] = cid
-
-                collaboration['address'] = {
-                    'street': row['ADRES'].strip() or None,
-                    'city': row['PLAATSNAAM'].strip() or None,
-                    'zip_code': row['POSTCODE'].replace(' ', '') or None
-                }
-
-                collaboration['correspondence_address'] = {
-                    'street': row['CORRESPONDENTIEADRES'],
-                    'city': row['PLAATS CORRESPONDENTIEADRES'],
-                    'zip_code': row['POSTCODE CORRESPONDENTIEADRES'].replace(' ', '')
-                }
-
-                for field, field_norm in collaboration_fields.iteritems():
-                    collaboration[field_norm] = row[field]
-
-                collaboration['reference_year'] = reference_year
-                collaboration['ignore_id_fields'] = ['reference_year']
+            for fields in COLLABORATION_COLUMNS.map_rows(parse_csv_file(file_response)):
+                yield DuoPaoCollaboration(
+                    reference_year=reference_year,
+                    ignore_id_fields=['reference_year'],
+                    **fields
+                )
 
-                yield collaboration
+        return self.request_files(response, parse_file)
 
 
 
@@ -3094,41 +3033,17 @@ class DuoMboBoardSpider(DuoSpider):
         Middelbaar beroepsonderwijs > Adressen bevoegde gezagen
         Parse "02. Adressen bevoegde gezagen"
         """
-        for csv_url, reference_date in find_available_datasets(response).iteritems():
+        def parse_file(file_response, csv_url, reference_date):
             reference_year = reference_date.year
-            reference_date = str(reference_date)
-            for row in parse_csv_file(csv_url):
-                # strip leading and trailing whitespace.
-                for key in row.keys():
-                    row[key] = row[key].strip()
-
+            for fields in MBO_BOARD_COLUMNS.map_rows(parse_csv_file(file_response)):
                 yield DuoMboBoard(
-                    reference_year = reference_year,
-                    ignore_id_fields = ['reference_year'],
-
-                    board_id = int(row['BEVOEGD GEZAG NUMMER']),
-
-                    address = {
-                        'street': '%s %s' % (row['STRAATNAAM'],
-                                             row['HUISNUMMER-TOEVOEGING']),
-                        'zip_code': row['POSTCODE'].replace(' ', ''),
-                        'city': row['PLAATSNAAM']
-                    },
-                    administrative_office_id = int_or_none(row['ADMINISTRATIEKANTOORNUMMER']),
-                    correspondence_address = {
-                        'street': '%s %s' % (row['STRAATNAAM CORRESPONDENTIEADRES'],
-                                             row['HUISNUMMER-TOEVOEGING CORRESPONDENTIEADRES']),
-                        'zip_code': row['POSTCODE CORRESPONDENTIEADRES'].replace(' ', ''),
-                        'city': row['PLAATSNAAM CORRESPONDENTIEADRES']
-                    },
-                    denomination = row['DENOMINATIE'],
-                    municipality = row['GEMEENTENAAM'],
-                    municipality_code = int(row['GEMEENTENUMMER']),
-                    name = row['BEVOEGD GEZAG NAAM'],
-                    phone = row['TELEFOONNUMMER'],
-                    website = row['INTERNETADRES'],
+                    reference_year=reference_year,
+                    ignore_id_fields=['reference_year'],
+                    **fields
                 )
 
+        return self.request_files(response, parse_file)
+
 class DuoMboInstitutionSpider(DuoSpider):
     name = 'duo_mbo_institutions'
 
@@ -3151,54 +3066,17 @@ class DuoMboInstitutionSpider(DuoSpider):
         Middelbaar beroepsonderwijs > Adressen bevoegde gezagen
         Parse "02. Adressen bevoegde gezagen"
         """
-        for csv_url, reference_date in find_available_datasets(response).iteritems():
+        def parse_file(file_response, csv_url, reference_date):
             reference_year = reference_date.year
-            reference_date = str(reference_date)
-            for row in parse_csv_file(csv_url):
-                # strip leading and trailing whitespace.
-                for key in row.keys():
-                    row[key] = row[key].strip()
-
+            for fields in MBO_INSTITUTION_COLUMNS.map_rows(parse_csv_file(file_response)):
                 yield DuoMboInstitution(
-                    reference_year = reference_year,
-                    ignore_id_fields = ['reference_year'],
-
-                    brin = row['BRIN NUMMER'],
-                    board_id = row['BEVOEGD GEZAG NUMMER'],
-                    corop_area = row['COROPGEBIED NAAM'],
-                    corop_area_code = int(row['COROPGEBIED CODE']),
-                    correspondence_address =  {
-                        'street': '%s %s' % (row['STRAATNAAM CORRESPONDENTIEADRES'],
-                                             row['HUISNUMMER-TOEVOEGING CORRESPONDENTIEADRES']),
-                        'zip_code': row['POSTCODE CORRESPONDENTIEADRES'].replace(' ', ''),
-                        'city': row['PLAATSNAAM CORRESPONDENTIEADRES']
-                    },
-                    denomination = row['DENOMINATIE'],
-                    municipality = row['GEMEENTENAAM'],
-                    municipality_code = int(row['GEMEENTENUMMER']),
-                    adress = {
-                        'street': '%s %s' % (row['STRAATNAAM'],
-                                             row['HUISNUMMER-TOEVOEGING']),
-                        'zip_code': row['POSTCODE'].replace(' ', ''),
-                        'city': row['PLAATSNAAM']
-                    },
-                    name = row['INSTELLINGSNAAM '], #space!
-                    nodal_area = row['NODAAL GEBIED NAAM'],
-                    nodal_area_code = int(row['NODAAL GEBIED CODE']),
-                    education_area = row['ONDERWIJSGEBIED NAAM '], #space!
-                    education_area_code = int(row['ONDERWIJSGEBIED CODE']),
-                    rpa_area = row['RPA-GEBIED NAAM'],
-                    rpa_area_code = int(row['RPA-GEBIED CODE']),
-                    rmc_region = row['RMC-REGIO NAAM '], #space!
-                    rmc_region_code = int(row['RMC-REGIO CODE ']), #space!
-                    phone = row['TELEFOONNUMMER'],
-                    website = row['INTERNETADRES'],
-                    wgr_area = row['NAAM WGR-GEBIED'],
-                    wgr_area_code = int(row['WGR-GEBIED CODE']),
-                    mbo_institution_kind = row['MBO INSTELLINGSSOORT - NAAM'],
-                    mbo_institution_kind_code = row['MBO INSTELLINGSOORT - CODE'],
+                    reference_year=reference_year,
+                    ignore_id_fields=['reference_year'],
+                    **fields
                 )
 
+        return self.request_files(response, parse_file)
+
     def parse_mbo_participants(self, response):
         """
         Middelbaar beroepsonderwijs > Deelnemers > Onderwijsdeelnemers
@@ -3235,12 +3113,12 @@ class DuoMboInstitutionSpider(DuoSpider):
                         }
 
         # Two datasets for one file, no fancy abstraction yet
-        for csv_url, reference_date in find_available_datasets(response).iteritems():
+        def parse_file(file_response, csv_url, reference_date):
             reference_year = reference_date.year
             reference_date = str(reference_date)
 
             dataset = {}
-            for row in parse_csv_file(csv_url):
+            for row in parse_csv_file(file_response):
                 # strip leading and trailing whitespace.
                 for key in row.keys():
                     value = (row[key] or '').strip()
@@ -3266,6 +3144,8 @@ class DuoMboInstitutionSpider(DuoSpider):
                         school['%s_reference_date' % dataset_name] = reference_date
                         school[dataset_name] = item[dataset_name]
                     yield school
+
+        return self.request_files(response, parse_file)
         
     def parse_mbo_participants_grade_year(self, response):
         """
@@ -3322,4 +3202,65 @@ class DuoMboInstitutionSpider(DuoSpider):
                         }
 
         return self.dataset(response, self.make_item, 'graduates_per_qualification', parse_row)
-        
+
+
+class DuoAllSpider(DuoSpider):
+    """
+    Crawl the datasets of all DUO spiders at once. Pages and files that
+    are used by several spiders (e.g. the staff files of the board and
+    school spiders, or the student flow table of the po and vo branch
+    spiders) are downloaded once, and passed to the callbacks of every
+    spider that uses them. These files are also parsed once, as the
+    functions that parse them (`get_xls_rows`, `get_student_flow_index`)
+    keep the result in the meta of the response.
+
+    Items get the name of the spider that produced them as their
+    `export_name`, so the pipeline merges and exports them as if they
+    were crawled by that spider.
+    """
+    name = 'duo_all'
+    spider_classes = [
+        DuoVoBoardsSpider, DuoVoSchoolsSpider, DuoVoBranchesSpider,
+        DuoPoBoardsSpider, DuoPoSchoolsSpider, DuoPoBranchesSpider,
+        DuoPaoCollaborationsSpider, DuoMboBoardSpider, DuoMboInstitutionSpider,
+    ]
+
+    def __init__(self, *args, **kwargs):
+        self.spiders = [spider_class(*args, **kwargs)
+                        for spider_class in self.spider_classes]
+        self.export_names = [spider.name for spider in self.spiders]
+
+        callbacks = {}
+        for spider in self.spiders:
+            for url, callback in spider.requests.items():
+                callbacks.setdefault(url, []).append((spider.name, callback))
+
+        self.requests = dict((url, self.dispatch(url_callbacks))
+                             for url, url_callbacks in callbacks.items())
+        DuoSpider.__init__(self, *args, **kwargs)
+
+    def dispatch(self, callbacks):
+        """
+        Return a callback that passes a response to all `callbacks`, a
+        list of `(spider name, callback)` pairs. The requests they make
+        for the same URL are merged into one request, which is dispatched
+        to all of their callbacks in turn.
+        """
+        def parse(response):
+            requests, request_callbacks = [], {}
+            for name, callback in callbacks:
+                for result in callback(response) or []:
+                    if isinstance(result, Request):
+                        if result.url not in request_callbacks:
+                            requests.append(result)
+                            request_callbacks[result.url] = []
+                        request_callbacks[result.url].append((name,
+                                                              result.callback))
+                    else:
+                        result['export_name'] = name
+                        yield result
+
+            for request in requests:
+                yield request.replace(
+                    callback=self.dispatch(request_callbacks[request.url]))
+        return parse
@@ -0,0 +1,134 @@
+import os
+import csv
+import cPickle as pickle
+from array import array
+from itertools import islice
+
+
+class StudentFlowIndex(object):
+    """
+    The flow of students from po to vo branches, from the DUO table
+    "Stroominformatie > Doorstromers > 05. Doorstromers van primair naar
+    voortgezet onderwijs". The table is read once for both directions:
+    the flow out of po branches and the flow into vo branches.
+
+    Branches are numbered; `branches` has the `(brin, branch_id)` of every
+    number (BRINs are interned). Each flow is an entry in the integer
+    arrays `po`, `vo` and `students`, and `out_flows` and `in_flows` map
+    the number of a po or vo branch to an array of its flows.
+
+    An index can be saved to disk, and loaded again instead of parsing the
+    table.
+    """
+    # Columns of the table, which starts with two lines of headers
+    PO_BRIN, PO_BRANCH_ID, VO_BRIN, VO_BRANCH_ID, STUDENTS = 0, 1, 5, 6, 10
+
+    def __init__(self):
+        self.branches = []
+        self.branch_numbers = {}
+        self.po = array('i')
+        self.vo = array('i')
+        self.students = array('i')
+        self.out_flows = {}
+        self.in_flows = {}
+
+    @classmethod
+    def from_table(cls, table):
+        """ Build the index from the lines of a flow table. """
+        index = cls()
+        for row in csv.reader(islice(table, 2, None), delimiter=';'):
+            if not row:
+                continue
+            index.add(index.branch_number(row[cls.PO_BRIN],
+                                          int(row[cls.PO_BRANCH_ID])),
+                      index.branch_number(row[cls.VO_BRIN],
+                                          int(row[cls.VO_BRANCH_ID])),
+                      int(row[cls.STUDENTS]))
+        return index
+
+    def branch_number(self, brin, branch_id):
+        key = (brin, branch_id)
+        number = self.branch_numbers.get(key)
+        if number is None:
+            number = self.branch_numbers[key] = len(self.branches)
+            self.branches.append((intern(brin), branch_id))
+        return number
+
+    def add(self, po_number, vo_number, students):
+        """ Add the flow of `students` from one branch to another. """
+        flow = len(self.students)
+        self.po.append(po_number)
+        self.vo.append(vo_number)
+        self.students.append(students)
+        self.out_flows.setdefault(po_number, array('i')).append(flow)
+        self.in_flows.setdefault(vo_number, array('i')).append(flow)
+
+    def out_flow_per_branch(self):
+        """
+        Iterate over `((brin, branch_id), out flow)` of all po branches,
+        where the out flow is a list of the vo branches the students of
+        the po branch went to, in the order of the table.
+        """
+        branches, vo, students = self.branches, self.vo, self.students
+        for number, flows in self.out_flows.iteritems():
+            yield branches[number], [{
+                'to_vo_brin': branches[vo[flow]][0],
+                'to_vo_branch_id': branches[vo[flow]][1],
+                'out_flow': students[flow],
+            } for flow in flows]
+
+    def in_flow_per_branch(self):
+        """
+        Iterate over `((brin, branch_id), in flow)` of all vo branches,
+        where the in flow is a list of the po branches the students of
+        the vo branch came from, in the order of the table.
+        """
+        branches, po, students = self.branches, self.po, self.students
+        for number, flows in self.in_flows.iteritems():
+            yield branches[number], [{
+                'from_po_brin': branches[po[flow]][0],
+                'from_po_branch_id': branches[po[flow]][1],
+                'in_flow': students[flow],
+            } for flow in flows]
+
+    def total_out_flow(self):
+        """ Dict of the number of students that left each po branch """
+        students = self.students
+        return dict((self.branches[number], sum(students[flow] for flow in flows))
+                    for number, flows in self.out_flows.iteritems())
+
+    def total_in_flow(self):
+        """ Dict of the number of students that entered each vo branch """
+        students = self.students
+        return dict((self.branches[number], sum(students[flow] for flow in flows))
+                    for number, flows in self.in_flows.iteritems())
+
+    def save(self, path):
+        data = {
+            'branches': self.branches,
+            'po': self.po.tostring(),
+            'vo': self.vo.tostring(),
+            'students': self.students.tostring(),
+        }
+        # Write to a temporary file first, so an interrupted save does not
+        # leave a truncated index
+        with open('%s.tmp' % path, 'wb') as f:
+            pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+        os.rename('%s.tmp' % path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            data = pickle.load(f)
+
+        index = cls()
+        for brin, branch_id in data['branches']:
+            index.branch_number(brin, branch_id)
+
+        po, vo, students = array('i'), array('i'), array('i')
+        po.fromstring(data['po'])
+        vo.fromstring(data['vo'])
+        students.fromstring(data['students'])
+        for flow in xrange(len(students)):
+            index.add(po[flow], vo[flow], students[flow])
+        return index
@@ -1,11 +1,56 @@
-import json
 from datetime import datetime
 
 import pytz
-from colander import Invalid
+from colander import Invalid, String, null
 
 import inspect
 
+from compiled import compile_schema
+
+
+def accept_utf8_strings(node):
+    """
+    Let all String nodes of a schema decode UTF-8 encoded byte strings
+    (as produced by the spiders), instead of only accepting ASCII byte
+    strings and unicode.
+    """
+    if isinstance(node.typ, String):
+        node.typ.encoding = 'utf-8'
+
+    for child in node.children:
+        accept_utf8_strings(child)
+
+
+def error_messages(error):
+    """
+    Return the messages of an `Invalid` exception per field path.
+
+    Colander can not interpolate UTF-8 encoded byte strings (such as the
+    invalid values it includes in its messages) into unicode messages,
+    so these are decoded first.
+    """
+    errors = [error]
+    while errors:
+        invalid = errors.pop()
+        errors.extend(invalid.children)
+        for msg in invalid.msg if isinstance(invalid.msg, list) else [invalid.msg]:
+            mapping = getattr(msg, 'mapping', None) or {}
+            for key, value in mapping.items():
+                if isinstance(value, str):
+                    mapping[key] = value.decode('utf-8', 'replace')
+
+    return error.asdict()
+
+
+def prepare_schema(validation_schema):
+    """
+    Prepare a schema instance for `validate`; this only has to be done
+    once per instance.
+    """
+    accept_utf8_strings(validation_schema)
+    validation_schema.compiled_check = compile_schema(validation_schema)
+
+
 def validate(validation_schema, index, doctype, doc_id, item):
     validated_at = datetime.utcnow().replace(tzinfo=pytz.utc)\
         .strftime('%Y-%m-%dT%H:%M:%SZ')
@@ -23,19 +68,37 @@ def validate(validation_schema, index, doctype, doc_id, item):
     item['meta']['validated_at'] = validated_at
     item['meta']['validation_result'] = 'invalid'
 
-    messages = []
-    # Dirty 'hack' to validate the item with sorted keys. This is
-    # done to keep references to keys in sync between the validation
-    # result document and the scraped item.
-    item_sorted = json.dumps(item, sort_keys=True)
-    item_sorted = json.loads(item_sorted)
-
-    try:
-        validation_schema.deserialize(item_sorted)
-    except Invalid, e:
-        messages = map(lambda item: dict(field=item[0], message=item[1]),
-            e.asdict().items())
+    if not hasattr(validation_schema, 'compiled_check'):
+        prepare_schema(validation_schema)
+
+    # Check the item with the compiled schema, and only let colander
+    # validate the top-level fields that failed these checks in order to
+    # get the error messages.
+    failed = None
+    if validation_schema.compiled_check is not None:
+        failed = validation_schema.compiled_check(item)
+
+    errors = {}
+    if failed is None:
+        try:
+            validation_schema.deserialize(item)
+        except Invalid, e:
+            errors = error_messages(e)
     else:
+        for node in failed:
+            try:
+                node.deserialize(item.get(node.name, null))
+            except Invalid, e:
+                errors.update(error_messages(e))
+
+    # Colander walks mappings in schema order and sequences in item
+    # order, so the field paths in the messages refer to the item as it
+    # is exported. The item is validated as is (colander does not modify
+    # it); the messages are sorted by field path to keep the validation
+    # documents stable between crawls.
+    messages = [dict(field=field, message=message)
+                for field, message in sorted(errors.items())]
+    if not messages:
         validation['result'] = 'valid'
         item['meta']['validation_result'] = 'valid'
 
@@ -0,0 +1,307 @@
+"""
+Compile colander schemas into specialized validation functions.
+
+Colander interprets a schema node by node for every item it validates.
+`compile_schema` walks a schema once and generates the Python code of a
+single function that performs the same checks for a whole item: type
+checks, `Range`, `Length`, `OneOf` and `Regex` validators, dates and
+booleans, with nested mappings and sequences unrolled into plain code
+and loops. Nodes the compiler does not know how to check (e.g. nodes
+with a preparer) are handed to colander from within the generated code.
+
+The generated function only tells which top-level fields are invalid.
+Any exception raised while checking a field (e.g. by a failing `int()`
+or UTF-8 decode) marks it as invalid, so the generated code needs no
+error handling of its own. Colander then validates only the invalid
+fields, to produce the error messages; a field the generated code
+rejects but colander accepts gets no messages, so the result is always
+the same as colander's.
+"""
+import re
+from datetime import date
+
+from colander import (Invalid, Mapping, Sequence, String, Integer, Float,
+                      Date, Boolean, Range, Length, OneOf, Regex, Email, All,
+                      null, drop, required, deferred)
+
+
+class _Failed(Exception):
+    """ Raised by the generated code when a field is invalid. """
+    pass
+
+
+FAIL = 'raise Failed'
+
+LOCALS = ['null', 'drop', 'type', 'str', 'unicode', 'list', 'dict', 'len']
+
+# Maximum number of values that are remembered per regular expression or
+# date field
+REMEMBERED_SIZE = 10000
+
+# Dates in the format the spiders produce them; other values are parsed
+# by colander
+DATE_RE = re.compile(r'\d{4}-\d{2}-\d{2}\Z')
+
+
+class _CodeWriter(object):
+    def __init__(self):
+        self.lines = []
+        self.namespace = {
+            'Failed': _Failed,
+            'null': null,
+            'drop': drop,
+            'date': date,
+            'DATE_RE': DATE_RE,
+        }
+        self.counter = 0
+
+    def line(self, indent, code):
+        self.lines.append('    ' * indent + code)
+
+    def ref(self, obj, prefix='c'):
+        """ Make `obj` available to the generated code. """
+        self.counter += 1
+        name = '%s%d' % (prefix, self.counter)
+        self.namespace[name] = obj
+        return name
+
+    def var(self, prefix='v'):
+        self.counter += 1
+        return '%s%d' % (prefix, self.counter)
+
+    def function(self, name):
+        exec '\n'.join(self.lines) in self.namespace
+        return self.namespace[name]
+
+
+def _can_compile(node):
+    return node.preparer is None and\
+        not isinstance(node.missing, deferred) and\
+        not isinstance(node.validator, deferred) and\
+        isinstance(node.typ, (String, Integer, Float, Date, Boolean, Mapping,
+                              Sequence)) and\
+        not (isinstance(node.typ, Mapping) and node.typ.unknown == 'raise') and\
+        not (isinstance(node.typ, (Mapping, Sequence)) and node.validator)
+
+
+def _write_missing(w, node, indent):
+    """ Code for a value that deserializes to `null`. """
+    if node.missing is required:
+        w.line(indent, FAIL)
+    else:
+        w.line(indent, 'pass')
+
+
+def _constant(w, value):
+    """ Numbers are written into the code, other values are referenced. """
+    if type(value) in (int, long, float):
+        return repr(value)
+    return w.ref(value)
+
+
+def _write_validator(w, node, validator, value, indent):
+    if isinstance(validator, All):
+        for sub_validator in validator.validators:
+            _write_validator(w, node, sub_validator, value, indent)
+
+    elif type(validator) in (Range, Length):
+        if type(validator) is Length:
+            value = 'len(%s)' % value
+        if validator.min is not None and validator.max is not None:
+            w.line(indent, 'if not %s <= %s <= %s: %s'
+                   % (_constant(w, validator.min), value,
+                      _constant(w, validator.max), FAIL))
+        elif validator.min is not None:
+            w.line(indent, 'if %s < %s: %s'
+                   % (value, _constant(w, validator.min), FAIL))
+        elif validator.max is not None:
+            w.line(indent, 'if %s > %s: %s'
+                   % (value, _constant(w, validator.max), FAIL))
+
+    elif type(validator) is OneOf:
+        w.line(indent, 'if not %s in %s: %s'
+               % (value, w.ref(validator.choices), FAIL))
+
+    elif type(validator) in (Regex, Email):
+        # Matching e.g. `colander.url` is slow, and many values (such as
+        # the reference URLs of DUO datasets) are the same for all items,
+        # so the values that matched are remembered
+        matched = w.ref({}, 'm')
+        w.line(indent, 'if %s not in %s:' % (value, matched))
+        w.line(indent + 1, 'if %s.match(%s) is None: %s'
+               % (w.ref(validator.match_object, 'r'), value, FAIL))
+        w.line(indent + 1, 'if len(%s) < %d: %s[%s] = True'
+               % (matched, REMEMBERED_SIZE, matched, value))
+
+    else:
+        # Any other validator is called just like colander does
+        w.line(indent, '%s(%s, %s)' % (w.ref(validator), w.ref(node), value))
+
+
+def _write_string(w, node, value, indent):
+    if node.typ.encoding:
+        decode = 'unicode(%s, %r)' % (value, node.typ.encoding)
+        coerce = '%s if type(%s) is unicode else %s' % (value, value, decode)
+    else:
+        decode = coerce = 'unicode(%s)' % value
+
+    string = w.var('s')
+    w.line(indent, 'if not %s:' % value)
+    _write_missing(w, node, indent + 1)
+    w.line(indent, 'elif type(%s) is str:' % value)
+    w.line(indent + 1, '%s = %s' % (string, decode))
+    if node.validator is not None:
+        _write_validator(w, node, node.validator, string, indent + 1)
+    w.line(indent, 'else:')
+    w.line(indent + 1, 'if not isinstance(%s, (unicode, str)): %s'
+           % (value, FAIL))
+    w.line(indent + 1, '%s = %s' % (string, coerce))
+    if node.validator is not None:
+        _write_validator(w, node, node.validator, string, indent + 1)
+
+
+def _write_number(w, node, value, indent):
+    num = w.ref(node.typ.num)
+    number = w.var('x')
+    w.line(indent, 'if %s != 0 and not %s:' % (value, value))
+    _write_missing(w, node, indent + 1)
+    w.line(indent, 'else:')
+    # Values that already have the right type need no conversion
+    w.line(indent + 1, '%s = %s if type(%s) is %s else %s(%s)'
+           % (number, value, value, num, num, value))
+    if node.validator is not None:
+        _write_validator(w, node, node.validator, number, indent + 1)
+
+
+def _write_date(w, node, value, indent):
+    # Most dates (e.g. the reference dates of DUO datasets) are the same
+    # for all items, so the dates that were parsed are remembered
+    day, parsed = w.var('d'), w.ref({}, 'm')
+    node_ref = w.ref(node, 'n')
+    w.line(indent, 'if not %s:' % value)
+    _write_missing(w, node, indent + 1)
+    w.line(indent, 'else:')
+    w.line(indent + 1, '%s = %s.get(%s)' % (day, parsed, value))
+    w.line(indent + 1, 'if %s is None:' % day)
+    w.line(indent + 2, 'if isinstance(%s, (unicode, str)) and '
+           'DATE_RE.match(%s):' % (value, value))
+    w.line(indent + 3, '%s = date(int(%s[:4]), int(%s[5:7]), int(%s[8:]))'
+           % (day, value, value, value))
+    w.line(indent + 2, 'else:')
+    w.line(indent + 3, '%s = %s.typ.deserialize(%s, %s)' % (day, node_ref,
+                                                            node_ref, value))
+    w.line(indent + 2, 'if len(%s) < %d: %s[%s] = %s'
+           % (parsed, REMEMBERED_SIZE, parsed, value, day))
+    if node.validator is not None:
+        _write_validator(w, node, node.validator, day, indent + 1)
+
+
+def _write_boolean(w, node, value, indent):
+    typ = node.typ
+    boolean = w.var('b')
+    w.line(indent, 'if %s is null:' % value)
+    _write_missing(w, node, indent + 1)
+    w.line(indent, 'else:')
+    w.line(indent + 1, '%s = str(%s).lower()' % (boolean, value))
+    w.line(indent + 1, 'if %s in %s:' % (boolean, w.ref(typ.false_choices)))
+    w.line(indent + 2, '%s = False' % boolean)
+    if typ.true_choices:
+        w.line(indent + 1, 'elif %s in %s:' % (boolean,
+                                               w.ref(typ.true_choices)))
+        w.line(indent + 2, '%s = True' % boolean)
+        w.line(indent + 1, 'else:')
+        w.line(indent + 2, FAIL)
+    else:
+        w.line(indent + 1, 'else:')
+        w.line(indent + 2, '%s = True' % boolean)
+    if node.validator is not None:
+        _write_validator(w, node, node.validator, boolean, indent + 1)
+
+
+def _write_mapping(w, node, value, indent):
+    w.line(indent, 'if %s is null:' % value)
+    _write_missing(w, node, indent + 1)
+    w.line(indent, 'else:')
+    w.line(indent + 1, 'if type(%s) is not dict:' % value)
+    w.line(indent + 2, "if not hasattr(%s, 'items'): %s" % (value, FAIL))
+    w.line(indent + 2, '%s = dict(%s)' % (value, value))
+    for child in node.children:
+        child_value = w.var()
+        w.line(indent + 1, '%s = %s.get(%r, null)' % (child_value, value,
+                                                   child.name))
+        _write_node(w, child, child_value, indent + 1)
+
+
+def _write_sequence(w, node, value, indent):
+    w.line(indent, 'if %s is null:' % value)
+    _write_missing(w, node, indent + 1)
+    w.line(indent, 'else:')
+    w.line(indent + 1, 'if type(%s) is not list and not ('
+           "hasattr(%s, '__iter__') and not hasattr(%s, 'get') and "
+           'not isinstance(%s, basestring)):'
+           % (value, value, value, value))
+    if node.typ.accept_scalar:
+        w.line(indent + 2, '%s = [%s]' % (value, value))
+    else:
+        w.line(indent + 2, FAIL)
+    element = w.var()
+    w.line(indent + 1, 'for %s in %s:' % (element, value))
+    _write_node(w, node.children[0], element, indent + 2)
+
+
+_WRITERS = [
+    (String, _write_string),
+    ((Integer, Float), _write_number),
+    (Date, _write_date),
+    (Boolean, _write_boolean),
+    (Mapping, _write_mapping),
+    (Sequence, _write_sequence),
+]
+
+
+def _write_node(w, node, value, indent):
+    """
+    Write the code that checks `value` (the name of a variable in the
+    generated code) against `node`, and raises an exception if it is
+    invalid.
+    """
+    if _can_compile(node):
+        for typ, writer in _WRITERS:
+            if isinstance(node.typ, typ):
+                writer(w, node, value, indent)
+                return
+
+    w.line(indent, '%s.deserialize(%s)' % (w.ref(node, 'n'), value))
+
+
+def compile_schema(schema):
+    """
+    Compile a mapping schema into a single function that takes an item
+    and returns the list of top-level nodes whose fields are invalid; an
+    empty list means the item is valid.
+
+    Returns None if the root of the schema can not be compiled, in which
+    case items should be validated by colander directly.
+    """
+    if not isinstance(schema.typ, Mapping) or not _can_compile(schema):
+        return None
+
+    w = _CodeWriter()
+    # The names the generated code uses most are passed as default
+    # arguments, as local variables are faster to look up
+    w.line(0, 'def check(item, %s):' % ', '.join('%s=%s' % (name, name)
+                                                for name in LOCALS))
+    w.line(1, 'if type(item) is not dict:')
+    w.line(2, "if not hasattr(item, 'items'): return None")
+    w.line(2, 'item = dict(item)')
+    w.line(1, 'failed = []')
+    for child in schema.children:
+        value = w.var()
+        w.line(1, '%s = item.get(%r, null)' % (value, child.name))
+        w.line(1, 'if %s is not drop:' % value)
+        w.line(2, 'try:')
+        _write_node(w, child, value, 3)
+        w.line(2, 'except Exception:')
+        w.line(3, 'failed.append(%s)' % w.ref(child, 'n'))
+    w.line(1, 'return failed')
+    return w.function('check')
@@ -0,0 +1,104 @@
+import unittest, sys, os, shutil, tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/..')
+
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+from scrapy.http import Request, Response
+from scrapy.settings import Settings
+
+from onderwijsscrapers import download_cache
+from onderwijsscrapers.download_cache import DownloadCacheMiddleware
+
+URL = 'http://duo.nl/open_onderwijsdata/images/03.-alle-vestigingen-bo.csv'
+
+class TestDownloadCacheMiddleware(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        download_cache.download_caches.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+        download_cache.download_caches.clear()
+
+    def middleware(self, offline=False):
+        download_cache.download_caches.clear()
+        return DownloadCacheMiddleware(Settings({
+            'DOWNLOAD_CACHE_DIR': self.cache_dir,
+            'DOWNLOAD_CACHE_OFFLINE': offline}))
+
+    def download(self, middleware, response):
+        """
+        Pass a GET request for `URL` through `middleware` and return the
+        request and the response the spider gets. `response` is what the
+        server sends, if the request is downloaded.
+        """
+        request = Request(URL)
+        result = middleware.process_request(request, None)
+        if result is None:
+            result = middleware.process_response(request, response(request),
+                                                 None)
+        return request, result
+
+    def test_unchanged_files_are_served_from_the_cache(self):
+        middleware = self.middleware()
+        request, response = self.download(middleware, lambda request: Response(
+            URL, body='BRIN_NUMMER;PLAATSNAAM\n', headers={
+                'ETag': '"abc"', 'Content-Type': 'text/csv',
+                'Last-Modified': 'Tue, 01 Oct 2013 00:00:00 GMT'}))
+        self.assertFalse('If-None-Match' in request.headers)
+        self.assertEqual(response.body, 'BRIN_NUMMER;PLAATSNAAM\n')
+
+        request, response = self.download(
+            middleware, lambda request: Response(URL, status=304))
+        self.assertEqual(request.headers['If-None-Match'], '"abc"')
+        self.assertEqual(request.headers['If-Modified-Since'],
+                         'Tue, 01 Oct 2013 00:00:00 GMT')
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.body, 'BRIN_NUMMER;PLAATSNAAM\n')
+        self.assertEqual(response.headers['Content-Type'], 'text/csv')
+        self.assertTrue('cached' in response.flags)
+
+    def test_changed_files_replace_the_cached_file(self):
+        middleware = self.middleware()
+        self.download(middleware, lambda request: Response(
+            URL, body='old', headers={'ETag': '"1"'}))
+        self.download(middleware, lambda request: Response(
+            URL, body='new', headers={'ETag': '"2"'}))
+
+        request, response = self.download(
+            middleware, lambda request: Response(URL, status=304))
+        self.assertEqual(request.headers['If-None-Match'], '"2"')
+        self.assertEqual(response.body, 'new')
+
+    def test_not_modified_without_a_cached_file(self):
+        request, response = self.download(
+            self.middleware(), lambda request: Response(URL, status=304))
+        self.assertEqual(response.status, 304)
+
+    def test_other_methods_are_not_cached(self):
+        middleware = self.middleware()
+        request = Request(URL, method='POST', body='q=1')
+        self.assertEqual(middleware.process_request(request, None), None)
+        middleware.process_response(request, Response(URL, body='x'), None)
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+    def test_offline(self):
+        self.download(self.middleware(), lambda request: Response(
+            URL, body='BRIN_NUMMER\n', headers={'Content-Type': 'text/csv'}))
+
+        def fail(request):
+            self.fail('%s was downloaded in offline mode' % request.url)
+
+        middleware = self.middleware(offline=True)
+        request, response = self.download(middleware, fail)
+        self.assertEqual(response.body, 'BRIN_NUMMER\n')
+        self.assertTrue('cached' in response.flags)
+
+        self.assertRaises(IgnoreRequest, middleware.process_request,
+                          Request('http://duo.nl/other.csv'), None)
+
+    def test_disabled_without_a_cache_dir(self):
+        self.assertRaises(NotConfigured, DownloadCacheMiddleware,
+                          Settings({'DOWNLOAD_CACHE_DIR': None}))
+
+if __name__ == '__main__':
+    unittest.main()
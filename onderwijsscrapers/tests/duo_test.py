@@ -0,0 +1,305 @@
+import unittest, sys, os, csv, cStringIO
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/..')
+
+from onderwijsscrapers.spiders.duo import (BOARD_COLUMNS, VO_SCHOOL_COLUMNS,
+                                           VO_BRANCH_COLUMNS, PO_BRANCH_COLUMNS,
+                                           MBO_INSTITUTION_COLUMNS,
+                                           get_staff_people, get_staff_fte)
+
+ADDRESS = {
+    'STRAATNAAM': 'Dorpsstraat ',
+    'HUISNUMMER-TOEVOEGING': '1a',
+    'POSTCODE': '1234 AB',
+    'PLAATSNAAM': 'AMSTERDAM',
+}
+
+AREAS = {
+    'NODAAL GEBIED NAAM': 'Amsterdam',
+    'NODAAL GEBIED CODE': '1',
+    'RPA-GEBIED NAAM': 'Groot-Amsterdam',
+    'RPA-GEBIED CODE': '2',
+    'WGR-GEBIED NAAM': 'Stadsregio',
+    'WGR-GEBIED CODE': '3',
+    'COROPGEBIED NAAM': 'Groot-Amsterdam',
+    'ONDERWIJSGEBIED NAAM': 'Amsterdam e.o.',
+    'ONDERWIJSGEBIED CODE': '4',
+    'RMC-REGIO NAAM': 'Amsterdam',
+    'RMC-REGIO CODE': '5',
+}
+
+def read(mapping, values, rename=None, drop=()):
+    """
+    Map a CSV file with one row, which has all columns of `mapping`. The
+    columns not in `values` are empty; `rename` gives columns another
+    header and the columns in `drop` are left out.
+    """
+    rename = rename or {}
+    header = []
+    for field, columns, convert in mapping.fields:
+        if isinstance(columns, basestring):
+            columns = (columns,)
+        for column in columns:
+            if column not in header and column not in drop:
+                header.append(column)
+
+    lines = [';'.join(rename.get(column, column) for column in header),
+             ';'.join(values.get(column, '') for column in header)]
+    rows = csv.DictReader(cStringIO.StringIO('\n'.join(lines) + '\n'),
+                          delimiter=';')
+    return list(mapping.map_rows(rows))
+
+class TestRowMappings(unittest.TestCase):
+    def test_board(self):
+        values = dict(ADDRESS, **{
+            'BEVOEGD GEZAG NUMMER': '40000',
+            'BEVOEGD GEZAG NAAM': ' Stichting ',
+            'GEMEENTENUMMER': '363',
+            'ADMINISTRATIEKANTOORNUMMER': '',
+        })
+        self.assertEqual(read(BOARD_COLUMNS, values), [{
+            'board_id': 40000,
+            'name': 'Stichting',
+            'address': {'street': 'Dorpsstraat 1a', 'zip_code': '1234AB',
+                        'city': 'AMSTERDAM'},
+            'correspondence_address': {'street': None, 'zip_code': None,
+                                       'city': None},
+            'municipality': None,
+            'municipality_code': 363,
+            'phone': None,
+            'website': None,
+            'denomination': None,
+            'administrative_office_id': None,
+        }])
+
+    def test_school_blanks_are_none(self):
+        values = dict(ADDRESS, **AREAS)
+        values.update({
+            'STRAATNAAM CORRESPONDENTIEADRES': 'Postbus',
+            'HUISNUMMER-TOEVOEGING CORRESPONDENTIEADRES': '12',
+            'POSTCODE CORRESPONDENTIEADRES': '1200 AA',
+            'PLAATSNAAM CORRESPONDENTIEADRES': 'AMSTERDAM',
+            'BEVOEGD GEZAG NUMMER': '40000',
+            'BRIN NUMMER': '00AA',
+            'INSTELLINGSNAAM': 'School',
+            'GEMEENTENUMMER': '363',
+            'ONDERWIJSSTRUCTUUR': 'VMBO/HAVO',
+        })
+        self.assertEqual(read(VO_SCHOOL_COLUMNS, values), [{
+            'board_id': 40000,
+            'brin': '00AA',
+            'name': 'School',
+            'address': {'street': 'Dorpsstraat 1a', 'zip_code': '1234AB',
+                        'city': 'AMSTERDAM'},
+            'correspondence_address': {'street': 'Postbus 12',
+                                       'zip_code': '1200AA',
+                                       'city': 'AMSTERDAM'},
+            'province': None,
+            'municipality': None,
+            'municipality_code': 363,
+            'denomination': None,
+            'website': None,
+            'phone': None,
+            'education_structures': ['VMBO', 'HAVO'],
+            # An empty 'COROPGEBIED CODE' is left out
+            'nodal_area': 'Amsterdam',
+            'nodal_area_code': 1,
+            'rpa_area': 'Groot-Amsterdam',
+            'rpa_area_code': 2,
+            'wgr_area': 'Stadsregio',
+            'wgr_area_code': 3,
+            'corop_area': 'Groot-Amsterdam',
+            'education_area': 'Amsterdam e.o.',
+            'education_area_code': 4,
+            'rmc_region': 'Amsterdam',
+            'rmc_region_code': 5,
+        }])
+
+    def test_vo_branch(self):
+        values = dict(ADDRESS, **AREAS)
+        values.update({
+            'VESTIGINGSNAAM': 'School',
+            'BEVOEGD GEZAG NUMMER': '40000',
+            'BRIN NUMMER': '00AA',
+            'VESTIGINGSNUMMER': '00AA01',
+            'COROPGEBIED CODE': '6',
+        })
+        branch, = read(VO_BRANCH_COLUMNS, values)
+        self.assertEqual((branch['brin'], branch['branch_id']), ('00AA', 1))
+        self.assertEqual(branch['corop_area_code'], 6)
+        self.assertEqual(branch['education_structures'], None)
+        self.assertEqual(branch['correspondence_address'],
+                         {'street': None, 'zip_code': None, 'city': None})
+
+        # Branches without a BRIN or branch number leave these out
+        del values['BRIN NUMMER']
+        del values['VESTIGINGSNUMMER']
+        branch, = read(VO_BRANCH_COLUMNS, values)
+        self.assertFalse('brin' in branch)
+        self.assertFalse('branch_id' in branch)
+
+    def test_po_branch_columns(self):
+        values = dict(ADDRESS, **AREAS)
+        values.update({
+            'VESTIGINGSNAAM': 'School',
+            'BEVOEGD GEZAG NUMMER': '40000',
+            'BRIN NUMMER': '00AA',
+            'VESTIGINGSNUMMER': '00AA02',
+        })
+        branch, = read(PO_BRANCH_COLUMNS, values,
+                       rename={'VESTIGINGSNAAM': 'VESTIGINGSNAAM '})
+        self.assertEqual((branch['name'], branch['brin'], branch['branch_id']),
+                         ('School', '00AA', 2))
+
+        # The special education set has a 'BRINNUMMER' column, and no
+        # branch numbers
+        branch, = read(PO_BRANCH_COLUMNS, values,
+                       rename={'BRIN NUMMER': 'BRINNUMMER'},
+                       drop=['VESTIGINGSNUMMER'])
+        self.assertEqual(branch['brin'], '00AA')
+        self.assertFalse('branch_id' in branch)
+
+    def test_mbo_institution(self):
+        values = dict(ADDRESS, **{
+            'STRAATNAAM CORRESPONDENTIEADRES': 'Postbus',
+            'HUISNUMMER-TOEVOEGING CORRESPONDENTIEADRES': '12',
+            'POSTCODE CORRESPONDENTIEADRES': '1200 AA',
+            'PLAATSNAAM CORRESPONDENTIEADRES': 'AMSTERDAM',
+            'BRIN NUMMER': '25AA',
+            'BEVOEGD GEZAG NUMMER': '30000',
+            'INSTELLINGSNAAM': 'ROC',
+            'DENOMINATIE': 'Openbaar',
+            'GEMEENTENAAM': 'AMSTERDAM',
+            'GEMEENTENUMMER': '363',
+            'TELEFOONNUMMER': '020-1234567',
+            'INTERNETADRES': 'www.roc.nl',
+            'COROPGEBIED NAAM': 'Groot-Amsterdam',
+            'COROPGEBIED CODE': '23',
+            'NODAAL GEBIED NAAM': 'Amsterdam',
+            'NODAAL GEBIED CODE': '1',
+            'ONDERWIJSGEBIED NAAM': 'Amsterdam e.o.',
+            'ONDERWIJSGEBIED CODE': '4',
+            'RPA-GEBIED NAAM': 'Groot-Amsterdam',
+            'RPA-GEBIED CODE': '2',
+            'RMC-REGIO NAAM': 'Amsterdam',
+            'RMC-REGIO CODE': '5',
+            'NAAM WGR-GEBIED': 'Stadsregio',
+            'WGR-GEBIED CODE': '3',
+            'MBO INSTELLINGSSOORT - NAAM': 'ROC',
+            'MBO INSTELLINGSOORT - CODE': '1',
+        })
+        # Some headers of the mbo file have a trailing space
+        rename = dict((column, column + ' ') for column in [
+            'INSTELLINGSNAAM', 'ONDERWIJSGEBIED NAAM', 'RMC-REGIO NAAM',
+            'RMC-REGIO CODE'])
+        self.assertEqual(read(MBO_INSTITUTION_COLUMNS, values, rename), [{
+            'brin': '25AA',
+            'board_id': '30000',
+            'name': 'ROC',
+            # The baseline parser set this as `adress`
+            'address': {'street': 'Dorpsstraat 1a', 'zip_code': '1234AB',
+                        'city': 'AMSTERDAM'},
+            'correspondence_address': {'street': 'Postbus 12',
+                                       'zip_code': '1200AA',
+                                       'city': 'AMSTERDAM'},
+            'denomination': 'Openbaar',
+            'municipality': 'AMSTERDAM',
+            'municipality_code': 363,
+            'phone': '020-1234567',
+            'website': 'www.roc.nl',
+            'corop_area': 'Groot-Amsterdam',
+            'corop_area_code': 23,
+            'nodal_area': 'Amsterdam',
+            'nodal_area_code': 1,
+            'education_area': 'Amsterdam e.o.',
+            'education_area_code': 4,
+            'rpa_area': 'Groot-Amsterdam',
+            'rpa_area_code': 2,
+            'rmc_region': 'Amsterdam',
+            'rmc_region_code': 5,
+            'wgr_area': 'Stadsregio',
+            'wgr_area_code': 3,
+            'mbo_institution_kind': 'ROC',
+            'mbo_institution_kind_code': '1',
+        }])
+
+class StaffFile(object):
+    """ A downloaded staff file of which the sheet was parsed already. """
+    def __init__(self, rows):
+        self.meta = {'xls_rows': {'per owtype-bestuur-brin-functie': rows}}
+
+def staff_row(brin, function_group, **values):
+    row = {'BRIN NUMMER': brin, 'BEVOEGD GEZAG': '40000.0',
+           'FUNCTIEGROEP': function_group}
+    for column in ['PERSONEN', 'MANNEN', 'PERSONEN 25-35 JAAR',
+                   'PERSONEN JONGER DAN 25 JAAR', 'PERSONEN OUDER DAN 65 JAAR',
+                   'LEEFTIJD ONBEKEND', "PERSONEN 0,5-0,8 FTE'S",
+                   "PERSONEN MEER DAN 1,0 FTE'S", "FTE'S", "FTE'S MANNEN",
+                   "FTE'S PERSONEN 25-35 JAAR"]:
+        for year in [2012, 2013]:
+            row['%s %d' % (column, year)] = '*'
+    row.update(values)
+    return row
+
+def by_range(entries):
+    return sorted(entries, key=lambda entry: entry['range'])
+
+class TestStaffFiles(unittest.TestCase):
+    def setUp(self):
+        # Missing values are starred; all values of 2013 are missing for
+        # the school's teachers
+        self.response = StaffFile([
+            staff_row('00AA ', 'Onderwijzend personeel', **{
+                'PERSONEN 2012': '12', 'MANNEN 2012': '*',
+                'PERSONEN 25-35 JAAR 2012': '4',
+                'PERSONEN JONGER DAN 25 JAAR 2012': '1',
+                'PERSONEN OUDER DAN 65 JAAR 2012': '*',
+                'LEEFTIJD ONBEKEND 2012': '0',
+                "PERSONEN MEER DAN 1,0 FTE'S 2012": '2',
+                "FTE'S 2012": '10.5', "FTE'S PERSONEN 25-35 JAAR 2012": '3.2',
+            }),
+            staff_row('bovenschools', 'Directie', **{
+                'PERSONEN 2013': '2', "PERSONEN 0,5-0,8 FTE'S 2013": '1',
+            }),
+        ])
+
+    def test_staff_people(self):
+        staff = get_staff_people(self.response)
+        self.assertEqual(sorted(staff), [(2012, '00AA'), (2013, '00AA')])
+
+        group, = staff[(2012, '00AA')]
+        self.assertEqual(group['function_group'], 'Onderwijzend personeel')
+        people = group['staff']
+        self.assertEqual(by_range(people.pop('staff_age')), [
+            {'range': '25-35', 'count': 4},
+            {'range': '<25', 'count': 1},
+            {'range': '?', 'count': 0},
+        ])
+        self.assertEqual(people.pop('staff_workload'),
+                         [{'range': '>1,0', 'count': 2}])
+        self.assertEqual(people, {'staff': 12})
+
+        # Years without any value get no workload and age lists
+        self.assertEqual(staff[(2013, '00AA')], [{
+            'function_group': 'Onderwijzend personeel',
+            'staff': {'staff': 0}
+        }])
+
+        staff = get_staff_people(self.response, with_brin=False)
+        self.assertEqual(staff[(2013, 40000)], [{
+            'function_group': 'Directie',
+            'staff': {'staff': 2, 'staff_age': [],
+                      'staff_workload': [{'range': '0,5-0,8', 'count': 1}]}
+        }])
+        self.assertEqual(staff[(2012, 40000)][0]['staff'], {'staff': 0})
+
+    def test_staff_fte(self):
+        fte = get_staff_fte(self.response)
+        self.assertEqual(fte[(2012, '00AA')], [{
+            'function_group': 'Onderwijzend personeel',
+            'fte': {'fte': 10.5, 'fte_workload': [],
+                    'fte_age': [{'range': '25-35', 'fte': 3.2}]}
+        }])
+        self.assertEqual(fte[(2013, '00AA')][0]['fte'], {'fte': 0})
+
+if __name__ == '__main__':
+    unittest.main()
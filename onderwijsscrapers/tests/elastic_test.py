@@ -0,0 +1,111 @@
+import unittest, sys, os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/..')
+
+from requests import Response
+from requests.adapters import BaseAdapter
+from requests.exceptions import ConnectionError
+from rawes.elastic_exception import ElasticException
+
+from onderwijsscrapers import elastic
+
+class StubAdapter(BaseAdapter):
+    """
+    Answers requests with the next status code in `responses`, or raises
+    a `ConnectionError` for `None`. Keeps the paths that were requested.
+    """
+    def __init__(self, *responses):
+        super(StubAdapter, self).__init__()
+        self.responses = list(responses)
+        self.paths = []
+
+    def send(self, request, **kwargs):
+        self.paths.append(request.path_url)
+        status = self.responses.pop(0)
+        if status is None:
+            raise ConnectionError('Connection refused')
+
+        response = Response()
+        response.status_code = status
+        response._content = '{"status": %d}' % status
+        response.request = request
+        response.url = request.url
+        return response
+
+    def close(self):
+        pass
+
+class TestElastic(unittest.TestCase):
+    def setUp(self):
+        self.sleep = elastic.sleep
+        self.delays = []
+        elastic.sleep = self.delays.append
+
+    def tearDown(self):
+        elastic.sleep = self.sleep
+
+    def client(self, *responses, **options):
+        es = elastic.Elastic('localhost:9200', **options)
+        adapter = StubAdapter(*responses)
+        es.connection_pool.connections[0].session.mount('http://', adapter)
+        return es, adapter
+
+    def test_overloaded_requests_are_retried(self):
+        es, adapter = self.client(429, 503, 200, retry_delay=1)
+        self.assertEqual(es.duo.get('_search'), {'status': 200})
+        self.assertEqual(adapter.paths, ['/duo/_search'] * 3)
+        self.assertEqual(len(self.delays), 2)
+        self.assertTrue(0 <= self.delays[0] <= 1)
+        self.assertTrue(0 <= self.delays[1] <= 2)
+
+    def test_connection_errors_are_retried(self):
+        es, adapter = self.client(None, 200)
+        self.assertEqual(es.get('duo'), {'status': 200})
+        self.assertEqual(len(adapter.paths), 2)
+
+    def test_retries_are_limited(self):
+        es, adapter = self.client(503, 503, 503, max_retries=2)
+        try:
+            es.get('duo')
+            self.fail('ElasticException not raised')
+        except ElasticException, e:
+            self.assertEqual(e.status_code, 503)
+        self.assertEqual(len(adapter.paths), 3)
+        self.assertEqual(len(self.delays), 2)
+
+        es, adapter = self.client(None, None, max_retries=1)
+        self.assertRaises(ConnectionError, es.get, 'duo')
+        self.assertEqual(len(adapter.paths), 2)
+
+    def test_other_errors_are_not_retried(self):
+        es, adapter = self.client(404, 200)
+        self.assertRaises(ElasticException, es.get, 'duo/po_branch/1')
+        self.assertEqual(len(adapter.paths), 1)
+        self.assertEqual(self.delays, [])
+
+    def test_backoff(self):
+        es = elastic.Elastic(retry_delay=0.5, max_retry_delay=3)
+        for attempt, limit in [(1, 0.5), (2, 1), (3, 2), (4, 3), (10, 3)]:
+            for _ in range(20):
+                self.assertTrue(0 <= es.backoff(attempt) <= limit)
+
+class TestGetClient(unittest.TestCase):
+    def setUp(self):
+        self.clients = elastic.clients
+        elastic.clients = {}
+
+    def tearDown(self):
+        elastic.clients = self.clients
+
+    def test_clients_are_shared_per_url_and_options(self):
+        es = elastic.get_client('localhost:9200', timeout=10, pool_size=4)
+        self.assertTrue(
+            elastic.get_client('localhost:9200', pool_size=4, timeout=10) is es)
+        self.assertEqual(es.pool_size, 4)
+
+        self.assertFalse(elastic.get_client('localhost:9200', timeout=10) is es)
+        self.assertFalse(
+            elastic.get_client('otherhost:9200', timeout=10, pool_size=4) is es)
+        self.assertEqual(len(elastic.clients), 3)
+
+if __name__ == '__main__':
+    unittest.main()
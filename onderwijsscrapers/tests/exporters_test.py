@@ -0,0 +1,106 @@
+import unittest, sys, os, json
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/..')
+
+from rawes.elastic_exception import ElasticException
+
+from onderwijsscrapers import exporters
+
+class BulkElastic(object):
+    """
+    Keeps the `_bulk` requests it gets. Each request is answered by the
+    next function in `responses` (if any), which gets the ids of the
+    items in the request.
+    """
+    def __init__(self, *responses):
+        self.requests = []
+        self.responses = list(responses)
+
+    def post(self, path, data=None):
+        lines = data.splitlines()
+        ids = [json.loads(line).values()[0]['_id'] for line in lines[::2]]
+        self.requests.append(ids)
+        if self.responses:
+            return self.responses.pop(0)(ids)
+        return {'errors': False}
+
+def item_errors(**errors):
+    """ A bulk response in which the items in `errors` failed. """
+    def respond(ids):
+        items = []
+        for doc_id in ids:
+            if doc_id in errors:
+                status, error = errors[doc_id]
+                items.append({'index': {'_id': doc_id, 'status': status,
+                                        'error': error}})
+            else:
+                items.append({'index': {'_id': doc_id, 'status': 201}})
+        return {'errors': bool(errors), 'items': items}
+    return respond
+
+def rejected(status):
+    def respond(ids):
+        raise ElasticException('Rejected', {'status': status}, status)
+    return respond
+
+class TestElasticSearchBulk(unittest.TestCase):
+    def setUp(self):
+        self.get_client = exporters.get_client
+
+    def tearDown(self):
+        exporters.get_client = self.get_client
+
+    def exporter(self, es, **options):
+        exporters.get_client = lambda url, **client_options: es
+        return exporters.ElasticSearchExporter(
+            '2013-10-01T00:00:00Z', 'duo', 'po_branch', 'localhost:9200',
+            bulk_retry_delay=0, **options)
+
+    def test_buffered_documents_are_flushed_on_close(self):
+        es = BulkElastic()
+        exporter = self.exporter(es, bulk_size=2)
+        for doc_id in ['a', 'b', 'c']:
+            exporter.save({'brin': doc_id}, doc_id)
+        self.assertEqual(es.requests, [['a', 'b']])
+
+        exporter.delete('d')
+        exporter.close()
+        self.assertEqual(es.requests, [['a', 'b'], ['c', 'd']])
+        self.assertEqual(exporter.failed, [])
+
+    def test_only_transient_failures_are_retried(self):
+        es = BulkElastic(item_errors(
+            b=(429, {'type': 'es_rejected_execution_exception'}),
+            c=(400, {'type': 'mapper_parsing_exception'}),
+            d=(503, 'UnavailableShardsException[...]')))
+        exporter = self.exporter(es, bulk_size=10)
+        for doc_id in ['a', 'b', 'c', 'd']:
+            exporter.save({'brin': doc_id}, doc_id)
+        exporter.close()
+
+        self.assertEqual(es.requests, [['a', 'b', 'c', 'd'], ['b', 'd']])
+        self.assertEqual(exporter.failed,
+                         [('c', {'type': 'mapper_parsing_exception'})])
+
+    def test_items_that_keep_failing_are_given_up(self):
+        rejected_item = item_errors(a=(429, 'EsRejectedExecutionException[]'))
+        es = BulkElastic(*[rejected_item] * 3)
+        exporter = self.exporter(es, bulk_size=10, bulk_max_retries=2)
+        exporter.save({'brin': 'a'}, 'a')
+        exporter.close()
+
+        self.assertEqual(es.requests, [['a']] * 3)
+        self.assertEqual(exporter.failed,
+                         [('a', 'EsRejectedExecutionException[]')])
+
+    def test_rejected_requests(self):
+        es = BulkElastic(rejected(503), rejected(400))
+        exporter = self.exporter(es, bulk_size=10)
+        exporter.save({'brin': 'a'}, 'a')
+        exporter.close()
+
+        # Only the overloaded request is retried
+        self.assertEqual(es.requests, [['a'], ['a']])
+        self.assertEqual(exporter.failed, [('a', {'status': 400})])
+
+if __name__ == '__main__':
+    unittest.main()
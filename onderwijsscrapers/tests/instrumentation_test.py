@@ -0,0 +1,84 @@
+import unittest, sys, os, shutil, tempfile, json
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/..')
+
+from onderwijsscrapers.instrumentation import Histogram, Instrumentation
+
+class Stats(object):
+    def __init__(self):
+        self.values = {}
+
+    def set_value(self, key, value, spider=None):
+        self.values[key] = value
+
+class TestHistogram(unittest.TestCase):
+    def test_buckets(self):
+        histogram = Histogram()
+        for seconds in [0.0005, 0.001, 0.003, 0.003, 20]:
+            histogram.add(seconds)
+
+        self.assertEqual(histogram.buckets(), [('<=1ms', 2), ('<=5ms', 2),
+                                               ('>10000ms', 1)])
+        summary = histogram.as_dict()
+        self.assertEqual(summary['count'], 5)
+        self.assertAlmostEqual(summary['mean_ms'], 4001.5)
+        self.assertAlmostEqual(summary['max_ms'], 20000)
+
+    def test_update(self):
+        histogram, other = Histogram(), Histogram()
+        histogram.add(0.001)
+        other.add(0.001)
+        other.add(0.15)
+        histogram.update(other)
+
+        self.assertEqual(histogram.buckets(), [('<=1ms', 2), ('<=200ms', 1)])
+        self.assertAlmostEqual(histogram.max, 0.15)
+        self.assertEqual(Histogram().as_dict()['mean_ms'], 0)
+
+class TestInstrumentation(unittest.TestCase):
+    def setUp(self):
+        self.instrumentation = Instrumentation()
+        self.instrumentation.record('merge', 2.0, items=10)
+        self.instrumentation.record('merge', 3.0, items=15)
+        with self.instrumentation.stage('export', items=3):
+            pass
+        self.instrumentation.histogram('geocode').add(0.002)
+
+    def test_report(self):
+        report = self.instrumentation.report()
+        self.assertEqual(report['stages'].keys(), ['merge', 'export'])
+        self.assertEqual(report['stages']['merge'], {
+            'items': 25, 'seconds': 5.0, 'calls': 2, 'items_per_second': 5.0})
+        self.assertEqual(report['stages']['export']['calls'], 1)
+        self.assertEqual(report['latencies']['geocode']['count'], 1)
+        self.assertTrue(report['peak_rss_kb'] > 0)
+
+    def test_publish(self):
+        stats = Stats()
+        self.instrumentation.publish(stats, None)
+        self.assertEqual(stats.values['pipeline/merge/items'], 25)
+        self.assertEqual(stats.values['pipeline/latency/geocode/<=2ms'], 1)
+        self.assertTrue('pipeline/peak_rss_kb' in stats.values)
+
+    def test_write_report(self):
+        report_dir = os.path.join(tempfile.mkdtemp(), 'reports')
+        try:
+            path = self.instrumentation.write_report(
+                report_dir, 'duo_all', '2013-10-01T00:00:00Z',
+                {'item_scraped_count': 25, 'finish_reason': 'finished',
+                 'pipeline/merge/items': 25})
+            self.assertEqual(os.path.basename(path),
+                             'duo_all_20131001T000000Z.json')
+
+            with open(path) as f:
+                report = json.load(f)
+        finally:
+            shutil.rmtree(os.path.dirname(report_dir))
+
+        self.assertEqual(report['spider'], 'duo_all')
+        self.assertEqual(report['stages']['merge']['items'], 25)
+        # The pipeline stats are in the report already
+        self.assertEqual(report['scrapy_stats'], {'item_scraped_count': 25,
+                                                  'finish_reason': 'finished'})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,4 @@
-import unittest, sys, os
+import unittest, sys, os, shutil, tempfile
 sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/..')
 
 from onderwijsscrapers import item_enrichment
@@ -41,5 +41,89 @@ class TestGeocodingService(unittest.TestCase):
 
         self.assertIsNotNone(res)
 
+class TestGeocodeCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = item_enrichment.GeocodeCache(
+            os.path.join(self.cache_dir, 'geocode_cache.sqlite'),
+            ttl=60, negative_ttl=60)
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.cache_dir)
+
+    def test_normalized_address_hit(self):
+        geocoded = {'geo_location': {'lat': 52.2, 'lon': 6.8}}
+        self.cache.set({
+            "city": "ENSCHEDE",
+            "street": "Campuslaan  45",
+            "zip_code": "7522NG"
+        }, geocoded)
+
+        self.assertEqual(self.cache.get({
+            "city": "Enschede",
+            "street": "Campuslaan 45 ",
+            "zip_code": "7522 ng"
+        }), (True, geocoded))
+        self.assertEqual(self.cache.stats['hits'], 1)
+
+    def test_negative_result(self):
+        address = {"city": "NERGENS", "street": None, "zip_code": None}
+        self.cache.set(address, None)
+
+        self.assertEqual(self.cache.get(address), (True, None))
+        self.assertEqual(self.cache.stats['negative_hits'], 1)
+
+    def test_expired_result(self):
+        address = {"city": "ENSCHEDE", "street": "Campuslaan 45",
+                   "zip_code": "7522NG"}
+        self.cache.ttl = -1
+        self.cache.set(address, {'geo_location': {'lat': 52.2, 'lon': 6.8}})
+
+        self.assertEqual(self.cache.get(address), (False, None))
+        self.assertEqual(self.cache.hit_rate, 0.0)
+
+class TestLocalGeocoder(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.data_dir, 'bag.csv')
+        with open(self.path, 'w') as f:
+            f.write('postcode,huisnummer,lat,lon\n'
+                    '7522NG,45,52.2391,6.8506\n'
+                    '3122AM,29,52.0850,4.3906\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def test_house_number(self):
+        self.assertEqual(item_enrichment.parse_house_number(
+            'Valeriusstraat 29- 31'), 29)
+        self.assertEqual(item_enrichment.parse_house_number(
+            'Hoofdstraat 12 a'), 12)
+        self.assertIsNone(item_enrichment.parse_house_number('Postbus'))
+
+    def test_lookup_from_csv_and_index(self):
+        for i in range(2):
+            # The second geocoder loads the saved index
+            geocoder = item_enrichment.LocalGeocoder(self.path)
+            res = geocoder.geocode({
+                "city": "SCHIEDAM",
+                "street": "Valeriusstraat 29- 31",
+                "zip_code": "3122 AM"
+            })
+
+            self.assertEqual(res['geo_location'], {'lat': 52.0850,
+                                                   'lon': 4.3906})
+        self.assertTrue(os.path.exists(self.path + '.idx'))
+
+    def test_miss(self):
+        geocoder = item_enrichment.LocalGeocoder(self.path)
+        self.assertIsNone(geocoder.geocode({
+            "city": "ENSCHEDE",
+            "street": "Campuslaan 47",
+            "zip_code": "7522NG"
+        }))
+        self.assertEqual(geocoder.stats, {'hits': 0, 'misses': 1})
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,50 @@
+import unittest, sys, os, shutil, tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/..')
+
+from onderwijsscrapers import item_stores
+
+class TestSQLiteItemStore(unittest.TestCase):
+    def setUp(self):
+        self.store_dir = tempfile.mkdtemp()
+        self.store = item_stores.SQLiteItemStore('duo_po_branches', 'items',
+                                                 store_dir=self.store_dir)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.store_dir)
+
+    def test_update_merges_partial_items(self):
+        self.store.update('2013-00AA-0', {'brin': '00AA', 'name': 'School'})
+        self.store.update('2013-00AA-0', {'students': [{'count': 10}]})
+
+        self.assertEqual(self.store.get('2013-00AA-0'), {
+            'brin': '00AA',
+            'name': 'School',
+            'students': [{'count': 10}]
+        })
+        self.assertEqual(len(self.store), 1)
+
+    def test_iteritems_keeps_insertion_order(self):
+        for item_id in ['b', 'a', 'c']:
+            self.store.put(item_id, {'id': item_id})
+        self.store.update('b', {'extra': True})
+
+        self.assertEqual([item_id for item_id, item in self.store.iteritems()],
+                         ['b', 'a', 'c'])
+
+    def test_missing_item(self):
+        self.assertFalse('missing' in self.store)
+        self.assertIsNone(self.store.get('missing'))
+
+    def test_close_removes_database(self):
+        self.store.put('a', {})
+        self.store.close()
+        self.assertFalse(os.path.exists(self.store.path))
+
+    def test_close_twice(self):
+        self.store.put('a', {})
+        self.store.close()
+        self.store.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest, sys, os, shutil, tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/..')
+
+from onderwijsscrapers.manifests import ExportManifest, content_hash
+
+class TestExportManifest(unittest.TestCase):
+    def setUp(self):
+        self.manifest_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.manifest_dir)
+
+    def manifest(self):
+        return ExportManifest(self.manifest_dir, 'elasticsearch', 'duo',
+                              'po_branch')
+
+    def test_meta_is_not_hashed(self):
+        item = {'brin': '00AA', 'meta': {'item_scraped_at': '2013-01-01'}}
+        other_crawl = {'brin': '00AA', 'meta': {'item_scraped_at': '2014-01-01'}}
+
+        self.assertEqual(content_hash(item), content_hash(other_crawl))
+        self.assertNotEqual(content_hash(item), content_hash({'brin': '00AB'}))
+
+    def test_changed_and_deleted_documents(self):
+        manifest = self.manifest()
+        self.assertTrue(manifest.is_changed('a', 'hash-a'))
+        self.assertTrue(manifest.is_changed('b', 'hash-b'))
+        manifest.save()
+
+        manifest = self.manifest()
+        self.assertFalse(manifest.is_changed('a', 'hash-a'))
+        self.assertTrue(manifest.is_changed('c', 'hash-c'))
+        self.assertEqual(manifest.deleted(), ['b'])
+
+    def test_revert_failed_documents(self):
+        manifest = self.manifest()
+        manifest.is_changed('a', 'hash-a')
+        manifest.is_changed('b', 'hash-b')
+        manifest.save()
+
+        # 'a' changed and 'c' is new, but both failed to export, and the
+        # deletion of 'b' failed as well
+        manifest = self.manifest()
+        manifest.is_changed('a', 'hash-a2')
+        manifest.is_changed('c', 'hash-c')
+        for doc_id in ['a', 'b', 'c']:
+            manifest.revert(doc_id)
+        manifest.save()
+
+        manifest = self.manifest()
+        self.assertTrue(manifest.is_changed('a', 'hash-a2'))
+        self.assertTrue(manifest.is_changed('c', 'hash-c'))
+        self.assertEqual(manifest.deleted(), ['b'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,257 @@
+import unittest, sys, os, shutil, tempfile, json
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/..')
+
+from colander import MappingSchema
+from rawes.elastic_exception import ElasticException
+from scrapy.conf import settings
+
+from onderwijsscrapers import exporters
+from onderwijsscrapers.exporters import encode
+from onderwijsscrapers.item_stores import MemoryItemStore
+from onderwijsscrapers.manifests import ExportManifest
+from onderwijsscrapers.pipelines import (OnderwijsscrapersPipeline,
+                                         check_export_methods)
+
+class RecordingExporter(exporters.Exporter):
+    """ Keeps the `data` it gets for every item. """
+    saved = []
+
+    def __init__(self, crawl_started_at, index, doctype, pretty):
+        super(RecordingExporter, self).__init__(crawl_started_at, index,
+                                                doctype)
+
+    @classmethod
+    def uses_data(cls, options):
+        return not options['pretty']
+
+    def save(self, item, doc_id=None, data=None):
+        self.saved.append(data)
+
+class TestExportAll(unittest.TestCase):
+    def export_all(self, *pretty):
+        RecordingExporter.saved = []
+        exports = [('method%d' % i, {
+            'method_properties': {'exporter': RecordingExporter,
+                                  'options': {'pretty': method_pretty}},
+            'index': 'duo',
+            'doctype': 'po_branch'
+        }) for i, method_pretty in enumerate(pretty)]
+        OnderwijsscrapersPipeline().export_all(exports,
+                                               [('a', {'brin': '00AA'})])
+        return RecordingExporter.saved
+
+    def test_items_are_encoded_once_for_all_methods(self):
+        self.assertEqual(self.export_all(False, True),
+                         [encode({'brin': '00AA'})] * 2)
+
+    def test_items_are_not_encoded_when_unused(self):
+        self.assertEqual(self.export_all(True, True), [None, None])
+        self.assertFalse(exporters.FileExporter.uses_data({'indent': 4}))
+        self.assertTrue(exporters.FileExporter.uses_data({'indent': None}))
+
+class TestIncrementalExport(unittest.TestCase):
+    def setUp(self):
+        self.export_dir = tempfile.mkdtemp()
+        self.pipeline = OnderwijsscrapersPipeline()
+        self.method_properties = {
+            'exporter': exporters.FileExporter,
+            'incremental': True,
+            'options': {
+                'export_dir': self.export_dir,
+                'create_tar': False,
+                'remove_json': False
+            }
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.export_dir)
+
+    def export(self, items):
+        manifest = ExportManifest(os.path.join(self.export_dir, 'manifests'),
+                                  'file', 'duo', 'po_branch')
+        exported = self.pipeline.export(
+            self.method_properties, 'duo', 'po_branch',
+            [(item_id, item, encode(item)) for item_id, item in items],
+            manifest=manifest)
+        manifest.save()
+        return exported
+
+    def test_deleted_documents_are_removed(self):
+        self.assertEqual(self.export([('a', {'brin': '00AA'}),
+                                      ('b', {'brin': '00AB'})]),
+                         set(['a', 'b']))
+
+        # 'a' is unchanged and 'b' disappeared
+        self.assertEqual(self.export([('a', {'brin': '00AA'})]), set())
+        self.assertEqual(os.listdir(os.path.join(self.export_dir,
+                                                 'duo_po_branch')),
+                         ['a.json'])
+
+    def test_exporters_that_can_not_delete_are_rejected(self):
+        check_export_methods({'file': self.method_properties})
+
+        for exporter in [exporters.NDJSONExporter,
+                         exporters.ColumnarExporter]:
+            self.assertRaises(ValueError, check_export_methods, {
+                'other': {'exporter': exporter, 'incremental': True,
+                          'options': {}}
+            })
+            check_export_methods({'other': {'exporter': exporter,
+                                            'options': {}}})
+
+    def test_file_exporters_with_a_tarball_are_rejected(self):
+        self.method_properties['options']['create_tar'] = True
+        self.assertRaises(ValueError, check_export_methods,
+                          {'file': self.method_properties})
+
+class FakeElastic(object):
+    """
+    Keeps indices as dicts of `(doctype, id)` to document, and implements
+    the requests of a versioned `ElasticSearchExporter`.
+    """
+    def __init__(self):
+        self.indices = {}
+        self.aliases = {}
+        self.swaps = 0
+        self.scrolls = {}
+
+    def resolve(self, name):
+        return self.aliases.get(name, name)
+
+    def head(self, name):
+        if self.resolve(name) not in self.indices:
+            raise ElasticException('Not found', {}, 404)
+        return True
+
+    def put(self, path, data=None):
+        if '/' not in path:
+            self.indices[path] = {}
+
+    def delete(self, name):
+        del self.indices[name]
+
+    def get(self, path, params=None, data=None):
+        if path == '_aliases':
+            return dict((name, {'aliases': dict((alias, {}) for alias, index
+                                                in self.aliases.items()
+                                                if index == name)})
+                        for name in self.indices)
+        if path == '_search/scroll':
+            hits, self.scrolls[data] = self.scrolls[data], []
+            return {'_scroll_id': data, 'hits': {'hits': hits}}
+
+        index = self.resolve(path.split('/')[0])
+        scroll_id = str(len(self.scrolls))
+        self.scrolls[scroll_id] = [
+            {'_type': doctype, '_id': doc_id, '_source': source}
+            for (doctype, doc_id), source in self.indices[index].items()]
+        return {'_scroll_id': scroll_id}
+
+    def post(self, path, data=None):
+        if path == '_aliases':
+            for action in data['actions']:
+                if 'add' in action:
+                    self.aliases[action['add']['alias']] = \
+                        action['add']['index']
+            self.swaps += 1
+        elif path.endswith('/_bulk'):
+            index, doctype = path.split('/')[:2]
+            docs = self.indices[index]
+            lines = data.splitlines()
+            while lines:
+                action, metadata = json.loads(lines.pop(0)).items()[0]
+                key = (metadata.get('_type', doctype), metadata['_id'])
+                if action == 'delete':
+                    docs.pop(key, None)
+                    continue
+                source = json.loads(lines.pop(0))
+                if action == 'index' or key not in docs:
+                    docs[key] = source
+            return {'errors': False}
+
+    def documents(self, alias):
+        return sorted(self.indices[self.resolve(alias)])
+
+class Stats(object):
+    def set_value(self, key, value, spider=None):
+        pass
+
+    def get_stats(self, spider=None):
+        return {}
+
+class DuoAllSpider(object):
+    name = 'duo_all'
+    export_names = ['duo_po_branches', 'duo_vo_boards']
+    crawler = type('Crawler', (object,), {'stats': Stats()})
+
+class TestVersionedDuoAll(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.es = FakeElastic()
+        self.get_client = exporters.get_client
+        exporters.get_client = lambda url, **options: self.es
+
+        export_settings = dict(validate=False, geocode=False,
+                               schema=MappingSchema, index='duo')
+        test_settings = {
+            'EXPORT_METHODS': {'elasticsearch': {
+                'exporter': exporters.ElasticSearchExporter,
+                'incremental': True,
+                'options': {'url': 'localhost:9200', 'versioned': True,
+                            'keep_versions': 0}
+            }},
+            'EXPORT_SETTINGS': {
+                'duo_po_branches': dict(export_settings, doctype='po_branch',
+                                        id_fields=['brin', 'branch_id']),
+                'duo_vo_boards': dict(export_settings, doctype='vo_board',
+                                      id_fields=['board_id'])
+            },
+            'EXPORT_MANIFEST_DIR': self.tempdir,
+            'ITEM_STORE': {'store': MemoryItemStore, 'options': {}},
+            'CHECKPOINT_DIR': None,
+            'PIPELINE_REPORT_DIR': None,
+            'GEOCODE_BATCH_SIZE': 100,
+            'EXPORT_QUEUE_SIZE': 10
+        }
+        self.settings = dict((name, settings.get(name))
+                             for name in test_settings)
+        for name, value in test_settings.items():
+            settings.set(name, value, priority='cmdline')
+
+    def tearDown(self):
+        exporters.get_client = self.get_client
+        for name, value in self.settings.items():
+            settings.set(name, value, priority='cmdline')
+        shutil.rmtree(self.tempdir)
+
+    def crawl(self, started_at, items):
+        spider = DuoAllSpider()
+        pipeline = OnderwijsscrapersPipeline()
+        pipeline.scrape_started = started_at
+        pipeline.open_spider(spider)
+        for item in items:
+            pipeline.process_item(dict(item), spider)
+        pipeline.close_spider(spider)
+
+    def test_deletions_of_all_doctypes_are_published_once(self):
+        self.crawl('2013-10-01T00:00:00Z', [
+            {'export_name': 'duo_po_branches', 'brin': '00AA', 'branch_id': 0},
+            {'export_name': 'duo_po_branches', 'brin': '00AB', 'branch_id': 0},
+            {'export_name': 'duo_vo_boards', 'board_id': 1},
+            {'export_name': 'duo_vo_boards', 'board_id': 2}
+        ])
+        self.assertEqual(self.es.swaps, 1)
+
+        # A branch and a board disappeared
+        self.crawl('2013-10-02T00:00:00Z', [
+            {'export_name': 'duo_po_branches', 'brin': '00AA', 'branch_id': 0},
+            {'export_name': 'duo_vo_boards', 'board_id': 2}
+        ])
+        self.assertEqual(self.es.swaps, 2)
+        self.assertEqual(self.es.aliases, {'duo': 'duo_20131002T000000Z'})
+        self.assertEqual(self.es.documents('duo'), [('po_branch', '00AA-0'),
+                                                    ('vo_board', '2')])
+        self.assertEqual(self.es.indices.keys(), ['duo_20131002T000000Z'])
+
+if __name__ == '__main__':
+    unittest.main()
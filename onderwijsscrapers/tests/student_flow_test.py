@@ -0,0 +1,55 @@
+import unittest, sys, os, shutil, tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/..')
+
+from onderwijsscrapers.student_flow import StudentFlowIndex
+
+TABLE = [
+    'DOORSTROMERS VAN PO NAAR VO\n',
+    'BRIN NUMMER PO;VESTIGINGSNUMMER PO;...\n',
+    '00AA;0;School A;Straat;Plaats;10BB;0;School B;Straat;Plaats;12\n',
+    '00AA;0;School A;Straat;Plaats;10CC;1;School C;Straat;Plaats;3\n',
+    '00AB;1;School D;Straat;Plaats;10BB;0;School B;Straat;Plaats;5\n',
+]
+
+class TestStudentFlowIndex(unittest.TestCase):
+    def setUp(self):
+        self.index_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.index_dir)
+
+    def test_both_directions(self):
+        index = StudentFlowIndex.from_table(TABLE)
+
+        out_flow = dict(index.out_flow_per_branch())
+        self.assertEqual(out_flow[('00AA', 0)], [
+            {'to_vo_brin': '10BB', 'to_vo_branch_id': 0, 'out_flow': 12},
+            {'to_vo_brin': '10CC', 'to_vo_branch_id': 1, 'out_flow': 3},
+        ])
+
+        in_flow = dict(index.in_flow_per_branch())
+        self.assertEqual(in_flow[('10BB', 0)], [
+            {'from_po_brin': '00AA', 'from_po_branch_id': 0, 'in_flow': 12},
+            {'from_po_brin': '00AB', 'from_po_branch_id': 1, 'in_flow': 5},
+        ])
+
+    def test_totals(self):
+        index = StudentFlowIndex.from_table(TABLE)
+        self.assertEqual(index.total_out_flow(), {('00AA', 0): 15,
+                                                  ('00AB', 1): 5})
+        self.assertEqual(index.total_in_flow(), {('10BB', 0): 17,
+                                                 ('10CC', 1): 3})
+
+    def test_save_and_load(self):
+        index = StudentFlowIndex.from_table(TABLE)
+        path = os.path.join(self.index_dir, 'flow')
+        index.save(path)
+
+        loaded = StudentFlowIndex.load(path)
+        self.assertEqual(dict(loaded.out_flow_per_branch()),
+                         dict(index.out_flow_per_branch()))
+        self.assertEqual(dict(loaded.in_flow_per_branch()),
+                         dict(index.in_flow_per_branch()))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import unittest, sys, os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/..')
+
+import colander
+from colander import (MappingSchema, SequenceSchema, SchemaNode, String, Int,
+                      Date, Length, Range, Invalid)
+
+from onderwijsscrapers.validation import (validate, accept_utf8_strings,
+                                          error_messages)
+from onderwijsscrapers.validation.compiled import compile_schema
+
+
+class Report(MappingSchema):
+    title = SchemaNode(String(), validator=Length(min=4, max=20))
+    url = SchemaNode(String(), validator=colander.url)
+    publication_date = SchemaNode(Date())
+
+
+class Reports(SequenceSchema):
+    report = Report()
+
+
+class Branch(MappingSchema):
+    brin = SchemaNode(String(), validator=Length(min=4, max=4))
+    branch_id = SchemaNode(Int(), validator=Range(min=0, max=1000))
+    reference_date = SchemaNode(Date(), missing=True)
+    reports = Reports()
+
+
+def branch(**fields):
+    item = {
+        'brin': '00AA',
+        'branch_id': 0,
+        'reference_date': '2013-10-01',
+        'reports': [{'title': 'Rapport \xc3\xa9\xc3\xa9n',
+                     'url': 'http://www.onderwijsinspectie.nl/1',
+                     'publication_date': '2013-01-31'}],
+        'meta': {'scrape_started_at': '2013-10-01T00:00:00Z',
+                 'item_scraped_at': '2013-10-01T00:00:00Z'}
+    }
+    item.update(fields)
+    return item
+
+
+class TestCompiledValidation(unittest.TestCase):
+    def setUp(self):
+        self.schema = Branch()
+        accept_utf8_strings(self.schema)
+        self.check = compile_schema(self.schema)
+
+    def assertSameAsColander(self, item):
+        try:
+            self.schema.deserialize(item)
+            expected = []
+        except Invalid, e:
+            expected = [dict(field=field, message=message)
+                        for field, message in sorted(error_messages(e).items())]
+
+        item, validation = validate(Branch(), 'i', 'd', 'id', item)
+        self.assertEqual(validation['messages'], expected)
+
+    def test_valid_item(self):
+        self.assertEqual(self.check(branch()), [])
+        # Values that were checked before are remembered
+        self.assertEqual(self.check(branch()), [])
+        self.assertSameAsColander(branch())
+
+    def test_invalid_fields(self):
+        item = branch(brin='00A', branch_id='x', reports=[
+            {'title': 'Rapport', 'url': 'geen url',
+             'publication_date': '2013-02-30'}])
+        self.assertEqual([node.name for node in self.check(item)],
+                         ['brin', 'branch_id', 'reports'])
+        self.assertSameAsColander(item)
+
+    def test_missing_fields(self):
+        item = branch()
+        del item['reference_date']
+        del item['brin']
+        self.assertEqual([node.name for node in self.check(item)], ['brin'])
+        self.assertSameAsColander(item)
+
+if __name__ == '__main__':
+    unittest.main()